@@ -0,0 +1,79 @@
+"""Benchmark del motor de alineación contra el camino antiguo (SequenceMatcher).
+
+    python benchmarks/bench_align.py                 # 10k, 30k, 100k palabras
+    python benchmarks/bench_align.py --sizes 5000 --legacy-max 20000
+
+Genera una transcripción sintética (vocabulario tipo Zipf, estribillos
+repetidos) y una letra con ~5% de erratas, inserciones y borrados.
+El camino antiguo es cuadrático: solo se mide hasta --legacy-max palabras.
+"""
+import argparse
+import os
+import random
+import sys
+import time
+from difflib import SequenceMatcher
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from karaoke_align import align, apply_alignment, normalize_tokens
+from karaoke_core import normalize_text
+
+def align_lyrics_legacy(raw, cl):
+    # Camino anterior del botón PROCESAR (SequenceMatcher por palabras)
+    wn = [normalize_text(w['text']) for w in raw]
+    un = [normalize_text(w) for w in cl]
+    sm = SequenceMatcher(None, wn, un)
+    return apply_alignment(raw, cl, sm.get_opcodes())
+
+def synth(n, seed=0, noise=0.05):
+    rnd = random.Random(seed)
+    vocab = [f"pal{k}" for k in range(3000)]
+    weights = [1.0 / (k + 1) for k in range(len(vocab))]
+    chorus = rnd.choices(vocab, weights, k=40)
+    text = []
+    while len(text) < n:
+        text.extend(chorus if rnd.random() < 0.3 else rnd.choices(vocab, weights, k=60))
+    text = text[:n]
+    raw, t = [], 0.0
+    for w in text:
+        d = rnd.uniform(0.15, 0.6)
+        raw.append({'text': ' ' + w, 'start': t, 'end': t + d}); t += d + rnd.uniform(0.0, 0.2)
+    lyrics = []
+    for w in text:
+        r = rnd.random()
+        if r < noise / 3: continue                                  # borrado
+        if r < 2 * noise / 3: lyrics.append(w + "x")                # errata
+        else: lyrics.append(w.capitalize() + ("," if rnd.random() < 0.1 else ""))
+        if rnd.random() < noise / 3: lyrics.append(rnd.choice(vocab))   # inserción
+    return raw, lyrics
+
+def main():
+    ap = argparse.ArgumentParser()
+    ap.add_argument('--sizes', type=int, nargs='+', default=[10000, 30000, 100000])
+    ap.add_argument('--legacy-max', type=int, default=10000)
+    args = ap.parse_args()
+
+    print(f"{'words':>8} {'engine_s':>9} {'legacy_s':>9} {'speedup':>8} {'sim%':>5} {'legacy%':>7} {'same_timing':>11}")
+    for n in args.sizes:
+        raw, lyrics = synth(n)
+        t0 = time.perf_counter()
+        res = align(normalize_tokens(w['text'] for w in raw), normalize_tokens(lyrics))
+        words = apply_alignment(raw, lyrics, res.opcodes)
+        t_new = time.perf_counter() - t0
+
+        t_old = legacy_pct = same = None
+        if n <= args.legacy_max:
+            t0 = time.perf_counter()
+            legacy_pct = int(SequenceMatcher(None, " ".join(normalize_tokens(w['text'] for w in raw)),
+                                             " ".join(normalize_tokens(lyrics))).ratio() * 100)
+            old = align_lyrics_legacy(raw, lyrics)
+            t_old = time.perf_counter() - t0
+            same = sum(1 for x, y in zip(words, old) if x == y) / max(1, len(old))
+
+        fmt = lambda v, f: format(v, f) if v is not None else '-'
+        speed = f"{t_old / t_new:.0f}x" if t_old else '-'
+        print(f"{n:>8} {t_new:>9.3f} {fmt(t_old, '>9.3f'):>9} {speed:>8} {res.percent:>5} {fmt(legacy_pct, 'd'):>7} {fmt(same, '.1%'):>11}")
+
+if __name__ == "__main__":
+    main()
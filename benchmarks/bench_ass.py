@@ -0,0 +1,67 @@
+"""Benchmark de disposición del .ass: por palabra contra por frase (\\k / \\t).
+
+    python benchmarks/bench_ass.py                        # 3 min, 1280x720, clásico/barrido/fade
+    python benchmarks/bench_ass.py --seconds 600 --visible full --no-render
+
+Genera palabras sintéticas (~3 por segundo, con silencios de vez en cuando),
+escribe el .ass en las dos disposiciones y mide líneas, tamaño y tiempo de
+escritura. Con render, quema el .ass con ffmpeg (filtro ass, libass) sobre
+un fondo negro de la misma duración, sin codificar, y da los fps del filtro.
+"""
+import argparse
+import os
+import random
+import subprocess
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from karaoke_core import FFMPEG_EXE, VISIBLE_KEYS
+from karaoke_pipeline import StyleConfig, write_ass
+from karaoke_render import ass_filter_path
+from karaoke_track import WordTrack
+
+def synth(seconds, seed=0):
+    rnd = random.Random(seed)
+    words, t = [], 0.5
+    while t < seconds - 1:
+        d = rnd.uniform(0.15, 0.5)
+        words.append({'text': f"pal{rnd.randrange(500)}", 'start': t, 'end': t + d})
+        t += d + (rnd.uniform(1.5, 3.0) if rnd.random() < 0.03 else rnd.uniform(0.0, 0.1))
+    return WordTrack.from_dicts(words)
+
+def render_fps(ass, seconds, size, fps=30):
+    cmd = [FFMPEG_EXE, "-v", "error", "-f", "lavfi", "-i", f"color=black:s={size}:d={seconds}:r={fps}",
+           "-vf", f"ass={ass_filter_path(ass)}", "-f", "null", "-"]
+    t = time.perf_counter()
+    subprocess.run(cmd, check=True)
+    return seconds * fps / (time.perf_counter() - t)
+
+def main():
+    ap = argparse.ArgumentParser()
+    ap.add_argument('--seconds', type=float, default=180)
+    ap.add_argument('--size', default='1280x720')
+    ap.add_argument('--visible', default='balanced', choices=VISIBLE_KEYS)
+    ap.add_argument('--effects', nargs='+', default=['fx_color', 'fx_wipe', 'fx_fade'])
+    ap.add_argument('--no-render', action='store_true')
+    args = ap.parse_args()
+
+    words = synth(args.seconds)
+    size = tuple(int(v) for v in args.size.split('x'))
+    print(f"{len(words)} palabras, {args.seconds:.0f} s, ventana '{args.visible}'")
+    with tempfile.TemporaryDirectory() as d:
+        print(f"{'efecto':>9} {'modo':>7} {'líneas':>8} {'KB':>9} {'escribir (s)':>13} {'render fps':>11}")
+        for eff in args.effects:
+            for layout in ('word', 'phrase'):
+                path = os.path.join(d, f"{eff}_{layout}.ass")
+                t = time.perf_counter()
+                write_ass(path, words, StyleConfig(effect=eff, visible=args.visible, layout=layout), size)
+                dt = time.perf_counter() - t
+                with open(path, encoding='utf-8') as f: lines = sum(1 for l in f if l.startswith('Dialogue'))
+                fps = '-' if args.no_render else f"{render_fps(path, args.seconds, args.size):.0f}"
+                print(f"{eff:>9} {layout:>7} {lines:8d} {os.path.getsize(path) / 1024:9.1f} {dt:13.3f} {fps:>11}")
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,92 @@
+"""Benchmark del compositor de Pillow contra el quemado con libass (filtro ass).
+
+    python benchmarks/bench_compositor.py                          # 120 s 1280x720, 1/2/4 procesos
+    python benchmarks/bench_compositor.py --seconds 300 --workers 4 8 --effect fx_wipe --layout phrase
+
+Genera un video de prueba (testsrc2 + tono, keyframe cada 2 s) y una letra
+sintética. Primero mide solo la composición en Python (sin ffmpeg): frames
+por segundo con rectángulos sucios contra redibujar el lienzo entero en cada
+frame, píxeles tocados y aciertos del atlas. Después quema el video completo
+con libass y con el compositor para cada número de procesos y da el tiempo
+de pared y el PSNR medio frente a la salida de libass (el rasterizado no es
+el mismo, así que solo indica que la letra sale en el mismo sitio y momento).
+"""
+import argparse
+import os
+import re
+import subprocess
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from bench_render import synth_video, synth_words
+from karaoke_core import FFMPEG_EXE
+from karaoke_ass import AssStyle, write_ass
+from karaoke_compositor import FrameCompositor, render_composited
+from karaoke_pipeline import StyleConfig
+from karaoke_render import render_segments, render_single
+
+def psnr(a, b):
+    txt = subprocess.run([FFMPEG_EXE, "-i", a, "-i", b, "-lavfi", "psnr", "-f", "null", "-"], capture_output=True).stderr.decode('utf-8', 'replace')
+    m = re.search(r'average:(\S+)', txt)
+    return m.group(1) if m else '?'
+
+def compose_only(words, style, seconds, fps, full):
+    comp = FrameCompositor(words, style)
+    n = int(seconds * fps)
+    t = time.perf_counter()
+    for k in range(n):
+        if full:
+            # Sin rectángulos sucios: lienzo vacío y todas las palabras otra vez
+            comp.canvas[:] = 0
+            comp.drawn = {}
+        comp.advance(k / fps)
+    return n / (time.perf_counter() - t), comp.stats()
+
+def main():
+    ap = argparse.ArgumentParser()
+    ap.add_argument('--seconds', type=float, default=120)
+    ap.add_argument('--size', default='1280x720')
+    ap.add_argument('--fps', type=int, default=30)
+    ap.add_argument('--workers', type=int, nargs='+', default=[1, 2, 4])
+    ap.add_argument('--effect', default='fx_color', choices=['fx_color', 'fx_box', 'fx_wipe', 'fx_fade'])
+    ap.add_argument('--layout', default='word')
+    args = ap.parse_args()
+
+    w, h = (int(v) for v in args.size.split('x'))
+    words = synth_words(args.seconds)
+    style = AssStyle.from_config(StyleConfig(effect=args.effect, layout=args.layout), (w, h))
+    print(f"{os.cpu_count()} CPUs, {args.seconds:.0f} s {args.size}, {len(words)} palabras, {args.effect}/{args.layout}")
+
+    print(f"{'composición':>12} {'fps':>8} {'píxeles tocados':>16} {'atlas':>7}")
+    for full in (True, False):
+        fps, st = compose_only(words, style, args.seconds, args.fps, full)
+        hits = st['atlas_hits'] / max(1, st['atlas_hits'] + st['atlas_misses'])
+        print(f"{'completa' if full else 'sucios':>12} {fps:8.0f} {st['dirty_px'] / st['pixels']:16.2%} {hits:7.1%}")
+
+    with tempfile.TemporaryDirectory() as d:
+        src, ass = os.path.join(d, 'in.mp4'), os.path.join(d, 'subs.ass')
+        synth_video(src, args.seconds, args.size, args.fps)
+        write_ass(ass, words, style)
+        print(f"{'backend':>8} {'procesos':>9} {'tiempo (s)':>11} {'fps':>7} {'PSNR dB':>8}")
+        frames = args.seconds * args.fps
+        ref = None
+        for workers in args.workers:
+            out = os.path.join(d, f'ass_{workers}.mp4')
+            t = time.perf_counter()
+            if workers == 1 or render_segments(src, ass, out, workers=workers, log=lambda m: None) is None:
+                render_single(src, ass, out)
+            dt = time.perf_counter() - t
+            ref = ref or out
+            print(f"{'libass':>8} {workers:9d} {dt:11.2f} {frames / dt:7.0f} {'ref' if out == ref else psnr(ref, out):>8}")
+        for workers in args.workers:
+            out = os.path.join(d, f'pil_{workers}.mp4')
+            t = time.perf_counter()
+            render_composited(src, words, style, out, workers=workers, log=lambda m: None)
+            dt = time.perf_counter() - t
+            print(f"{'pillow':>8} {workers:9d} {dt:11.2f} {frames / dt:7.0f} {psnr(ref, out):>8}")
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,103 @@
+"""Benchmark del archivo de proyecto: abrir, guardar una edición y compactar.
+
+    python benchmarks/bench_project.py                    # 3 h de audio, 200 ediciones en el diario
+    python benchmarks/bench_project.py --hours 6 --edits 1000
+
+Genera una pista sintética (~3 palabras por segundo, transcript crudo
+igual de largo), una pirámide de picos del tamaño que tendría el audio a
+44.1 kHz y onsets cada 0.3 s. Mide escribir el .smproj, abrirlo (memmap),
+guardar una palabra movida (un registro del diario), abrirlo con el diario
+lleno y compactarlo. Como referencia, lo mismo guardado como JSON de dicts
+más un .npz con los picos, que hay que leer entero para abrir.
+"""
+import argparse
+import json
+import os
+import random
+import sys
+import tempfile
+import time
+
+import numpy as np
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from karaoke_media import PLAYBACK_RATE, PEAK_BASE, PeakPyramid
+from karaoke_onsets import OnsetIndex
+from karaoke_project import Project, write_project, video_ref
+
+def synth_words(seconds, seed=0):
+    rnd = random.Random(seed)
+    words, t = [], 0.3
+    while t < seconds - 1:
+        d = rnd.uniform(0.15, 0.5)
+        words.append({'text': f"pal{rnd.randrange(500)}", 'start': t, 'end': t + d})
+        t += d + rnd.uniform(0.0, 0.15)
+    return words
+
+def synth_peaks(seconds):
+    # Con base=1 cada "frame" es un grupo: misma forma que la pirámide del audio real
+    bins = int(seconds * PLAYBACK_RATE / PEAK_BASE)
+    pcm = np.random.default_rng(0).integers(-20000, 20000, size=(bins, 2), dtype=np.int16)
+    return PeakPyramid(PeakPyramid.build(pcm, PLAYBACK_RATE, base=1).levels, PLAYBACK_RATE, PEAK_BASE)
+
+def timed(fn):
+    t = time.perf_counter()
+    out = fn()
+    return out, time.perf_counter() - t
+
+def main():
+    ap = argparse.ArgumentParser()
+    ap.add_argument('--hours', type=float, default=3)
+    ap.add_argument('--edits', type=int, default=200)
+    args = ap.parse_args()
+
+    seconds = args.hours * 3600
+    words = synth_words(seconds)
+    raw = [dict(w, text=' ' + w['text']) for w in words]
+    peaks = synth_peaks(seconds)
+    onsets = OnsetIndex(np.arange(0.0, seconds, 0.3), np.arange(0.0, seconds, 0.5), 120.0)
+    print(f"{args.hours:g} h, {len(words)} palabras, picos {sum(mn.nbytes * 2 for mn, _ in peaks.levels) / 2**20:.0f} MB")
+
+    with tempfile.TemporaryDirectory() as d:
+        video = os.path.join(d, 'video.mp4')
+        open(video, 'wb').close()
+        path = os.path.join(d, 'p.smproj')
+        _, t_write = timed(lambda: write_project(path, video_ref(video, path), words, raw, {'effect': 'fx_color'}, {}, peaks, onsets))
+        size = os.path.getsize(path)
+        proj, t_open = timed(lambda: Project(path))
+
+        rnd = random.Random(1)
+        cur = proj.words.to_dicts()
+        t_edit = 0.0
+        for _ in range(args.edits):
+            k = rnd.randrange(len(cur))
+            cur[k] = dict(cur[k], start=cur[k]['start'] + 0.01)
+            _, dt = timed(lambda: proj.set_words(cur))
+            t_edit += dt
+        journal = proj.journal_bytes
+        reopened, t_replay = timed(lambda: Project(path))
+        ok = reopened.words.to_dicts() == cur
+        _, t_compact = timed(proj.compact)
+
+        # Referencia: JSON de dicts + .npz, todo leído al abrir
+        ref_json, ref_npz = os.path.join(d, 'ref.json'), os.path.join(d, 'ref.npz')
+        def ref_write():
+            with open(ref_json, 'w', encoding='utf-8') as f: json.dump({'words': words, 'raw': raw, 'style': {}}, f)
+            np.savez(ref_npz, onsets=onsets.onsets, beats=onsets.beats,
+                     **{f'min{k}': mn for k, (mn, _) in enumerate(peaks.levels)}, **{f'max{k}': mx for k, (_, mx) in enumerate(peaks.levels)})
+        def ref_open():
+            with open(ref_json, encoding='utf-8') as f: json.load(f)
+            with np.load(ref_npz) as z: return {k: z[k] for k in z.files}
+        _, t_ref_write = timed(ref_write)
+        _, t_ref_open = timed(ref_open)
+        ref_size = os.path.getsize(ref_json) + os.path.getsize(ref_npz)
+
+        print(f"{'formato':>10} {'MB':>7} {'escribir (s)':>13} {'abrir (s)':>10}")
+        print(f"{'smproj':>10} {size / 2**20:7.1f} {t_write:13.3f} {t_open:10.3f}")
+        print(f"{'json+npz':>10} {ref_size / 2**20:7.1f} {t_ref_write:13.3f} {t_ref_open:10.3f}")
+        print(f"{args.edits} ediciones: {t_edit / max(1, args.edits) * 1000:.1f} ms por guardado, diario {journal / 1024:.0f} KB, "
+              f"abrir con diario {t_replay:.3f} s ({'ok' if ok else 'DISTINTO'}), compactar {t_compact:.2f} s")
+
+if __name__ == '__main__':
+    main()
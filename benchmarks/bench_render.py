@@ -0,0 +1,102 @@
+"""Benchmark del render: un solo ffmpeg contra segmentos en paralelo.
+
+    python benchmarks/bench_render.py                         # 180 s 1280x720, 1/2/4 procesos
+    python benchmarks/bench_render.py --seconds 600 --workers 8 16 --effect fx_wipe
+
+Genera un video de prueba (testsrc2 + tono, keyframe cada 2 s) y una letra
+sintética, escribe el .ass y lo quema con render_video (camino de siempre)
+y con render_segments. Mide el tiempo de pared y compara la salida con la
+del camino de un proceso: número de frames, duración y PSNR medio (x264 no
+da bits idénticos con otros cortes de GOP, pero la imagen debe coincidir).
+Al final mide el retoque: render con caché en frío, se mueve una palabra
+a mitad del video y se vuelve a renderizar (solo su segmento se recodifica).
+"""
+import argparse
+import os
+import random
+import re
+import subprocess
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from karaoke_core import FFMPEG_EXE
+from karaoke_pipeline import RenderConfig, StyleConfig, render_video, write_ass
+from karaoke_render import RenderCache, render_segments
+from karaoke_track import WordTrack
+
+def synth_video(path, seconds, size, fps=30, gop=60):
+    cmd = [FFMPEG_EXE, "-v", "error", "-f", "lavfi", "-i", f"testsrc2=s={size}:r={fps}:d={seconds}",
+           "-f", "lavfi", "-i", f"sine=frequency=440:duration={seconds}",
+           "-c:v", "libx264", "-preset", "ultrafast", "-g", str(gop), "-c:a", "aac", "-shortest", "-y", path]
+    subprocess.run(cmd, check=True)
+
+def synth_words(seconds, seed=0):
+    rnd = random.Random(seed)
+    words, t = [], 0.3
+    while t < seconds - 1:
+        d = rnd.uniform(0.15, 0.5)
+        words.append({'text': f"pal{rnd.randrange(500)}", 'start': t, 'end': t + d})
+        t += d + rnd.uniform(0.0, 0.15)
+    return WordTrack.from_dicts(words)
+
+def frame_count(path):
+    txt = subprocess.run([FFMPEG_EXE, "-i", path, "-map", "0:v:0", "-f", "null", "-"], capture_output=True).stderr.decode('utf-8', 'replace')
+    return int(re.findall(r'frame=\s*(\d+)', txt)[-1])
+
+def psnr(a, b):
+    txt = subprocess.run([FFMPEG_EXE, "-i", a, "-i", b, "-lavfi", "psnr", "-f", "null", "-"], capture_output=True).stderr.decode('utf-8', 'replace')
+    m = re.search(r'average:(\S+)', txt)
+    return m.group(1) if m else '?'
+
+def main():
+    ap = argparse.ArgumentParser()
+    ap.add_argument('--seconds', type=float, default=180)
+    ap.add_argument('--size', default='1280x720')
+    ap.add_argument('--workers', type=int, nargs='+', default=[2, 4])
+    ap.add_argument('--effect', default='fx_color')
+    ap.add_argument('--layout', default='word')
+    args = ap.parse_args()
+
+    with tempfile.TemporaryDirectory() as d:
+        src, ass = os.path.join(d, 'in.mp4'), os.path.join(d, 'subs.ass')
+        synth_video(src, args.seconds, args.size)
+        w, h = (int(v) for v in args.size.split('x'))
+        words = synth_words(args.seconds)
+        style = StyleConfig(effect=args.effect, layout=args.layout)
+        write_ass(ass, words, style, (w, h))
+
+        ref = os.path.join(d, 'single.mp4')
+        t = time.perf_counter()
+        render_video(src, ass, ref, RenderConfig())
+        base = time.perf_counter() - t
+        n_ref = frame_count(ref)
+        print(f"{os.cpu_count()} CPUs, {args.seconds:.0f} s {args.size}")
+        print(f"{'procesos':>9} {'tiempo (s)':>11} {'speedup':>8} {'frames':>7} {'PSNR dB':>8}")
+        print(f"{1:9d} {base:11.2f} {1.0:8.2f} {n_ref:7d} {'ref':>8}")
+        for workers in args.workers:
+            out = os.path.join(d, f'seg_{workers}.mp4')
+            t = time.perf_counter()
+            render_segments(src, ass, out, workers=workers, log=lambda m: None)
+            dt = time.perf_counter() - t
+            n = frame_count(out)
+            print(f"{workers:9d} {dt:11.2f} {base / dt:8.2f} {n:7d}{'' if n == n_ref else '!'} {psnr(ref, out):>8}")
+
+        cache = RenderCache(os.path.join(d, 'cache'))
+        workers = max(args.workers)
+        t = time.perf_counter()
+        render_segments(src, ass, os.path.join(d, 'cold.mp4'), workers=workers, cache=cache, log=lambda m: None)
+        cold = time.perf_counter() - t
+        moved = words.to_dicts()
+        moved[len(moved) // 2]['start'] += 0.05
+        write_ass(ass, WordTrack.from_dicts(moved), style, (w, h))
+        msgs = []
+        t = time.perf_counter()
+        render_segments(src, ass, os.path.join(d, 'touch.mp4'), workers=workers, cache=cache, log=msgs.append)
+        touch = time.perf_counter() - t
+        print(f"caché: en frío {cold:.2f} s, retoque de una palabra {touch:.2f} s ({msgs[-1]})")
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,76 @@
+"""Benchmark de quitar voz por bloques: muestras/s y memoria pico.
+
+    python benchmarks/bench_vocals.py                   # 60 s y 600 s, ambos modos
+    python benchmarks/bench_vocals.py --seconds 1800 --modes spectral
+
+Genera un estéreo sintético (voz centrada + instrumentos paneados) en un
+memmap temporal, como el WAV del servicio de audio, y compara con el camino
+antiguo (todo el array en RAM, pico global, column_stack). La memoria pico
+se mide con tracemalloc (numpy registra sus buffers) y debe quedar plana
+al crecer la duración; la del camino antiguo crece con ella.
+"""
+import argparse
+import os
+import sys
+import tempfile
+import time
+import tracemalloc
+
+import numpy as np
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from karaoke_media import PLAYBACK_RATE
+from karaoke_vocals import MODES, remove_vocals
+
+def synth(path, seconds, rate=PLAYBACK_RATE, block=1 << 20):
+    n = int(seconds * rate)
+    pcm = np.memmap(path, dtype=np.int16, mode='w+', shape=(n, 2))
+    rnd = np.random.default_rng(0)
+    for a in range(0, n, block):
+        t = np.arange(a, min(n, a + block)) / rate
+        voice = 7000 * np.sin(2 * np.pi * 220 * t) * (1 + 0.3 * np.sin(2 * np.pi * 5 * t))
+        gtr = 5000 * np.sin(2 * np.pi * 330 * t)
+        noise = rnd.normal(0, 600, (len(t), 2))
+        pcm[a:a + len(t), 0] = np.clip(voice + gtr + noise[:, 0], -32768, 32767)
+        pcm[a:a + len(t), 1] = np.clip(voice + 0.3 * gtr + noise[:, 1], -32768, 32767)
+    pcm.flush()
+    return np.memmap(path, dtype=np.int16, mode='r', shape=(n, 2))
+
+def legacy(pcm):
+    # Camino anterior de _voc_thread
+    data = np.array(pcm)
+    inst = (data[:, 0].astype(np.float32) - data[:, 1]) / 2
+    m = np.max(np.abs(inst))
+    if m > 0: inst = np.int16(inst / m * 32767 * 0.8)
+    return np.column_stack((inst, inst))
+
+def measure(fn):
+    tracemalloc.start()
+    t = time.perf_counter()
+    fn()
+    dt = time.perf_counter() - t
+    peak = tracemalloc.get_traced_memory()[1]
+    tracemalloc.stop()
+    return dt, peak
+
+def main():
+    ap = argparse.ArgumentParser()
+    ap.add_argument('--seconds', type=float, nargs='+', default=[60, 600])
+    ap.add_argument('--modes', nargs='+', default=list(MODES) + ['legacy'])
+    args = ap.parse_args()
+
+    with tempfile.TemporaryDirectory() as d:
+        print(f"{'dur (s)':>8} {'modo':>9} {'tiempo (s)':>11} {'Msamples/s':>11} {'x realtime':>11} {'pico MB':>9}")
+        for secs in args.seconds:
+            pcm = synth(os.path.join(d, 'in.pcm'), secs)
+            n = len(pcm)
+            for mode in args.modes:
+                out = os.path.join(d, 'out.pcm')
+                if mode == 'legacy': dt, peak = measure(lambda: legacy(pcm))
+                else: dt, peak = measure(lambda: remove_vocals(pcm, out, mode))
+                print(f"{secs:8.0f} {mode:>9} {dt:11.2f} {n / dt / 1e6:11.2f} {secs / dt:11.1f} {peak / 2**20:9.1f}")
+            del pcm
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,206 @@
+from bisect import bisect_left, bisect_right
+from collections import Counter
+from difflib import SequenceMatcher
+
+from karaoke_core import normalize_text
+
+# --- MOTOR DE ALINEACIÓN LETRA <-> TRANSCRIPCIÓN ---
+# Sustituye las dos pasadas de SequenceMatcher (una por caracteres, cuadrática,
+# y otra por palabras) por una sola pasada por palabras:
+#   1. prefijos/sufijos comunes fuera,
+#   2. anclas = palabras únicas en ambos lados, ordenadas con LIS (patience diff),
+#   3. recursión en los huecos entre anclas,
+#   4. huecos sin anclas: SequenceMatcher si son pequeños, DP en banda si no.
+# Con texto que casi coincide el coste es casi lineal. El porcentaje de
+# parecido sale de la misma alineación.
+
+SMALL_GAP = 40000     # celdas (n*m) por debajo de las cuales basta SequenceMatcher
+BAND = 48             # semiancho extra de la banda diagonal en huecos grandes
+
+def normalize_tokens(words):
+    return [normalize_text(w) for w in words]
+
+def _lis(pairs):
+    # Subsecuencia creciente más larga por la segunda coordenada (patience sorting)
+    tails, tails_idx, prev = [], [], [None] * len(pairs)
+    for k, (_, j) in enumerate(pairs):
+        pos = bisect_left(tails, j)
+        if pos == len(tails): tails.append(j); tails_idx.append(k)
+        else: tails[pos] = j; tails_idx[pos] = k
+        prev[k] = tails_idx[pos - 1] if pos else None
+    out, k = [], tails_idx[-1] if tails_idx else None
+    while k is not None:
+        out.append(pairs[k]); k = prev[k]
+    return out[::-1]
+
+def _unique_anchors(a, alo, ahi, b, blo, bhi):
+    ca, cb = Counter(a[alo:ahi]), Counter(b[blo:bhi])
+    pos_b = {b[j]: j for j in range(blo, bhi) if cb[b[j]] == 1 and ca[b[j]] == 1}
+    if not pos_b: return []
+    pairs = [(i, pos_b[a[i]]) for i in range(alo, ahi) if a[i] in pos_b]
+    return _lis(pairs)
+
+def _banded_lcs(a, alo, ahi, b, blo, bhi, out):
+    # LCS limitado a una banda alrededor de la diagonal: O(n * banda)
+    n, m = ahi - alo, bhi - blo
+    k = abs(n - m) + BAND
+    def band(i):
+        c = (i * m) // n
+        return max(0, c - k), min(m, c + k)
+
+    UP, LEFT, DIAG = 0, 1, 2
+    prev_lo, prev_hi = band(0)
+    prev = [0] * (prev_hi - prev_lo + 1)
+    moves = []
+    for i in range(1, n + 1):
+        lo, hi = band(i)
+        row = [-1] * (hi - lo + 1)
+        mv = bytearray(hi - lo + 1)
+        ai = a[alo + i - 1]
+        for j in range(lo, hi + 1):
+            best, d = -1, UP
+            if prev_lo <= j <= prev_hi: best = prev[j - prev_lo]
+            if j == 0: best = max(best, 0)
+            if j > lo and row[j - 1 - lo] > best: best, d = row[j - 1 - lo], LEFT
+            if j > 0 and prev_lo <= j - 1 <= prev_hi and ai == b[blo + j - 1]:
+                diag = prev[j - 1 - prev_lo] + 1
+                if diag > best: best, d = diag, DIAG
+            row[j - lo] = best; mv[j - lo] = d
+        moves.append((lo, mv))
+        prev, prev_lo, prev_hi = row, lo, hi
+
+    i, j = n, m
+    while i > 0 and j > 0:
+        lo, mv = moves[i - 1]
+        d = mv[j - lo]
+        if d == DIAG: out.append((alo + i - 1, blo + j - 1)); i -= 1; j -= 1
+        elif d == LEFT: j -= 1
+        else: i -= 1
+
+def match_pairs(a, b):
+    """Pares (i, j) de palabras iguales, crecientes en i y en j."""
+    out = []
+    stack = [(0, len(a), 0, len(b))]
+    while stack:
+        alo, ahi, blo, bhi = stack.pop()
+        while alo < ahi and blo < bhi and a[alo] == b[blo]:
+            out.append((alo, blo)); alo += 1; blo += 1
+        while alo < ahi and blo < bhi and a[ahi - 1] == b[bhi - 1]:
+            ahi -= 1; bhi -= 1; out.append((ahi, bhi))
+        if alo >= ahi or blo >= bhi: continue
+
+        anchors = _unique_anchors(a, alo, ahi, b, blo, bhi)
+        if anchors:
+            pi, pj = alo, blo
+            for i, j in anchors:
+                out.append((i, j))
+                stack.append((pi, i, pj, j))
+                pi, pj = i + 1, j + 1
+            stack.append((pi, ahi, pj, bhi))
+        elif (ahi - alo) * (bhi - blo) <= SMALL_GAP:
+            sm = SequenceMatcher(None, a[alo:ahi], b[blo:bhi], autojunk=False)
+            for x, y, size in sm.get_matching_blocks():
+                out.extend((alo + x + k, blo + y + k) for k in range(size))
+        else:
+            _banded_lcs(a, alo, ahi, b, blo, bhi, out)
+    out.sort()
+    return out
+
+def pairs_to_opcodes(pairs, n, m):
+    # Mismo formato que SequenceMatcher.get_opcodes()
+    ops = []
+    i = j = 0
+    k = 0
+    while k <= len(pairs):
+        pi, pj = pairs[k] if k < len(pairs) else (n, m)
+        if i < pi and j < pj: ops.append(('replace', i, pi, j, pj))
+        elif i < pi: ops.append(('delete', i, pi, j, j))
+        elif j < pj: ops.append(('insert', i, i, j, pj))
+        if k == len(pairs): break
+        run = 1
+        while k + run < len(pairs) and pairs[k + run] == (pi + run, pj + run): run += 1
+        ops.append(('equal', pi, pi + run, pj, pj + run))
+        i, j, k = pi + run, pj + run, k + run
+    return ops
+
+class Alignment:
+    def __init__(self, a, b):
+        self.a, self.b = a, b
+        self.opcodes = pairs_to_opcodes(match_pairs(a, b), len(a), len(b))
+        self.ratio = self._ratio()
+
+    def _ratio(self):
+        # Equivalente por caracteres del ratio de SequenceMatcher sobre los textos
+        # unidos: palabras iguales cuentan entero, las sustituidas por letras comunes
+        total = sum(map(len, self.a)) + sum(map(len, self.b)) + max(0, len(self.a) - 1) + max(0, len(self.b) - 1)
+        if total == 0: return 1.0
+        matched = 0
+        for tag, i1, i2, j1, j2 in self.opcodes:
+            if tag == 'equal':
+                matched += sum(len(self.a[i]) + 1 for i in range(i1, i2))
+            elif tag == 'replace':
+                for k in range(min(i2 - i1, j2 - j1)):
+                    matched += sum((Counter(self.a[i1 + k]) & Counter(self.b[j1 + k])).values())
+        return min(1.0, 2.0 * matched / total)
+
+    @property
+    def percent(self): return int(self.ratio * 100)
+
+def align(raw_norm, user_norm):
+    return Alignment(raw_norm, user_norm)
+
+def apply_alignment(raw, tokens, opcodes, start=0.0):
+    # Semántica de tiempos de siempre: equal copia, replace reparte, insert +0.5 s, delete se omite
+    fin = []
+    for tag, i1, i2, j1, j2 in opcodes:
+        if tag == 'equal':
+            for k in range(j2-j1): fin.append({'text': tokens[j1+k], 'start': raw[i1+k]['start'], 'end': raw[i1+k]['end']})
+        elif tag == 'replace':
+            if i2 > i1:
+                st, en = raw[i1]['start'], raw[i2-1]['end']
+                dur = (en-st)/(j2-j1)
+                for k in range(j2-j1): fin.append({'text': tokens[j1+k], 'start': st+k*dur, 'end': st+(k+1)*dur})
+        elif tag == 'insert':
+            le = fin[-1]['end'] if fin else start
+            for k in range(j2-j1): fin.append({'text': tokens[j1+k], 'start': le, 'end': le+0.5}); le+=0.5
+    return fin
+
+# --- RE-ALINEACIÓN INCREMENTAL ---
+# Al corregir una errata en la letra no se rehace todo: se compara la letra
+# nueva con las palabras actuales (que pueden tener tiempos retocados a mano),
+# las que siguen iguales conservan sus tiempos y solo los tramos cambiados se
+# vuelven a alinear contra la parte de la transcripción cruda que cae entre
+# las palabras vecinas que no cambiaron.
+
+def _place_range(raw, raw_starts, tokens, norm, t0, t1):
+    # Palabras crudas cuyo centro cae en el hueco [t0, t1]
+    lo, hi = bisect_left(raw_starts, t0 - 1.0), bisect_right(raw_starts, t1 + 1.0)
+    seg = [w for w in raw[lo:hi] if t0 <= (w['start'] + w['end']) / 2 <= t1]
+    if seg:
+        sub = align(normalize_tokens(w['text'] for w in seg), norm)
+        return apply_alignment(seg, tokens, sub.opcodes, start=t0)
+    # Sin audio reconocido en el hueco: reparto uniforme (o 0.5 s por palabra si no hay hueco)
+    n = len(tokens)
+    dur = (t1 - t0) / n if t1 - t0 >= 0.1 * n else 0.5
+    return [{'text': tokens[k], 'start': t0 + k * dur, 'end': t0 + (k + 1) * dur} for k in range(n)]
+
+def realign(words, new_tokens, raw):
+    """Devuelve (palabras, nº de palabras re-alineadas, % de parecido con lo anterior)."""
+    cur = normalize_tokens(w['text'] for w in words)
+    new = normalize_tokens(new_tokens)
+    res = align(cur, new)
+    raw_starts = [w['start'] for w in raw]
+    raw_end = raw[-1]['end'] if raw else 0.0
+    out, changed = [], 0
+    for tag, i1, i2, j1, j2 in res.opcodes:
+        if tag == 'equal':
+            # Se conservan los tiempos actuales (retoques manuales incluidos)
+            for k in range(i2 - i1):
+                w = words[i1 + k]
+                out.append({'text': new_tokens[j1 + k], 'start': w['start'], 'end': w['end']})
+        elif tag in ('replace', 'insert'):
+            t0 = out[-1]['end'] if out else 0.0
+            t1 = words[i2]['start'] if i2 < len(words) else max(raw_end, t0)
+            out.extend(_place_range(raw, raw_starts, new_tokens[j1:j2], new[j1:j2], t0, t1))
+            changed += j2 - j1
+    return out, changed, res.percent
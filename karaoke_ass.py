@@ -0,0 +1,255 @@
+import random
+from dataclasses import dataclass
+from itertools import islice
+
+import numpy as np
+
+from karaoke_core import EFFECT_KEYS, VISIBLE_WINDOWS
+from karaoke_track import word_columns
+
+# --- MOTOR ASS ---
+# Generación de subtítulos .ass sin Tk y sin estado compartido: recibe una
+# foto inmutable del estilo (AssStyle), toma la etiqueta de la palabra activa
+# de una tabla de plantillas ya compilada para ese estilo y arma cada línea
+# con joins sobre segmentos precalculados por palabra. Los eventos salen de un
+# generador y se escriben con un buffer grande, así se puede llamar desde
+# cualquier hilo y la memoria no crece con el número de palabras.
+#
+# Dos disposiciones:
+#   'word'   : una línea por palabra con la ventana visible entera (lo de siempre).
+#   'phrase' : una línea por frase; el resaltado de cada palabra va dentro con
+#              \t (clásico, fade) o \k/\kf (barrido). El .ass ocupa ~ventana
+#              veces menos y libass maqueta una línea por frase, no por palabra.
+#              La frase es un bloque fijo de palabras (no una ventana que se
+#              desliza) y se corta en los silencios largos.
+
+WRITE_BUFFER = 1 << 20
+TIME_BLOCK = 1 << 16     # eventos por bloque al formatear tiempos
+
+LAYOUTS = ('word', 'phrase')
+PHRASE_EFFECTS = ('fx_color', 'fx_box', 'fx_wipe', 'fx_fade')   # el resto sigue por palabra
+PHRASE_GAP = 1.0         # silencio (s) que corta una frase
+FADE_MS = 100
+
+# Etiqueta de la palabra activa por efecto. {act}: color activo, {cx}: centro X,
+# {ty}/{ty50}: altura del texto. fx_wipe lleva además {kf} por palabra.
+ACTIVE_TEMPLATES = {
+    'fx_pop': "{{\\fscx50\\fscy50\\t(0,100,\\fscx120\\fscy120)\\1c{act}}}",
+    'fx_shake': "{{\\t(0,50,\\frz5)\\t(50,100,\\frz-5)\\t(100,150,\\frz0)\\1c{act}}}",
+    'fx_glitch': "{{\\t(0,50,\\fscx110\\3c&H0000FF&)\\t(50,100,\\fscx100\\3c&H000000&)\\1c{act}}}",
+    'fx_slide': "{{\\move({cx},{ty50},{cx},{ty})\\1c{act}}}",
+    'fx_neon': "{{\\bord5\\3c{act}\\blur3\\1c&HFFFFFF&}}",
+    'fx_type': "{{\\alpha&H00&}}",
+    'fx_wipe': "{{\\kf{{kf}} \\1c{act}}}",
+    'fx_bounce': "{{\\t(0,150,\\fscy150)\\t(150,300,\\fscy100)\\1c{act}}}",
+    'fx_fade': "{{\\fad(100,100)\\1c{act}}}",
+    'fx_pulse': "{{\\t(0,100,\\fscx110\\fscy110)\\t(100,200,\\fscx100\\fscy100)\\1c{act}}}",
+    'fx_zoom': "{{\\t(0,100,\\fscx130\\fscy130)\\1c{act}}}",
+}
+DEFAULT_ACTIVE = "{{\\1c{act}}}"
+
+def ass_color(c):
+    h = c.lstrip('#')
+    return f"&H00{h[4:6]}{h[2:4]}{h[0:2]}"
+
+def ass_time(s):
+    if 0 <= s < 3600:
+        # Caso normal sin horas (divmod(s, 3600) sería (0, s) exacto): mismo texto, la mitad de coste
+        m, sec = divmod(s, 60)
+        return "0:%02d:%05.2f" % (m, sec)
+    h, r = divmod(s, 3600); m, s = divmod(r, 60)
+    return f"{int(h)}:{int(m):02d}:{s:05.2f}"
+
+def ass_times(values):
+    """ass_time() para muchos valores a la vez, con el mismo texto exacto.
+
+    fmod es exacto, así que H/M/S salen igual que con divmod; los centésimos
+    se redondean en float salvo los casos a un pelo del empate, que (como los
+    negativos) pasan por ass_time. Los dígitos se arman como bytes en numpy,
+    un grupo por número de cifras de la hora.
+    """
+    t = np.asarray(values, dtype=np.float64)
+    out = [None] * len(t)
+    if not len(t): return out
+    sec = np.fmod(t, 60.0)
+    h, m = np.divmod((t - sec) / 60.0, 60.0)
+    x = sec * 100.0
+    slow = (t < 0) | (t >= 1e9) | ~np.isfinite(t) | (np.abs(x - np.floor(x) - 0.5) < 1e-6)
+    ok = ~slow
+    hi = np.where(ok, h, 0).astype(np.int64)
+    mi = np.where(ok, m, 0).astype(np.int64)
+    cs = np.where(ok, np.rint(x), 0).astype(np.int64)
+    width = np.where(hi >= 10, np.floor(np.log10(np.maximum(hi, 1))).astype(np.int64) + 1, 1)
+    for k in np.unique(width[ok]).tolist():
+        sel = np.flatnonzero(ok & (width == k))
+        hk, mk, ck = hi[sel], mi[sel], cs[sel]
+        d = np.empty((len(sel), k + 9), dtype=np.uint8)
+        for j in range(k): d[:, j] = hk // 10 ** (k - 1 - j) % 10 + 48
+        d[:, k] = d[:, k + 3] = 58          # ':'
+        d[:, k + 6] = 46                    # '.'
+        d[:, k + 1] = mk // 10 + 48; d[:, k + 2] = mk % 10 + 48
+        ss, cc = ck // 100, ck % 100
+        d[:, k + 4] = ss // 10 + 48; d[:, k + 5] = ss % 10 + 48
+        d[:, k + 7] = cc // 10 + 48; d[:, k + 8] = cc % 10 + 48
+        strs = d.view(f'S{k + 9}').ravel().astype(f'U{k + 9}').tolist()
+        if len(sel) == len(t): return strs
+        for i, v in zip(sel.tolist(), strs): out[i] = v
+    for i in np.flatnonzero(slow).tolist(): out[i] = ass_time(float(t[i]))
+    return out
+
+@dataclass(frozen=True)
+class AssStyle:
+    """Foto inmutable de todo lo que necesita la exportación (segura entre hilos)."""
+    effect: str
+    font: str
+    size: int
+    c_act: str
+    c_in: str
+    position: str
+    before: int
+    after: int
+    width: int
+    height: int
+    align: int
+    margin_v: int
+    ty: int
+    active_tag: str      # plantilla compilada de la palabra activa (fx_wipe conserva {kf})
+    inactive_tag: str
+    layout: str = 'word'
+
+    @classmethod
+    def from_config(cls, style, size=(1920, 1080)):
+        # `style`: cualquier objeto con los campos de StyleConfig
+        width, height = size
+        eff = style.effect if style.effect in EFFECT_KEYS else 'fx_color'
+        before, after = VISIBLE_WINDOWS.get(style.visible, VISIBLE_WINDOWS['balanced'])
+        c_act, c_in = ass_color(style.active), ass_color(style.inactive)
+        align, mv, ty = 2, 50, height - 100
+        if style.position == 'top': align, mv, ty = 8, 50, 150
+        elif style.position == 'center': align, mv, ty = 5, 0, height // 2
+        active = ACTIVE_TEMPLATES.get(eff, DEFAULT_ACTIVE).format(act=c_act, cx=width // 2, ty=ty, ty50=ty + 50)
+        layout = style.layout if style.layout in LAYOUTS else 'word'
+        return cls(eff, style.font, style.size, c_act, c_in, style.position, before, after,
+                   width, height, align, mv, ty, active, f"{{\\1c{c_in}}}", layout)
+
+    @property
+    def phrased(self): return self.layout == 'phrase' and self.effect in PHRASE_EFFECTS
+
+    def header(self):
+        border_style = "3" if self.effect == 'fx_box' else "1"
+        back_col = "&H80000000" if self.effect == 'fx_box' else "&H00000000"
+        return (f"[Script Info]\nScriptType: v4.00+\nPlayResX: {self.width}\nPlayResY: {self.height}\n[V4+ Styles]\n"
+                "Format: Name, Fontname, Fontsize, PrimaryColour, SecondaryColour, OutlineColour, BackColour, Bold, Italic, Underline, StrikeOut, ScaleX, ScaleY, Spacing, Angle, BorderStyle, Outline, Shadow, Alignment, MarginL, MarginR, MarginV, Encoding\n"
+                f"Style: Default,{self.font},{self.size},{self.c_act},{self.c_in},&H00000000,{back_col},-1,0,0,0,100,100,0,0,{border_style},2,0,{self.align},10,10,{self.margin_v},1\n"
+                "[Events]\nFormat: Layer, Start, End, Style, Name, MarginL, MarginR, MarginV, Effect, Text\n")
+
+def phrase_spans(starts, ends, size, gap=PHRASE_GAP):
+    """[(i0, i1)] de bloques de hasta `size` palabras, cortando en silencios > gap."""
+    spans, i0 = [], 0
+    for i in range(1, len(starts)):
+        if i - i0 >= size or starts[i] - ends[i - 1] > gap:
+            spans.append((i0, i)); i0 = i
+    if len(starts): spans.append((i0, len(starts)))
+    return spans
+
+def _phrase_events(texts, starts, ends, style):
+    # (primera palabra, última palabra, capa, texto) por frase. Los tiempos de
+    # \t van en ms y los de \k en cs, relativos al inicio de la línea tal
+    # como queda escrito (redondeado a centésimas).
+    w, h = style.width, style.height
+    act, ina = style.c_act, style.c_in
+    pos_tags = None
+    if style.position == 'alternating':
+        pos_tags = (f"{{\\an2\\pos({w//2},{h-50})}}", f"{{\\an8\\pos({w//2},50)}}", f"{{\\an5\\pos({w//2},{h//2})}}")
+    lead = "{\\fad(100,100)}" if style.effect == 'fx_fade' else ""
+
+    for i0, i1 in phrase_spans(starts, ends, max(1, style.before + style.after)):
+        t0, prev, parts = round(starts[i0] * 100), 0, []
+        for j in range(i0, i1):
+            a = max(prev, round(starts[j] * 100) - t0)
+            b = max(a, round(ends[j] * 100) - t0)
+            if style.effect == 'fx_wipe':
+                # Sílaba vacía para el hueco; el barrido vuelve a pasivo al terminar la palabra
+                if a > prev: parts.append(f"{{\\k{a - prev}}}")
+                parts.append(f"{{\\kf{b - a}\\1c{act}\\t({b * 10},{b * 10 + 1},\\1c{ina})}}{texts[j]} ")
+            elif style.effect == 'fx_fade':
+                parts.append(f"{{\\1c{ina}\\t({a * 10},{a * 10 + FADE_MS},\\1c{act})\\t({b * 10},{b * 10 + FADE_MS},\\1c{ina})}}{texts[j]} ")
+            else:
+                # \\t de 1 ms = cambio seco (con t2 = 0 libass animaría toda la línea)
+                parts.append(f"{{\\1c{ina}\\t({a * 10},{a * 10 + 1},\\1c{act})\\t({b * 10},{b * 10 + 1},\\1c{ina})}}{texts[j]} ")
+            prev = b
+        line = lead + "".join(parts)
+        yield i0, i1 - 1, 0, (pos_tags[(i0 // 4) % 3] + line) if pos_tags else line
+
+def _word_events(texts, starts, ends, style):
+    # (índice de palabra, capa, texto): los tiempos los pone quien consume
+    w, h = style.width, style.height
+
+    if style.effect == 'fx_scatter':
+        for i, text in enumerate(texts):
+            # Posición fija por palabra (texto + inicio): el mismo .ass en cada export y
+            # la caché de render por segmentos no ve cambios donde no los hay
+            rnd = random.Random(f"{text}|{starts[i]:.2f}")
+            rx, ry = rnd.randint(w//4, w*3//4), rnd.randint(h//4, h*3//4)
+            yield i, 0, f"{{\\an5\\move({rx},{ry},{rx},{ry})\\fad(100,100)}}{text}"
+        return
+
+    if style.effect == 'fx_hormozi':
+        tag = f"{{\\an5\\pos({w//2},{h//2})\\fscx120\\fscy120\\1c{style.c_act}}}"
+        for i, text in enumerate(texts):
+            yield i, 0, tag + text
+        return
+
+    # Segmentos por palabra calculados una vez; cada línea es un join de la ventana
+    inactive = [f"{style.inactive_tag}{t} " for t in texts]
+    if style.effect == 'fx_wipe':
+        active = [f"{style.active_tag.replace('{kf}', str(int((e - s) * 100)))}{t} " for t, s, e in zip(texts, starts, ends)]
+    else:
+        active = [f"{style.active_tag}{t} " for t in texts]
+
+    pos_tags = None
+    if style.position == 'alternating':
+        pos_tags = (f"{{\\an2\\pos({w//2},{h-50})}}", f"{{\\an8\\pos({w//2},50)}}", f"{{\\an5\\pos({w//2},{h//2})}}")
+    heart = f"{{\\an5\\pos({w//2},{style.ty-style.size-20})\\1c&H0000FF&}}❤" if style.effect == 'fx_heart' else None
+
+    n, before, after = len(texts), style.before, style.after
+    join = "".join
+    for i in range(n):
+        if heart: yield i, 1, heart
+        line = join(inactive[max(0, i - before):i]) + active[i] + join(inactive[i + 1:min(n, i + after)])
+        yield i, 0, (pos_tags[(i // 4) % 3] + line) if pos_tags else line
+
+def iter_events(words, style):
+    """Genera (inicio, fin, capa, texto) en orden de escritura; inicio/fin en segundos."""
+    texts, starts, ends = word_columns(words)
+    if style.phrased:
+        for i, j, layer, text in _phrase_events(texts, starts, ends, style):
+            yield starts[i], ends[j], layer, text
+        return
+    for i, layer, text in _word_events(texts, starts, ends, style):
+        yield starts[i], ends[i], layer, text
+
+def iter_lines(words, style):
+    texts, starts, ends = word_columns(words)
+    if style.phrased:
+        events = _phrase_events(texts, starts, ends, style)
+        while True:
+            batch = list(islice(events, TIME_BLOCK))
+            if not batch: return
+            a = ass_times([starts[e[0]] for e in batch]); b = ass_times([ends[e[1]] for e in batch])
+            for (_, _, layer, text), s, e in zip(batch, a, b):
+                yield f"Dialogue: {layer},{s},{e},Default,,0,0,0,,{text}\n"
+    base, times = 0, []
+    for i, layer, text in _word_events(texts, starts, ends, style):
+        if i - base >= len(times):
+            # Tiempos formateados por bloques (vectorizado), no uno a uno
+            base = i
+            blk = slice(i, i + TIME_BLOCK)
+            times = [f"{a},{b}" for a, b in zip(ass_times(starts[blk]), ass_times(ends[blk]))]
+        yield f"Dialogue: {layer},{times[i - base]},Default,,0,0,0,,{text}\n"
+
+def write_ass(filename, words, style):
+    """Escribe el .ass en streaming. `style` es un AssStyle (ver AssStyle.from_config)."""
+    with open(filename, 'w', encoding='utf-8', buffering=WRITE_BUFFER) as f:
+        f.write(style.header())
+        f.writelines(iter_lines(words, style))
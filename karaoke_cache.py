@@ -0,0 +1,108 @@
+import hashlib
+import json
+import logging
+import os
+import tempfile
+import threading
+
+from karaoke_core import CACHE_DIR
+from karaoke_media import get_audio
+
+# --- CACHÉ DE TRANSCRIPCIONES ---
+# La lista cruda de palabras de Whisper se guarda en disco con una clave que
+# depende del AUDIO decodificado (no del nombre del archivo), del modelo y de
+# las opciones de transcribe. Re-procesar el mismo video con otra letra o
+# efecto salta directamente a la alineación.
+
+DEFAULT_MAX_MB = int(os.environ.get("SUBMASTER_TRANSCRIPT_CACHE_MB", "256"))
+
+# Memo ruta+mtime+tamaño -> hash del audio, para no decodificar solo para hashear
+_INDEX_MAX = 5000
+_index_lock = threading.Lock()
+
+def file_fingerprint(path):
+    st = os.stat(path)
+    return f"{os.path.abspath(path)}|{st.st_mtime_ns}|{st.st_size}"
+
+def _atomic_write_json(path, data):
+    fd, tmp = tempfile.mkstemp(dir=os.path.dirname(path), suffix=".tmp")
+    with os.fdopen(fd, 'w', encoding='utf-8') as f: json.dump(data, f)
+    os.replace(tmp, path)
+
+def _read_json(path, default):
+    try:
+        with open(path, encoding='utf-8') as f: return json.load(f)
+    except Exception:
+        return default
+
+def audio_digest(path, cache_dir=CACHE_DIR):
+    index_path = os.path.join(cache_dir, "audio_index.json")
+    fp = file_fingerprint(path)
+    with _index_lock:
+        digest = _read_json(index_path, {}).get(fp)
+    if digest: return digest
+
+    # Hash del audio decodificado (igual audio = igual clave). La decodificación
+    # queda en el servicio de audio y la reutiliza la transcripción.
+    digest = get_audio(path).digest
+    with _index_lock:
+        os.makedirs(cache_dir, exist_ok=True)
+        index = _read_json(index_path, {})
+        index[fp] = digest
+        if len(index) > _INDEX_MAX:
+            index = dict(list(index.items())[-_INDEX_MAX:])
+        _atomic_write_json(index_path, index)
+    return digest
+
+class TranscriptCache:
+    def __init__(self, directory=os.path.join(CACHE_DIR, "transcripts"), max_mb=DEFAULT_MAX_MB):
+        self.dir = directory
+        self.max_bytes = int(max_mb * 1024 * 1024)
+        self._lock = threading.Lock()
+
+    @staticmethod
+    def key(digest, model, options):
+        blob = json.dumps({'audio': digest, 'model': model, 'options': options}, sort_keys=True)
+        return hashlib.sha256(blob.encode('utf-8')).hexdigest()
+
+    def _path(self, key): return os.path.join(self.dir, key + ".json")
+
+    def get(self, key):
+        path = self._path(key)
+        data = _read_json(path, None)
+        if data is None: return None
+        try: os.utime(path)  # marca de uso para la expulsión LRU
+        except OSError: pass
+        return data['words']
+
+    def put(self, key, words):
+        with self._lock:
+            os.makedirs(self.dir, exist_ok=True)
+            _atomic_write_json(self._path(key), {'words': words})
+            self._evict()
+
+    def _evict(self):
+        entries = []
+        for name in os.listdir(self.dir):
+            if not name.endswith(".json"): continue
+            try:
+                st = os.stat(os.path.join(self.dir, name))
+                entries.append((st.st_mtime, st.st_size, name))
+            except OSError: pass
+        total = sum(e[1] for e in entries)
+        for _, size, name in sorted(entries):
+            if total <= self.max_bytes: break
+            try:
+                os.remove(os.path.join(self.dir, name)); total -= size
+                logging.info(f"Transcript cache: evicted {name}")
+            except OSError: pass
+
+    def clear(self):
+        with self._lock:
+            if not os.path.isdir(self.dir): return
+            for name in os.listdir(self.dir):
+                if name.endswith(".json"):
+                    try: os.remove(os.path.join(self.dir, name))
+                    except OSError: pass
+
+TRANSCRIPT_CACHE = TranscriptCache()
@@ -0,0 +1,448 @@
+import logging
+import math
+import os
+import re
+import tempfile
+import threading
+import time
+from bisect import bisect_right
+from collections import OrderedDict
+from concurrent.futures import ProcessPoolExecutor
+from functools import lru_cache
+from multiprocessing import Manager
+
+import numpy as np
+from PIL import Image, ImageDraw, ImageFont
+
+from karaoke_core import FFMPEG_EXE, IS_WINDOWS, IS_MAC
+from karaoke_ass import PHRASE_EFFECTS, FADE_MS, phrase_spans
+from karaoke_media import probe_media
+from karaoke_render import (SEGMENT_S, RenderStats, _Tracker, auto_render_workers, concat_segments,
+                            plan_segments, run_ffmpeg)
+from karaoke_track import WordTrack, word_columns
+
+# --- COMPOSITOR NATIVO (PILLOW) ---
+# Segundo backend de render: en vez de pasar el .ass por libass, cada frame
+# del overlay se dibuja aquí y va en RGBA crudo por stdin a ffmpeg, que lo
+# pone encima del video con el filtro overlay.
+#
+# - Atlas: cada palabra se rasteriza una sola vez por color (contorno y caja
+#   incluidos) y se guarda como sprite RGBA; los frames solo copian arrays.
+# - Rectángulos sucios: el lienzo persiste entre frames y se compara el
+#   estado de cada palabra (posición, color, barrido, alfa) con el del frame
+#   anterior; solo se borra y se vuelve a copiar lo que cambió. En un frame
+#   sin cambios no se toca ni un píxel.
+# - Paralelo por frames: el video se corta en keyframes como en
+#   karaoke_render y cada segmento lo compone y codifica su propio proceso
+#   (el filtro ass de libass, en cambio, va en un solo hilo por ffmpeg).
+#
+# Cubre los efectos de la disposición por frase (clásico, caja, barrido,
+# fade) en las dos disposiciones; el resto sigue por libass. La maqueta imita
+# la del .ass (mismo tamaño de letra, contorno, márgenes y anclas) pero el
+# rasterizado no es idéntico al de libass, y sin fontconfig la fuente se busca
+# por nombre de archivo en las carpetas del sistema.
+
+COMPOSITOR_EFFECTS = PHRASE_EFFECTS
+ATLAS_SPRITES = 4096      # sprites vivos en el atlas (LRU)
+OUTLINE = 2               # Outline del estilo en la cabecera del .ass
+BOX_RGBA = (0, 0, 0, 255) # fx_box: BorderStyle 3 pinta la caja con el color del contorno (negro)
+ALPHA_STEPS = 32          # fundidos cuantizados: estados repetidos -> sprites del atlas
+MARGIN_X = 10             # MarginL/MarginR del estilo
+METRIC_SCALE = 8          # la maqueta se mide con la fuente a 8x: avances fraccionarios, sin hinting, como libass
+FALLBACK_FONTS = ('arialbd', 'arial', 'dejavusansbold', 'dejavusans', 'liberationsansbold', 'liberationsans')
+
+def supports(style):
+    # Sin archivo de fuente no hay métricas fiables: mejor libass (que tiene fontconfig)
+    return style.effect in COMPOSITOR_EFFECTS and font_file(style.font) is not None
+
+def _rgb(ass):
+    # "&H00BBGGRR" -> (r, g, b)
+    h = ass[-6:]
+    return int(h[4:6], 16), int(h[2:4], 16), int(h[0:2], 16)
+
+def _norm(name): return re.sub(r'[\s_\-]', '', name).lower()
+
+@lru_cache(maxsize=1)
+def _font_index():
+    # nombre normalizado del archivo -> ruta, de las carpetas de fuentes del sistema
+    if IS_WINDOWS: dirs = [os.path.join(os.environ.get('WINDIR', r'C:\Windows'), 'Fonts')]
+    elif IS_MAC: dirs = ['/Library/Fonts', '/System/Library/Fonts', os.path.expanduser('~/Library/Fonts')]
+    else: dirs = ['/usr/share/fonts', '/usr/local/share/fonts', os.path.expanduser('~/.fonts'), os.path.expanduser('~/.local/share/fonts')]
+    index = {}
+    for d in dirs:
+        for root, _, files in os.walk(d):
+            for f in files:
+                stem, ext = os.path.splitext(f)
+                if ext.lower() in ('.ttf', '.otf', '.ttc'): index.setdefault(_norm(stem), os.path.join(root, f))
+    return index
+
+def font_file(name):
+    """Archivo de la fuente `name` (en negrita si existe, como Bold=-1 del .ass) o una de respaldo."""
+    index, n = _font_index(), _norm(name)
+    for cand in (n + 'bold', n + 'bd', n + 'b', n) + FALLBACK_FONTS:
+        if cand in index: return index[cand]
+    return None
+
+@lru_cache(maxsize=64)
+def _truetype(path, px):
+    # Sin el fallback silencioso de get_cached_font: aquí una fuente de mapa de bits no sirve.
+    # px fraccionario (tamaño em exacto): Pillow >= 10.1
+    return ImageFont.truetype(path, px)
+
+def load_font(name, size, scale=1):
+    """Fuente cuya altura (ascent + descent) mide `size` px, que es como libass lee el Fontsize."""
+    path = font_file(name)
+    if path is None: raise ValueError(f"No font file found for {name!r}")
+    # Proporción medida a 1000 px: a tamaño pequeño las métricas ya vienen redondeadas
+    asc, desc = _truetype(path, 1000).getmetrics()
+    return _truetype(path, max(1.0, size * scale * 1000 / max(1, asc + desc)))
+
+# --- ATLAS DE PALABRAS ---
+
+class GlyphAtlas:
+    """Sprites RGBA por (palabra, color): cada combinación se rasteriza una sola vez."""
+    def __init__(self, font, box=False, capacity=ATLAS_SPRITES, layout_font=None):
+        self.font, self.box, self.capacity = font, box, capacity
+        self.layout_font = layout_font or font      # a METRIC_SCALE veces el tamaño (ver metrics)
+        self.k = self.layout_font.size / font.size
+        asc, desc = font.getmetrics()
+        self.line_h = asc + desc
+        self.space = self.layout_font.getlength(' ') / self.k
+        self.sprites = OrderedDict()
+        self._adv = {}
+        self.hits = self.misses = 0
+
+    def metrics(self, text):
+        # (avance de "texto " como en el .ass, avance sin espacio, x mínima y máxima de la tinta)
+        m = self._adv.get(text)
+        if m is None:
+            f, k = self.layout_font, self.k
+            l, _, r, _ = f.getbbox(text)
+            m = self._adv[text] = (f.getlength(text + ' ') / k, f.getlength(text) / k, l / k, r / k)
+        return m
+
+    def advance(self, text): return self.metrics(text)[0]
+
+    def get(self, text, rgb, end=False):
+        """(array alto x ancho x 4, dx, dy): dx/dy desde el origen de la palabra.
+
+        `end`: última palabra de su fila (con caja, esta no se alarga hasta el espacio).
+        """
+        key = (text, rgb, end and self.box)
+        spr = self.sprites.get(key)
+        if spr is not None:
+            self.hits += 1
+            self.sprites.move_to_end(key)
+            return spr
+        self.misses += 1
+        spr = self.sprites[key] = self._render(text, rgb, key[2])
+        while len(self.sprites) > self.capacity: self.sprites.popitem(last=False)
+        return spr
+
+    def _render(self, text, rgb, end=False):
+        l, t, r, b = self.font.getbbox(text, stroke_width=OUTLINE)
+        if self.box:
+            # La caja llega hasta el espacio (las de palabras vecinas quedan pegadas) salvo al final de la fila
+            l, t = min(l, -OUTLINE), min(t, -OUTLINE)
+            r, b = max(r, r if end else math.ceil(self.advance(text))), max(b, self.line_h + OUTLINE)
+        im = Image.new('RGBA', (max(1, r - l), max(1, b - t)), (0, 0, 0, 0))
+        draw = ImageDraw.Draw(im)
+        if self.box: draw.rectangle((0, 0, im.width, im.height), fill=BOX_RGBA)
+        draw.text((-l, -t), text, font=self.font, fill=rgb + (255,), stroke_width=OUTLINE, stroke_fill=(0, 0, 0, 255))
+        return np.asarray(im), l, t
+
+# --- COMPOSICIÓN ---
+
+class FrameCompositor:
+    """Lienzo RGBA del overlay: advance(t) lo deja como se ve en t redibujando solo lo que cambió.
+
+    El lienzo es solo la franja horizontal que puede llegar a ocupar la letra
+    (filas top..top+alto del video): es lo único que viaja por el pipe.
+    """
+    def __init__(self, words, style, atlas=None):
+        texts, starts, ends = word_columns(words)
+        self.texts = texts
+        # En ms, con los mismos centisegundos que quedan escritos en el .ass
+        self.a = [round(s * 100) * 10 for s in starts]
+        self.b = [round(e * 100) * 10 for e in ends]
+        # \kf del barrido por palabra, truncado a cs como en el .ass
+        self.kf = [int((e - s) * 100) * 10 for s, e in zip(starts, ends)] if style.effect == 'fx_wipe' else None
+        self.style = style
+        self.atlas = atlas or GlyphAtlas(load_font(style.font, style.size), style.effect == 'fx_box',
+                                         layout_font=load_font(style.font, style.size, METRIC_SCALE))
+        self.c_act, self.c_in = _rgb(style.c_act), _rgb(style.c_in)
+        self.drawn = {}       # palabra -> (x, y, estado, rect en coordenadas del lienzo)
+        self.spans = phrase_spans(starts, ends, max(1, style.before + style.after)) if style.phrased else None
+        self.span_a = [self.a[i0] for i0, _ in self.spans] if self.spans is not None else None
+        self._layouts = OrderedDict()
+        self.top, bottom = self._band()
+        self.canvas = np.zeros((bottom - self.top, style.width, 4), dtype=np.uint8)
+        self.frames = self.redraws = self.dirty_px = 0
+
+    def _lines(self):
+        # (lo, hi, var) de cada evento: lo que puede llegar a maquetarse
+        st, n = self.style, len(self.texts)
+        if self.spans is not None: return ((i0, i1, self._var(i0)) for i0, i1 in self.spans)
+        return ((max(0, i - st.before), min(n, i + st.after), self._var(i)) for i in range(n))
+
+    def _band(self):
+        # Filas [top, bottom) que cubren todas las líneas (pares: el overlay va en yuv420)
+        ys = [p[1] for line in self._lines() for p in self._layout(*line).values()]
+        if not ys: return 0, 2
+        pad = OUTLINE + 2
+        top = max(0, min(ys) - pad) // 2 * 2
+        bottom = min(self.style.height, max(ys) + self.atlas.line_h + pad)
+        return top, top + max(2, (bottom - top) // 2 * 2)
+
+    def _var(self, k):
+        # Posición alterna: el mismo ciclo de \pos que el .ass (por palabra activa o por frase)
+        return (k // 4) % 3 if self.style.position == 'alternating' else None
+
+    # --- qué se ve en t ---
+    def _event(self, ms):
+        # (primera, última+1, activa, inicio, fin) del evento visible en ms, o None
+        if self.spans is not None:
+            k = bisect_right(self.span_a, ms) - 1
+            if k < 0: return None
+            i0, i1 = self.spans[k]
+            return (i0, i1, None, self.a[i0], self.b[i1 - 1]) if ms < self.b[i1 - 1] else None
+        i = bisect_right(self.a, ms) - 1
+        if i < 0 or ms >= self.b[i]: return None
+        st = self.style
+        return max(0, i - st.before), min(len(self.texts), i + st.after), i, self.a[i], self.b[i]
+
+    def _mix(self, w):
+        w = round(w * ALPHA_STEPS) / ALPHA_STEPS
+        return tuple(round(c0 + (c1 - c0) * w) for c0, c1 in zip(self.c_in, self.c_act))
+
+    def _states(self, t):
+        # palabra -> (x, y, color, barrido en [0, 1] o None, alfa cuantizado, fin de fila)
+        # El filtro ass le pasa a libass el pts redondeado a ms
+        ms = round(t * 1000)
+        ev = self._event(ms)
+        if ev is None: return {}
+        lo, hi, active, ea, eb = ev
+        eff = self.style.effect
+        alpha = ALPHA_STEPS
+        if eff == 'fx_fade':
+            # \fad(100,100) de la línea
+            alpha = max(0, min(ALPHA_STEPS, round(min(ms - ea, eb - ms) / FADE_MS * ALPHA_STEPS)))
+        var = self._var(lo if active is None else active)
+        out = {}
+        for j, (x, y, end) in self._layout(lo, hi, var).items():
+            sweep = None
+            if active is not None:
+                # Una línea por palabra: solo la activa cambia
+                col = self.c_act if j == active else self.c_in
+                if eff == 'fx_wipe' and j == active:
+                    kf = self.kf[j]
+                    col, sweep = self.c_in, min(1.0, (ms - ea) / kf) if kf > 0 else 1.0
+            else:
+                a, b = self.a[j], self.b[j]
+                if eff == 'fx_fade':
+                    col = self._mix(min(1.0, max(0.0, (ms - a) / FADE_MS)) - min(1.0, max(0.0, (ms - b) / FADE_MS)))
+                elif eff == 'fx_wipe' and a <= ms < b:
+                    col, sweep = self.c_in, (ms - a) / (b - a)
+                else:
+                    col = self.c_act if a <= ms < b else self.c_in
+            if sweep is not None: sweep = round(sweep * 64) / 64
+            out[j] = (x, y, col, sweep, alpha, end)
+        return out
+
+    def _layout(self, lo, hi, var=None):
+        # Palabras lo..hi-1 -> (x, y, fin de fila) de cada una; maqueta cacheada por línea
+        key = (lo, hi, var)
+        lay = self._layouts.get(key)
+        if lay is not None: return lay
+        st, atlas = self.style, self.atlas
+        limit = st.width - 2 * MARGIN_X
+        met = {j: atlas.metrics(self.texts[j]) for j in range(lo, hi)}
+        width = lambda row: sum(met[j][0] for j in row) - atlas.space
+        def ink(row, to_pen=False):
+            # Extensión de la fila como la mide libass: tinta a tinta, o hasta la pluma tras la última palabra
+            end = sum(met[j][0] for j in row[:-1]) + met[row[-1]][1 if to_pen else 3]
+            return end - met[row[0]][2]
+
+        rows = [[]]
+        for j in range(lo, hi):
+            if rows[-1] and ink(rows[-1] + [j]) > limit: rows.append([])
+            rows[-1].append(j)
+
+        # Segundo paso del WrapStyle 0 de libass: bajar la última palabra si las filas quedan más parejas
+        moved = True
+        while moved:
+            moved = False
+            for r in range(len(rows) - 1):
+                up, dn = rows[r], rows[r + 1]
+                if len(up) < 2: continue
+                new_dn = up[-1:] + dn
+                if abs(ink(up[:-1]) - (ink(new_dn) + met[up[-1]][2])) < abs(ink(up, True) - ink(dn)):
+                    dn.insert(0, up.pop()); moved = True
+        align, mv = st.align, st.margin_v
+        if var is not None: align, mv = ((2, 50), (8, 50), (5, 0))[var]
+        block = len(rows) * atlas.line_h
+        y0 = st.height - mv - block if align == 2 else mv if align == 8 else (st.height - block) / 2
+        lay = {}
+        for r, row in enumerate(rows):
+            x = (st.width - width(row)) / 2
+            for j in row:
+                lay[j] = (int(round(x)), int(round(y0 + r * atlas.line_h)), j == row[-1])
+                x += met[j][0]
+        self._layouts[key] = lay
+        if len(self._layouts) > 64: self._layouts.popitem(last=False)
+        return lay
+
+    # --- dibujo ---
+    def _sprite(self, j, state):
+        _, _, col, sweep, alpha, end = state
+        arr, dx, dy = self.atlas.get(self.texts[j], col, end)
+        if sweep is not None:
+            # Barrido (\kf): la parte ya cantada sale del sprite activo; avanza sobre la tinta, como en libass
+            _, _, l, r = self.atlas.metrics(self.texts[j])
+            px = int(round(l + (r - l) * sweep - dx))
+            if px > 0:
+                act = self.atlas.get(self.texts[j], self.c_act, end)[0]
+                arr = arr.copy(); arr[:, :px] = act[:, :px]
+        if alpha < ALPHA_STEPS:
+            arr = arr.copy(); arr[..., 3] = (arr[..., 3].astype(np.uint16) * alpha // ALPHA_STEPS).astype(np.uint8)
+        return arr, dx, dy
+
+    def _clip(self, x0, y0, x1, y1):
+        h, w = self.canvas.shape[:2]
+        return max(0, x0), max(0, y0), min(w, x1), min(h, y1)
+
+    def advance(self, t):
+        """Actualiza el lienzo para el instante t (s) y devuelve los rectángulos redibujados."""
+        self.frames += 1
+        new = self._states(t)
+        old = self.drawn
+        dirty = []
+        for j, (x, y, st, rect) in old.items():
+            if new.get(j) != (x, y) + st:
+                x0, y0, x1, y1 = rect
+                self.canvas[y0:y1, x0:x1] = 0
+                dirty.append(rect)
+        drawn = {}
+        for j, state in new.items():
+            prev = old.get(j)
+            if prev is not None and prev[:2] + prev[2] == state:
+                drawn[j] = prev
+                continue
+            drawn[j] = self._blit(j, state)
+            dirty.append(drawn[j][3])
+        if dirty:
+            # Un sprite que toca un rectángulo borrado (contorno o caja vecina) se vuelve a copiar
+            for j, prev in drawn.items():
+                if prev is old.get(j) and any(_overlap(prev[3], r) for r in dirty):
+                    self._blit(j, new[j])
+            self.redraws += 1
+            self.dirty_px += sum((r[2] - r[0]) * (r[3] - r[1]) for r in dirty)
+        self.drawn = drawn
+        return dirty
+
+    def _blit(self, j, state):
+        arr, dx, dy = self._sprite(j, state)
+        x, y = state[0] + dx, state[1] + dy - self.top
+        x0, y0, x1, y1 = self._clip(x, y, x + arr.shape[1], y + arr.shape[0])
+        if x1 > x0 and y1 > y0:
+            dst = self.canvas[y0:y1, x0:x1]
+            src = arr[y0 - y:y1 - y, x0 - x:x1 - x]
+            # Donde ya hay algo (contornos que se tocan) gana el más opaco
+            np.copyto(dst, src, where=(src[..., 3:] >= dst[..., 3:]))
+        return state[0], state[1], state[2:], (x0, y0, max(x0, x1), max(y0, y1))
+
+    def stats(self):
+        return {'frames': self.frames, 'redraws': self.redraws, 'dirty_px': self.dirty_px,
+                'pixels': self.frames * self.canvas.shape[0] * self.canvas.shape[1],
+                'atlas_hits': self.atlas.hits, 'atlas_misses': self.atlas.misses}
+
+def _overlap(a, b): return a[0] < b[2] and b[0] < a[2] and a[1] < b[3] and b[1] < a[3]
+
+# --- RENDER ---
+
+def _overlay_cmd(video_path, t0, t1, fps, size, top, out_path, preset, threads, whole, last):
+    cmd = [FFMPEG_EXE, "-hide_banner", "-nostdin", "-v", "error"]
+    if not whole: cmd += ["-ss", f"{t0:.6f}"]
+    cmd += ["-i", video_path, "-f", "rawvideo", "-pix_fmt", "rgba", "-s", f"{size[0]}x{size[1]}", "-r", f"{fps:.6f}", "-i", "pipe:0",
+            "-filter_complex", f"[0:v][1:v]overlay=x=0:y={top}:eof_action=repeat:format=yuv420[v]", "-map", "[v]",
+            # El overlay puede traer un frame de más al final: el corte lo pone la duración del video
+            # (medio frame menos si el keyframe que abre el segmento siguiente no se debe repetir)
+            "-t", f"{max(0.0, t1 - t0 - (0.0 if last else 0.5 / fps)):.6f}"]
+    if whole: return cmd + ["-map", "0:a:0?", "-c:a", "copy", "-c:v", "libx264", "-preset", preset, "-threads", str(threads), "-y", out_path]
+    return cmd + ["-an", "-fps_mode", "passthrough", "-c:v", "libx264", "-preset", preset, "-threads", str(threads), "-y", out_path]
+
+def composite_segment(video_path, words, style, t0, t1, fps, out_path, preset='ultrafast', threads=1,
+                      whole=False, last=True, on_block=None):
+    """Compone y codifica [t0, t1) (todo el video con audio si `whole`). Devuelve las stats del compositor."""
+    comp = FrameCompositor(words, style)
+    n = int(math.ceil((t1 - t0) * fps)) + 1
+    h, w = comp.canvas.shape[:2]
+    cmd = _overlay_cmd(video_path, t0, t1, fps, (w, h), comp.top, out_path, preset, threads, whole, last)
+
+    def feed(stdin):
+        for k in range(n):
+            comp.advance(t0 + k / fps)
+            stdin.write(comp.canvas.data)
+
+    run_ffmpeg(cmd, on_block, feed)
+    return comp.stats()
+
+def _segment_job(args):
+    # Entrada de los procesos del pool: el progreso vuelve por una cola del Manager
+    queue, key, limit = args[-3:]
+    on_block = (lambda b: queue.put((key, dict(b), limit))) if queue is not None else None
+    return composite_segment(*args[:-3], on_block=on_block)
+
+def render_composited(video_path, words, style, out_path, preset='ultrafast', workers=None, target=SEGMENT_S,
+                      progress=None, log=logging.info):
+    """Quema la letra con el compositor de Pillow (`style`: AssStyle). Devuelve RenderStats.
+
+    Con varios `workers` el video se corta en keyframes y cada segmento se
+    compone y codifica en su propio proceso; luego se unen sin recodificar.
+    """
+    if not supports(style): raise ValueError(f"Not supported by the compositor: effect {style.effect}, font {style.font}")
+    info = probe_media(video_path, keyframes=True)
+    fps = info.fps or 30.0
+    workers = workers or auto_render_workers(info.duration)
+    segments = [(0.0, info.duration)]
+    if workers > 1:
+        segments = plan_segments([k - info.start_time for k in info.keyframes], info.duration, target)
+    workers = max(1, min(workers, len(segments)))
+    threads = max(1, (os.cpu_count() or 1) // workers)
+    words = WordTrack(*word_columns(words))     # columnar: barato de pasar a los procesos
+    t_start = time.perf_counter()
+    tracker = _Tracker(info.duration, progress)
+
+    if len(segments) < 2:
+        stats = [composite_segment(video_path, words, style, 0.0, info.duration, fps, out_path, preset, threads,
+                                   whole=True, on_block=lambda b: tracker.update(0, b, info.duration))]
+    else:
+        with tempfile.TemporaryDirectory(prefix="submaster_comp_", dir=os.path.dirname(os.path.abspath(out_path))) as tmp, \
+                Manager() as mgr:
+            queue = mgr.Queue() if progress else None
+            outputs, jobs = [], []
+            for j, (t0, t1) in enumerate(segments):
+                outputs.append(os.path.join(tmp, f"seg_{j:04d}.mp4"))
+                jobs.append((video_path, words, style, t0, t1, fps, outputs[-1], preset, threads,
+                             False, j == len(segments) - 1, queue, j, t1 - t0))
+            drain = None
+            if queue is not None:
+                def pump():
+                    for item in iter(queue.get, None): tracker.update(*item)
+                drain = threading.Thread(target=pump, daemon=True)
+                drain.start()
+            try:
+                with ProcessPoolExecutor(max_workers=workers) as pool:
+                    stats = list(pool.map(_segment_job, jobs))
+            finally:
+                if drain:
+                    queue.put(None); drain.join()
+            concat_segments(outputs, segments, video_path, out_path, tmp)
+
+    total = {k: sum(s[k] for s in stats) for k in stats[0]}
+    looked = total['atlas_hits'] + total['atlas_misses']
+    log(f"Compositor: {total['frames']} frames, {total['redraws']} redrawn, "
+        f"{total['dirty_px'] / max(1, total['pixels']):.2%} of pixels touched, "
+        f"atlas {total['atlas_hits'] / max(1, looked):.1%} hits ({total['atlas_misses']} sprites)")
+    return RenderStats(info.duration, time.perf_counter() - t_start, os.path.getsize(out_path),
+                       tracker.state.frame or total['frames'], len(segments), len(segments))
@@ -0,0 +1,88 @@
+import os
+import re
+import sys
+from functools import lru_cache
+
+import imageio_ffmpeg
+from PIL import ImageFont
+
+from karaoke_track import WordTrack
+
+# --- NÚCLEO SIN GUI ---
+# Todo lo que necesitan tanto la ventana Tk como el modo batch/headless.
+# Este módulo NO debe importar tkinter ni pygame.
+
+# Detectar Sistema Operativo
+IS_WINDOWS = sys.platform == "win32"
+IS_MAC = sys.platform == "darwin"
+IS_LINUX = sys.platform.startswith("linux")
+
+# Configuración dinámica de FFmpeg
+FFMPEG_EXE = imageio_ffmpeg.get_ffmpeg_exe()
+FFMPEG_DIR = os.path.dirname(FFMPEG_EXE)
+
+# Extensiones
+EXE_EXT = ".exe" if IS_WINDOWS else ""
+
+FFPROBE_EXE = os.path.join(FFMPEG_DIR, f"ffprobe{EXE_EXT}")
+FFPLAY_EXE  = os.path.join(FFMPEG_DIR, f"ffplay{EXE_EXT}")
+
+# Fallbacks
+if not os.path.exists(FFPLAY_EXE): FFPLAY_EXE = "ffplay"
+if not os.path.exists(FFPROBE_EXE): FFPROBE_EXE = "ffprobe"
+
+os.environ["PATH"] = FFMPEG_DIR + os.pathsep + os.environ["PATH"]
+os.environ["IMAGEIO_FFMPEG_EXE"]  = FFMPEG_EXE
+os.environ["IMAGEIO_FFPROBE_EXE"] = FFPROBE_EXE
+
+# Carpeta de cachés en disco (transcripciones, audio decodificado, etc.)
+CACHE_DIR = os.environ.get("SUBMASTER_CACHE_DIR", os.path.join(os.path.expanduser("~"), ".cache", "submaster"))
+
+# Flags para que ffmpeg no abra consola en Windows
+SUBPROCESS_FLAGS = {'creationflags': 0x08000000} if IS_WINDOWS else {}
+
+@lru_cache(maxsize=64)
+def get_cached_font(font_path, font_size):
+    try: return ImageFont.truetype(font_path, font_size)
+    except: return ImageFont.load_default()
+
+# --- UTILIDADES ---
+
+def normalize_text(text):
+    text = text.lower().strip()
+    text = re.sub(r'[^\w\s]', '', text)
+    return text
+
+def split_syllables(word: str) -> list:
+    pieces = re.findall(r'[^aeiouáéíóú]*[aeiouáéíóú]+[^aeiouáéíóú]*', word.lower(), flags=re.I)
+    return pieces or [word]
+
+def sanitize_float(val):
+    try: return float(val)
+    except: return 0.0
+
+def refine_word_segments(words):
+    # Ordena, da duración mínima y repara solapes (vectorizado en WordTrack).
+    # Devuelve el mismo tipo que recibe: lista de dicts o WordTrack.
+    if isinstance(words, WordTrack): return words.refine()
+    if not words: return []
+    return WordTrack.from_dicts(words).refine().to_dicts()
+
+# --- EFECTOS Y MODOS DE VISUALIZACIÓN ---
+EFFECT_KEYS = [
+    'fx_color', 'fx_wipe', 'fx_bounce', 'fx_neon', 'fx_type',
+    'fx_scatter', 'fx_hormozi', 'fx_ball',
+    'fx_box', 'fx_pop', 'fx_shake', 'fx_glitch', 'fx_slide', 'fx_heart',
+    'fx_fade', 'fx_pulse', 'fx_zoom'
+]
+
+# Palabras visibles alrededor de la actual: (antes, después incluyendo la actual)
+VISIBLE_KEYS = ['single', 'compact', 'balanced', 'full']
+VISIBLE_WINDOWS = {
+    'single': (0, 1),    # 1 Palabra (Solo la actual)
+    'compact': (1, 3),   # 4 Palabras (1 antes, 1 actual, 2 después)
+    'balanced': (3, 4),  # 7 Palabras (3 antes, 1 actual, 3 después)
+    'full': (5, 6),      # 11 Palabras (5 antes, 1 actual, 5 después)
+}
+
+POSITIONS = ['bottom', 'top', 'center', 'alternating']
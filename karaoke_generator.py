@@ -1,68 +1,48 @@
 import tkinter as tk
 from tkinter import ttk, filedialog, messagebox, scrolledtext, Canvas, colorchooser
 import tkinter.font as tkfont
-import whisper
 import os
-from functools import lru_cache 
-from moviepy import VideoFileClip 
 import numpy as np
-import pygame
 import threading
-import time
-from difflib import SequenceMatcher
 import sys
-import re
 import gc
 import subprocess
 import traceback
+from bisect import bisect_right
+from concurrent.futures import ThreadPoolExecutor
 try:
     import moviepy.video.io.ffmpeg_tools as ffmpeg_tools
 except ImportError:
     pass 
 import subprocess as sp
 import tempfile
-from scipy.io import wavfile
-import random
 import logging
 import warnings
 
 # --- IMPORTS NECESARIOS ---
-import imageio_ffmpeg
-from PIL import ImageFont 
-import platform 
+# FFmpeg, utilidades de texto y el pipeline viven en módulos sin GUI (modo batch)
+from karaoke_core import (
+    IS_WINDOWS, IS_MAC, FFMPEG_EXE, FFPLAY_EXE,
+    EFFECT_KEYS, VISIBLE_KEYS, refine_word_segments,
+)
+import karaoke_pipeline as pipeline
+from karaoke_models import preload_model
+from karaoke_media import get_audio, probe_media, render_size
+from karaoke_transcribe import auto_workers
+from karaoke_track import WordIndex, EditHistory, SNAP_TOLERANCE, snap_times, snap_words
+from karaoke_onsets import get_onsets
+from karaoke_playback import PcmPlayer
+from karaoke_render import auto_render_workers
+import karaoke_vocals as vocals
+from karaoke_preview import PreviewEngine
+from PIL import Image, ImageTk
+from dataclasses import asdict, fields
+from karaoke_project import PROJECT_EXT, Project
 
 # --- CONFIGURACIÓN OPTIMIZADA ---
 logging.basicConfig(level=logging.INFO, format="%(asctime)s - %(message)s")
 warnings.filterwarnings("ignore")
 
-# Detectar Sistema Operativo
-IS_WINDOWS = sys.platform == "win32"
-IS_MAC = sys.platform == "darwin"
-IS_LINUX = sys.platform.startswith("linux")
-
-# Configuración dinámica de FFmpeg
-FFMPEG_EXE = imageio_ffmpeg.get_ffmpeg_exe()
-FFMPEG_DIR = os.path.dirname(FFMPEG_EXE)
-
-# Extensiones
-EXE_EXT = ".exe" if IS_WINDOWS else ""
-
-FFPROBE_EXE = os.path.join(FFMPEG_DIR, f"ffprobe{EXE_EXT}")
-FFPLAY_EXE  = os.path.join(FFMPEG_DIR, f"ffplay{EXE_EXT}")
-
-# Fallbacks
-if not os.path.exists(FFPLAY_EXE): FFPLAY_EXE = "ffplay"
-if not os.path.exists(FFPROBE_EXE): FFPROBE_EXE = "ffprobe"
-
-os.environ["PATH"] = FFMPEG_DIR + os.pathsep + os.environ["PATH"]
-os.environ["IMAGEIO_FFMPEG_EXE"]  = FFMPEG_EXE
-os.environ["IMAGEIO_FFPROBE_EXE"] = FFPROBE_EXE
-
-@lru_cache(maxsize=64)
-def get_cached_font(font_path, font_size):
-    try: return ImageFont.truetype(font_path, font_size)
-    except: return ImageFont.load_default()
-
 # --- UTILIDADES ---
 
 def open_folder_cross_platform(path):
@@ -77,41 +57,6 @@ def open_folder_cross_platform(path):
     except Exception as e:
         print(f"No se pudo abrir la carpeta: {e}")
 
-def normalize_text(text):
-    text = text.lower().strip()
-    text = re.sub(r'[^\w\s]', '', text)
-    return text
-
-def split_syllables(word: str) -> list:
-    pieces = re.findall(r'[^aeiouáéíóú]*[aeiouáéíóú]+[^aeiouáéíóú]*', word.lower(), flags=re.I)
-    return pieces or [word]
-
-def sanitize_float(val):
-    try: return float(val)
-    except: return 0.0
-
-def refine_word_segments(words):
-    if not words: return []
-    refined = []
-    for w in words:
-        text = w['text'].strip()
-        start = sanitize_float(w['start'])
-        end = sanitize_float(w['end'])
-        refined.append({'text': text, 'start': start, 'end': end})
-    
-    refined.sort(key=lambda x: x['start'])
-    
-    for i in range(len(refined)):
-        if refined[i]['end'] <= refined[i]['start']:
-            refined[i]['end'] = refined[i]['start'] + 0.2
-        if i < len(refined) - 1:
-            if refined[i]['end'] > refined[i+1]['start']:
-                refined[i]['end'] = refined[i+1]['start'] - 0.01
-                if refined[i]['end'] <= refined[i]['start']:
-                     refined[i]['end'] = refined[i]['start'] + 0.1
-                     refined[i+1]['start'] = refined[i]['end'] + 0.01
-    return refined
-
 # --- TRADUCCIONES ---
 TRANSLATIONS = {
     'es': {
@@ -124,6 +69,7 @@ TRANSLATIONS = {
         'visual_editor': '👁️ EDITOR / PREVIEW', # CAMBIO AQUÍ PARA QUE SEA CLARO
         'export_subs': 'EXPORTAR SUBS', 'generate_video': 'RENDERIZAR VIDEO',
         'select_video': 'SELECCIONAR VIDEO', 'no_video': 'Ningún video seleccionado', 'lang_btn': '🌐 IDIOMA: ES', 
+        'open_project': 'ABRIR PROYECTO', 'save_project': 'GUARDAR PROYECTO',
         'video_success': '¡Video generado!', 'confirm_delete': '¿Borrar palabra?',
         'model': 'Modelo:', 'font': 'Fuente:', 'active': 'Color Activo:', 'inactive': 'Color Pasivo:', 
         'effect': 'Efecto:', 'size': 'Tamaño:', 'position': 'Posición:', 
@@ -133,6 +79,7 @@ TRANSLATIONS = {
         'compact': 'Compacto (4)',
         'balanced': 'Balanceado (7)',
         'full': 'Completo (11)',
+        'phrase_layout': 'Una línea por frase',
         
         'audio': 'AUDIO', 'language': 'Idioma:',
         'text': 'Texto:', 'start': 'Inicio (s):', 'end': 'Fin (s):',
@@ -157,6 +104,7 @@ TRANSLATIONS = {
         'visual_editor': '👁️ EDITOR / PREVIEW', 
         'export_subs': 'EXPORT SUBS', 'generate_video': 'RENDER VIDEO',
         'select_video': 'SELECT VIDEO', 'no_video': 'No video selected', 'lang_btn': '🌐 LANG: EN', 
+        'open_project': 'OPEN PROJECT', 'save_project': 'SAVE PROJECT',
         'video_success': 'Video generated!', 'confirm_delete': 'Delete word?',
         'model': 'Model:', 'font': 'Font:', 'active': 'Active Color:', 'inactive': 'Passive Color:', 
         'effect': 'Effect:', 'size': 'Size:', 'position': 'Position:', 
@@ -166,6 +114,7 @@ TRANSLATIONS = {
         'compact': 'Compact (4)',
         'balanced': 'Balanced (7)',
         'full': 'Full (11)',
+        'phrase_layout': 'One line per phrase',
 
         'visible_words': 'Visible Words:', 'audio': 'AUDIO', 'language': 'Language:',
         'text': 'Text:', 'start': 'Start (s):', 'end': 'End (s):',
@@ -182,13 +131,6 @@ TRANSLATIONS = {
     }
 }
 
-EFFECT_KEYS = [
-    'fx_color', 'fx_wipe', 'fx_bounce', 'fx_neon', 'fx_type', 
-    'fx_scatter', 'fx_hormozi', 'fx_ball', 
-    'fx_box', 'fx_pop', 'fx_shake', 'fx_glitch', 'fx_slide', 'fx_heart',
-    'fx_fade', 'fx_pulse', 'fx_zoom'
-]
-
 # --- PARCHE FFMPEG ---
 try:
     def ffplay_version_patch(): return ("ffplay", "6.0")
@@ -217,8 +159,14 @@ sp.Popen = patched_popen
 # ==============================================================================
 # TIMELINE EDITOR
 # ==============================================================================
+# Timeline: zoom permitido, pasos de la regla (s) y banda de la forma de onda
+ZOOM_MIN, ZOOM_MAX = 5.0, 2000.0
+RULER_STEPS = (1, 2, 5, 10, 30, 60, 120, 300, 600)
+WAVE_Y, WAVE_H = 85, 60
+SNAP_PX = 8             # al arrastrar, el imán alcanza al menos 8 px
+
 class TimelineEditor:
-    def __init__(self, parent, words_data, video_path, on_save_callback, language='es'):
+    def __init__(self, parent, words_data, video_path, on_save_callback, language='es', style=None, peaks=None, onsets=None):
         self.window = tk.Toplevel(parent)
         self.lang = language
         self.trans = TRANSLATIONS[language]
@@ -230,21 +178,39 @@ class TimelineEditor:
         self.video_path = video_path
         self.on_save = on_save_callback
         self.sel_idx = None
+        # Índice de intervalos: palabra activa al reproducir y clics en el timeline
+        self.index = WordIndex(self.words_data)
         
         self.playing = False
-        self.start_time = 0.0
         self.offset = 0.0
         self.px_per_sec = 180.0 
         
-        self.history = [self.words_data.copy()]
-        self.hist_idx = 0
+        # Historial por deltas: solo guarda lo que cambia en cada edición
+        self.history = EditHistory()
+
+        # Items vivos del timeline: índice de palabra -> (caja, texto)
+        self.word_items = {}
+        self.item_pool = []
+        self.ruler_items = {}
+        self.ruler_pool = []
+        self._refresh_pending = False
         
-        pygame.mixer.init()
-        self.audio_file = None
+        self.audio = None
+        self.player = None
+        # Picos y onsets guardados en el proyecto: la forma de onda sale sin esperar al análisis
+        self.peaks = peaks
+        self.onsets = onsets
+        self.drag = None        # (índice, desfase del agarre, x inicial, palabra movida)
         self.inst_file = None 
+        # Preview real: frames del video con el .ass aplicado (karaoke_preview)
+        self.style = style
+        self.preview = None
+        self.prev_img = None    # referencia al PhotoImage vivo (Tk no la guarda)
+        self._preview_job = None
         
         self.setup_ui()
         self.load_audio()
+        self.load_preview()
         
         self.window.after(200, self.draw_static_timeline) 
         
@@ -285,6 +251,9 @@ class TimelineEditor:
         row_aud.pack(pady=5)
         tk.Button(row_aud, text="⏹", command=self.stop, bg='#ff4444', font=('Arial', 12), width=4).pack(side=tk.LEFT, padx=2)
         tk.Button(row_aud, text="🎤 "+self.trans['voc_rem'], command=self.remove_vocals, bg='#2196f3', fg='white', font=('Arial', 9, 'bold')).pack(side=tk.LEFT, padx=2)
+        # Modo espectral (STFT): más lento pero conserva estéreo y graves
+        self.v_voc_hq = tk.BooleanVar(value=False)
+        tk.Checkbutton(row_aud, text="HQ", variable=self.v_voc_hq, bg='#151b35', fg='white', selectcolor='#0a0e27', activebackground='#151b35').pack(side=tk.LEFT, padx=2)
         
         self.lbl_time = tk.Label(ctr, text="00:00 / 00:00", bg='#151b35', fg='#00ff88', font=('Consolas', 22, 'bold'))
         self.lbl_time.pack(pady=10)
@@ -305,6 +274,7 @@ class TimelineEditor:
         tk.Button(ed, text="✓ APLICAR", command=self.apply_edit, bg='#00ff88', font=('bold',10)).pack(fill=tk.X, padx=10, pady=5)
         tk.Button(ed, text="🗑 BORRAR", command=self.delete_word, bg='#ff4444', fg='white', font=('bold',10)).pack(fill=tk.X, padx=10, pady=5)
         tk.Button(ed, text="+ NUEVA", command=self.add_word, bg='#2196f3', fg='white', font=('bold',10)).pack(fill=tk.X, padx=10, pady=5)
+        tk.Button(ed, text="🧲 AJUSTAR A ONSETS", command=self.auto_snap, bg='#9c27b0', fg='white', font=('bold',10)).pack(fill=tk.X, padx=10, pady=5)
 
         bot = tk.Frame(self.window, bg='#0a0e27')
         bot.grid(row=2, column=0, sticky='nsew', padx=10, pady=(0,10))
@@ -314,7 +284,7 @@ class TimelineEditor:
         cv_fr.pack(fill=tk.BOTH, expand=True)
         
         self.h_scr = tk.Scrollbar(cv_fr, orient=tk.HORIZONTAL)
-        self.cv_tl = Canvas(cv_fr, bg='#0f121f', highlightthickness=0, xscrollcommand=self.h_scr.set, height=300)
+        self.cv_tl = Canvas(cv_fr, bg='#0f121f', highlightthickness=0, xscrollcommand=self._on_xscroll, height=300)
         self.h_scr.config(command=self.cv_tl.xview)
         
         self.h_scr.pack(side=tk.BOTTOM, fill=tk.X)
@@ -322,6 +292,10 @@ class TimelineEditor:
         
         self.cv_tl.bind('<Button-1>', self.on_click)
         self.cv_tl.bind('<B1-Motion>', self.on_drag)
+        self.cv_tl.bind('<ButtonRelease-1>', self.on_release)
+        self.cv_tl.bind('<Configure>', self.schedule_refresh)
+        for seq in ('<Control-MouseWheel>', '<Control-Button-4>', '<Control-Button-5>'):
+            self.cv_tl.bind(seq, self.on_zoom)
 
     def mk_inp(self, p, l, v):
         tk.Label(p, text=l, bg='#151b35', fg='gray').pack(anchor='w', padx=10)
@@ -333,31 +307,92 @@ class TimelineEditor:
 
     def load_audio(self):
         try:
-            with VideoFileClip(self.video_path) as v:
-                # CORREGIDO: Guardar como WAV para que scipy no falle
-                self.audio_file = tempfile.NamedTemporaryFile(suffix=".wav", delete=False).name
-                v.audio.write_audiofile(self.audio_file, fps=44100, logger=None)
-            self.dur = pygame.mixer.Sound(self.audio_file).get_length()
+            # Audio compartido: ya decodificado al transcribir, no se vuelve a extraer
+            self.audio = get_audio(self.video_path)
+            self.dur = self.audio.duration
+            # Reproducción directa desde el memmap: seek sin recargar el archivo
+            self.player = PcmPlayer(self.audio.rate)
+            self.player.add_track('orig', self.audio.pcm())
+            threading.Thread(target=self._analysis_thread, daemon=True).start()
         except: self.dur = 60.0
         
         min_tot, sec_tot = divmod(self.dur, 60)
         self.lbl_time.config(text=f"00:00 / {int(min_tot):02}:{int(sec_tot):02}")
 
+    def load_preview(self):
+        if self.style is None: return
+        try:
+            self.preview = PreviewEngine(self.video_path, on_frame=lambda k: self.window.after(0, self._preview_ready, k))
+            self.preview.set_subtitles(self.words_data, self.style)
+        except Exception as e:
+            logging.warning(f"Preview unavailable: {e}")
+            self.preview = None
+
+    def refresh_preview(self):
+        # Debounce: al arrastrar llegan muchas ediciones seguidas; se regenera una vez
+        if not self.preview: return
+        if self._preview_job: self.window.after_cancel(self._preview_job)
+        self._preview_job = self.window.after(300, self._update_preview)
+
+    def _update_preview(self):
+        self._preview_job = None
+        if not self.preview: return
+        self.preview.set_subtitles(self.words_data, self.style)
+        if not self.playing: self.show_preview(self.offset)
+
+    def _preview_ready(self, k):
+        # En pausa el reloj no redibuja: el frame que esperaba el cabezal se pinta al llegar
+        if self.preview and not self.playing and k == self.preview.key(self.offset): self.show_preview(self.offset)
+
+    def show_preview(self, t):
+        cv = self.cv_prev
+        img = self.preview.frame(t) if self.preview else None
+        if img is None:
+            # Sin frame todavía se deja el anterior; sin motor, la palabra activa como texto
+            if self.preview: return
+            cv.delete('all')
+            k = self.index.at(t)
+            if k is not None:
+                cv.create_text(cv.winfo_width()/2, 100, text=self.words_data[k]['text'], fill='#00ff88', font=('Arial', 36, 'bold'))
+            return
+        pic = Image.fromarray(img)
+        cw, ch = cv.winfo_width(), cv.winfo_height()
+        scale = min(cw / pic.width, ch / pic.height)
+        if 0 < scale < 1: pic = pic.resize((max(1, int(pic.width * scale)), max(1, int(pic.height * scale))), Image.BILINEAR)
+        self.prev_img = ImageTk.PhotoImage(pic)
+        if not cv.find_withtag('frame'):
+            cv.delete('all')
+            cv.create_image(0, 0, tags='frame')
+        cv.itemconfig('frame', image=self.prev_img)
+        cv.coords('frame', cw / 2, ch / 2)
+
+    def _analysis_thread(self):
+        # Picos y onsets: la primera vez se calculan (vectorizado, por bloques); luego salen del .npz
+        if self.peaks is None:
+            try: self.peaks = self.audio.peaks()
+            except Exception as e: logging.warning(f"Waveform peaks unavailable: {e}")
+            else: self.window.after(0, self.schedule_refresh)
+        if self.onsets is None:
+            try: self.onsets = get_onsets(self.audio).onsets
+            except Exception as e: logging.warning(f"Onset analysis unavailable: {e}")
+
     def remove_vocals(self):
-        if not self.audio_file: return
+        if not self.player: return
         if not messagebox.askyesno("Karaoke", "Eliminar voces puede tardar. ¿Continuar?"): return
-        threading.Thread(target=self._voc_thread, daemon=True).start()
+        mode = 'spectral' if self.v_voc_hq.get() else 'phase'
+        threading.Thread(target=self._voc_thread, args=(mode,), daemon=True).start()
 
-    def _voc_thread(self):
+    def _voc_thread(self, mode='phase'):
         try:
-            # Scipy ahora podrá leer el archivo porque es .wav
-            fs, data = wavfile.read(self.audio_file)
-            if data.ndim > 1: 
-                inst = (data.T[0] - data.T[1]) / 2
-                self.inst_file = tempfile.NamedTemporaryFile(suffix=".wav", delete=False).name
-                m = np.max(np.abs(inst))
-                if m > 0: inst = np.int16(inst/m*32767*0.8)
-                wavfile.write(self.inst_file, fs, np.column_stack((inst, inst)))
+            # Se trabaja sobre el PCM en memoria mapeada del servicio de audio
+            data = self.audio.pcm()
+            if not self.audio.mono_source: 
+                # Por bloques de memmap a memmap: memoria acotada sea cual sea la duración.
+                # El reproductor cambia de pista al vuelo.
+                self.inst_file = tempfile.NamedTemporaryFile(suffix=".pcm", delete=False).name
+                pcm = vocals.remove_vocals(data, self.inst_file, mode, self.audio.rate)
+                self.player.add_track('inst', pcm)
+                self.player.select('inst')
                 messagebox.showinfo("OK", "Voces reducidas (Modo Preview).")
             else:
                 messagebox.showwarning("Error", "Audio Mono detectado.")
@@ -365,60 +400,154 @@ class TimelineEditor:
             print(e)
             messagebox.showerror("Error", f"Error eliminando voz: {e}")
 
+    # --- LÍNEA DE TIEMPO VIRTUALIZADA ---
+    # Solo hay items en el canvas para lo que se ve (más un margen de una
+    # pantalla a cada lado). Al hacer scroll los items que salen se esconden y
+    # se reciclan para las palabras que entran; seleccionar solo repinta las
+    # dos palabras afectadas. El coste ya no depende de la duración del tema.
+
     def draw_static_timeline(self):
-        self.cv_tl.delete('all')
-        if not self.words_data: return
-        
+        # Los datos cambiaron (edición, undo, lote nuevo...): se re-pintan los
+        # items del viewport, nada más. self.index ya debe estar al día.
         # Forzar conversión a float puro de Python para evitar errores de Numpy
-        duracion_total = float(max(self.dur, self.words_data[-1]['end'] + 2))
-        total_w = int(duracion_total * self.px_per_sec)
-        
-        self.cv_tl.config(scrollregion=(0, 0, total_w, 500))
-        
-        # Dibujar Regla de Tiempo
-        for i in range(int(duracion_total) + 1):
-            x = 50 + i * self.px_per_sec
-            self.cv_tl.create_line(x, 0, x, 300, fill='#444')
-            self.cv_tl.create_text(x, 15, text=str(i), fill='#888', font=('Arial', 8))
-            for d in range(1, 10):
-                sx = x + (d * self.px_per_sec / 10)
-                self.cv_tl.create_line(sx, 0, sx, 10, fill='#222')
-        
-        # Dibujar Palabras en Zig-Zag
-        base_y = 50
-        for i, w in enumerate(self.words_data):
-            # Casting explícito a float y luego int para coordenadas
-            start_t = float(w['start'])
-            end_t = float(w['end'])
-            
-            x1 = int(50 + start_t * self.px_per_sec)
-            x2 = int(50 + end_t * self.px_per_sec)
-            
-            # Asegurar ancho mínimo de 2 pixeles para que se vea
-            if x2 - x1 < 2: x2 = x1 + 2
-            w_px = x2 - x1
-            
-            # Lógica ZIG-ZAG: Alternar altura para que no se encimen los textos
-            # Las pares van arriba, las impares abajo
-            if i % 2 == 0:
-                y = base_y
-            else:
-                y = base_y + 40  # 40 pixeles más abajo
-            
-            col = '#00ff88' if i == self.sel_idx else '#333'
-            txt_c = 'black' if i == self.sel_idx else 'white'
-            outline_c = 'white' if i == self.sel_idx else '#666'
-            tag = f"w_{i}"
-            
-            # Caja
-            self.cv_tl.create_rectangle(x1, y, x1+w_px, y+30, fill=col, outline=outline_c, tags=tag)
-            
-            # Texto (Centrado en la caja)
-            # Si la caja es muy chica, el texto se saldrá, pero como está en ZigZag ya no tapará al vecino
-            self.cv_tl.create_text(x1 + w_px/2, y + 15, text=w['text'], fill=txt_c, font=('Arial', 9, 'bold'), tags=tag)
-
-        # Cursor rojo
-        self.cv_tl.create_line(50, 0, 50, 300, fill='red', width=2, tags='cursor')
+        max_ends = self.index.max_ends
+        duracion_total = float(max(self.dur, max_ends[-1] + 2)) if max_ends else float(self.dur)
+        self.cv_tl.config(scrollregion=(0, 0, int(duracion_total * self.px_per_sec), 500))
+        if not self.cv_tl.find_withtag('cursor'):
+            # Cursor rojo
+            self.cv_tl.create_line(50, 0, 50, 300, fill='red', width=2, tags='cursor')
+            # Forma de onda: un único polígono detrás de todo, se rehace con el viewport
+            self.cv_tl.create_polygon(0, 0, 0, 0, fill='#1c2b4a', outline='#2a3f66', tags='wave')
+            self.cv_tl.tag_lower('wave')
+        # Los items ya colocados se reaprovechan: solo se repintan con los datos nuevos
+        n = len(self.words_data)
+        for i in [i for i in self.word_items if i >= n]: self._release_word(i)
+        kept = list(self.word_items)
+        self.refresh_viewport()
+        for i in kept:
+            if i in self.word_items: self.paint_word(i)
+
+    def _on_xscroll(self, first, last):
+        self.h_scr.set(first, last)
+        self.schedule_refresh()
+
+    def schedule_refresh(self, e=None):
+        # Varios eventos de scroll seguidos = un solo refresco
+        if self._refresh_pending: return
+        self._refresh_pending = True
+        self.window.after_idle(self.refresh_viewport)
+
+    def refresh_viewport(self):
+        self._refresh_pending = False
+        w = max(self.cv_tl.winfo_width(), 1)
+        x0 = self.cv_tl.canvasx(0)
+        t0 = max(0.0, (x0 - w - 50) / self.px_per_sec)
+        t1 = (x0 + 2 * w - 50) / self.px_per_sec
+
+        lo, hi = self.index.range(t0, t1)
+        for i in [i for i in self.word_items if i < lo or i >= hi]: self._release_word(i)
+        for i in range(lo, hi):
+            if i not in self.word_items: self._place_word(i)
+
+        step = self.ruler_step()
+        secs = range(int(t0 // step) * step, int(t1) + 1, step)
+        for s in [s for s in self.ruler_items if s not in secs]: self._release_second(s)
+        for s in secs:
+            if s not in self.ruler_items: self._place_second(s, step)
+        self.draw_wave(x0, w)
+        self.cv_tl.tag_raise('cursor')
+
+    def ruler_step(self):
+        # Segundos entre marcas grandes de la regla: al menos ~60 px entre ellas
+        return next((s for s in RULER_STEPS if s * self.px_per_sec >= 60), RULER_STEPS[-1])
+
+    def _release_second(self, s):
+        ids = self.ruler_items.pop(s)
+        for it in ids: self.cv_tl.itemconfig(it, state='hidden')
+        self.ruler_pool.append(ids)
+
+    def draw_wave(self, x0, w):
+        # Solo las columnas de pixel visibles (más medio viewport a cada lado)
+        if self.peaks is None: return
+        a = max(50, int(x0 - w / 2)); n = 2 * w
+        mins, maxs = self.peaks.columns((a - 50) / self.px_per_sec, n, self.px_per_sec)
+        if not len(mins): return
+        xs = np.arange(a, a + len(mins), dtype=np.float32)
+        top = np.column_stack((xs, WAVE_Y - maxs * WAVE_H))
+        bot = np.column_stack((xs[::-1], WAVE_Y - mins[::-1] * WAVE_H))
+        self.cv_tl.coords('wave', *np.concatenate((top, bot)).ravel().round(1).tolist())
+
+    def on_zoom(self, e):
+        # Ctrl + rueda: zoom centrado en el instante bajo el ratón
+        up = getattr(e, 'delta', 0) > 0 or getattr(e, 'num', None) == 4
+        pps = min(ZOOM_MAX, max(ZOOM_MIN, self.px_per_sec * (1.25 if up else 0.8)))
+        if pps == self.px_per_sec: return 'break'
+        t = (self.cv_tl.canvasx(e.x) - 50) / self.px_per_sec
+        self.px_per_sec = pps
+        for s in list(self.ruler_items): self._release_second(s)
+        self.draw_static_timeline()
+        total = float(self.cv_tl.cget('scrollregion').split()[2])
+        self.cv_tl.xview_moveto(max(0.0, (50 + t * pps - e.x) / total))
+        return 'break'
+
+    def _place_second(self, s, step=1):
+        # Regla de tiempo: línea + número + 9 marcas intermedias (décimas con paso 1 s)
+        if self.ruler_pool:
+            ids = self.ruler_pool.pop()
+            for it in ids: self.cv_tl.itemconfig(it, state='normal')
+        else:
+            ids = [self.cv_tl.create_line(0, 0, 0, 0, fill='#444'),
+                   self.cv_tl.create_text(0, 0, fill='#888', font=('Arial', 8))]
+            ids += [self.cv_tl.create_line(0, 0, 0, 0, fill='#222') for _ in range(9)]
+            for it in ids: self.cv_tl.tag_lower(it)
+        x = 50 + s * self.px_per_sec
+        self.cv_tl.coords(ids[0], x, 0, x, 300)
+        self.cv_tl.coords(ids[1], x, 15); self.cv_tl.itemconfig(ids[1], text=str(s))
+        for d in range(1, 10):
+            sx = x + (d * step * self.px_per_sec / 10)
+            self.cv_tl.coords(ids[1 + d], sx, 0, sx, 10)
+        self.ruler_items[s] = ids
+
+    def _place_word(self, i):
+        if self.item_pool:
+            rect, txt = self.item_pool.pop()
+            self.cv_tl.itemconfig(rect, state='normal'); self.cv_tl.itemconfig(txt, state='normal')
+        else:
+            rect = self.cv_tl.create_rectangle(0, 0, 0, 0, tags='word')
+            txt = self.cv_tl.create_text(0, 0, font=('Arial', 9, 'bold'), tags='word')
+        self.word_items[i] = (rect, txt)
+        self.paint_word(i)
+
+    def _release_word(self, i):
+        rect, txt = self.word_items.pop(i)
+        self.cv_tl.itemconfig(rect, state='hidden'); self.cv_tl.itemconfig(txt, state='hidden')
+        self.item_pool.append((rect, txt))
+
+    def paint_word(self, i, w=None):
+        # Actualiza solo los items de la palabra i (si está en pantalla); `w` = posición provisional al arrastrar
+        items = self.word_items.get(i)
+        if items is None or i >= len(self.words_data): return
+        rect, txt = items
+        if w is None: w = self.words_data[i]
+        # Casting explícito a float y luego int para coordenadas
+        x1 = int(50 + float(w['start']) * self.px_per_sec)
+        x2 = int(50 + float(w['end']) * self.px_per_sec)
+        # Asegurar ancho mínimo de 2 pixeles para que se vea
+        if x2 - x1 < 2: x2 = x1 + 2
+
+        # Lógica ZIG-ZAG: las pares van arriba, las impares 40 pixeles más abajo
+        y = 50 if i % 2 == 0 else 90
+
+        sel = i == self.sel_idx
+        self.cv_tl.coords(rect, x1, y, x2, y+30)
+        self.cv_tl.itemconfig(rect, fill='#00ff88' if sel else '#333', outline='white' if sel else '#666')
+        self.cv_tl.coords(txt, (x1 + x2) / 2, y + 15)
+        self.cv_tl.itemconfig(txt, text=w['text'], fill='black' if sel else 'white')
+
+    def select_word(self, i):
+        old, self.sel_idx = self.sel_idx, i
+        if old is not None and old != i: self.paint_word(old)
+        if i is not None: self.paint_word(i)
 
     def update_cursor(self, t):
         x = 50 + t * self.px_per_sec
@@ -430,8 +559,8 @@ class TimelineEditor:
 
     def clock_loop(self):
         if not self.playing: return
-        t = self.offset + (time.time() - self.start_time)
-        if t > self.dur: self.stop(); return
+        t = self.player.position()
+        if t > self.dur or not self.player.playing: self.stop(); return
         
         min_cur, sec_cur = divmod(t, 60)
         min_tot, sec_tot = divmod(self.dur, 60)
@@ -442,23 +571,16 @@ class TimelineEditor:
         self.lbl_sec.config(text=f"({t:.4f}s)")
         
         self.update_cursor(t)
-        self.cv_prev.delete('all')
-        act = next((w for w in self.words_data if w['start'] <= t <= w['end']), None)
-        if act:
-            self.cv_prev.create_text(self.cv_prev.winfo_width()/2, 100, text=act['text'], fill='#00ff88', font=('Arial', 36, 'bold'))
+        self.show_preview(t)
         self.window.after(30, self.clock_loop)
 
     def toggle_play(self):
-        if not self.audio_file: return
-        to_play = self.inst_file if (self.inst_file and os.path.exists(self.inst_file)) else self.audio_file
+        if not self.player: return
         if self.playing:
-            self.offset += time.time() - self.start_time
-            pygame.mixer.music.pause()
+            self.offset = self.player.pause()
             self.playing = False
         else:
-            pygame.mixer.music.load(to_play)
-            pygame.mixer.music.play(start=self.offset)
-            self.start_time = time.time()
+            self.player.play(self.offset)
             self.playing = True
             self.clock_loop()
 
@@ -468,87 +590,139 @@ class TimelineEditor:
         self.toggle_play()
 
     def stop(self):
-        pygame.mixer.music.stop()
+        if self.player: self.player.stop()
         self.playing = False
         self.offset = 0
         self.update_cursor(0)
+        self.show_preview(0)
         min_tot, sec_tot = divmod(self.dur, 60)
         self.lbl_time.config(text=f"00:00 / {int(min_tot):02}:{int(sec_tot):02}")
 
-    def on_click(self, e):
+    def on_click(self, e, scrub=False):
         self.window.focus_set()
+        if not scrub: self.drag = None
         x = self.cv_tl.canvasx(e.x); y = self.cv_tl.canvasy(e.y)
-        item = self.cv_tl.find_closest(x, y)
-        tags = self.cv_tl.gettags(item)
         clicked = False
-        for t in tags:
-            if t.startswith('w_'):
-                self.sel_idx = int(t.split('_')[1])
-                w = self.words_data[self.sel_idx]
-                self.v_txt.set(w['text']); self.v_start.set(w['start']); self.v_end.set(w['end'])
-                self.draw_static_timeline()
-                clicked = True; break
+        # Hit-test por tiempo + fila del zig-zag (pares arriba, impares abajo), con 3 px de tolerancia
+        row = 0 if 50 <= y <= 80 else 1 if 90 <= y <= 120 else None
+        idx = self.index.hit((x - 50) / self.px_per_sec, 3 / self.px_per_sec, row) if row is not None else None
+        if idx is not None:
+            w = self.words_data[idx]
+            self.v_txt.set(w['text']); self.v_start.set(w['start']); self.v_end.set(w['end'])
+            self.select_word(idx)
+            if not scrub: self.drag = (idx, (x - 50) / self.px_per_sec - w['start'], x, None)
+            clicked = True
         if not clicked or y < 40:
             t = max(0, (x - 50) / self.px_per_sec)
             self.offset = t
-            if self.playing:
-                pygame.mixer.music.stop()
-                to_play = self.inst_file if (self.inst_file and os.path.exists(self.inst_file)) else self.audio_file
-                pygame.mixer.music.load(to_play)
-                pygame.mixer.music.play(start=t)
-                self.start_time = time.time()
+            if self.player:
+                # Al arrastrar: scrub con throttle (y un fragmento audible en pausa)
+                if scrub: self.player.scrub(t)
+                else: self.player.seek(t)
             self.update_cursor(t)
+            self.show_preview(t)
             min_cur, sec_cur = divmod(t, 60)
             min_tot, sec_tot = divmod(self.dur, 60)
             time_str = f"{int(min_cur):02}:{int(sec_cur):02} / {int(min_tot):02}:{int(sec_tot):02}"
             self.lbl_time.config(text=time_str)
 
-    def on_drag(self, e): self.on_click(e)
+    def on_drag(self, e):
+        if self.drag is None: self.on_click(e, scrub=True); return
+        # Arrastrar una palabra: se mueve entera y el inicio se pega al onset más cercano
+        i, grab, x0, _ = self.drag
+        x = self.cv_tl.canvasx(e.x)
+        if abs(x - x0) < 3: return
+        w = self.words_data[i]
+        start = max(0.0, (x - 50) / self.px_per_sec - grab)
+        if self.onsets is not None:
+            start = float(snap_times([start], self.onsets, max(SNAP_TOLERANCE, SNAP_PX / self.px_per_sec))[0])
+        moved = {'text': w['text'], 'start': start, 'end': start + (w['end'] - w['start'])}
+        self.drag = (i, grab, x0, moved)
+        self.v_start.set(moved['start']); self.v_end.set(moved['end'])
+        self.paint_word(i, moved)
+
+    def on_release(self, e):
+        drag, self.drag = self.drag, None
+        if drag is None or drag[3] is None: return
+        self.replace_words(drag[0], drag[0] + 1, [drag[3]])
+        self.sel_idx = None
+        self.draw_static_timeline()
+
+    def auto_snap(self):
+        # Todos los inicios y finales al onset más cercano: un único paso de deshacer
+        if self.onsets is None:
+            messagebox.showinfo("Karaoke", "Analizando el audio, inténtalo en unos segundos.")
+            return
+        self.splice(0, len(self.words_data), snap_words(self.words_data, self.onsets))
+        self.sel_idx = None
+        self.draw_static_timeline()
+        self.window.focus_set()
 
     def apply_edit(self):
         if self.sel_idx is None: return
-        self.save_hist()
-        w = self.words_data[self.sel_idx]
-        w['text'] = self.v_txt.get()
-        w['start'] = self.v_start.get()
-        w['end'] = self.v_end.get()
-        self.words_data = refine_word_segments(self.words_data)
+        i = self.sel_idx
+        w = {'text': self.v_txt.get(), 'start': self.v_start.get(), 'end': self.v_end.get()}
+        self.replace_words(i, i+1, [w], kind='edit')
         self.sel_idx = None
         self.draw_static_timeline()
         self.window.focus_set()
 
+    def replace_words(self, lo, hi, new, kind=None):
+        # La pista ya está refinada: al cambiar [lo, hi) basta con refinar ese
+        # tramo y sus vecinas, salvo que el cambio empuje más allá o altere el orden
+        words = self.words_data
+        n = len(words)
+        a, b = max(0, lo-1), min(n, hi+1)
+        local = refine_word_segments(words[a:lo] + new + words[hi:b])
+        if local and not ((a == 0 or words[a-1]['end'] <= local[0]['start']) and (b == n or local[-1]['end'] <= words[b]['start'])):
+            # Refinado completo; el historial solo guarda la zona que de verdad cambió
+            a, b, local = 0, n, refine_word_segments(words[:lo] + new + words[hi:])
+        self.splice(a, b, local, kind)
+
+    def splice(self, lo, hi, new, kind=None, record=True):
+        if record: self.history.record(lo, self.words_data[lo:hi], new, kind)
+        self.words_data[lo:hi] = new
+        self.index.splice(lo, hi, new)
+        self.refresh_preview()
+
     def delete_word(self):
         if self.sel_idx is None: return
-        self.save_hist()
-        del self.words_data[self.sel_idx]
+        self.splice(self.sel_idx, self.sel_idx + 1, [])
         self.sel_idx = None
         self.draw_static_timeline()
         self.window.focus_set()
 
     def add_word(self):
-        self.save_hist()
         t = self.offset
-        self.words_data.append({'text': 'NEW', 'start': t, 'end': t+1})
-        self.words_data = refine_word_segments(self.words_data)
+        k = bisect_right(self.index.starts, t)
+        self.replace_words(k, k, [{'text': 'NEW', 'start': t, 'end': t+1}])
         self.draw_static_timeline()
         self.window.focus_set()
 
-    def save_hist(self):
-        self.history = self.history[:self.hist_idx+1]
-        self.history.append([w.copy() for w in self.words_data])
-        self.hist_idx += 1
+    def append_words(self, words):
+        # Lotes que llegan mientras se sigue transcribiendo (modo streaming).
+        # No es una edición: no entra en el historial, y como solo crece por el
+        # final los deltas ya guardados siguen siendo válidos.
+        if not words: return
+        tail = self.words_data[-1:]
+        merged = refine_word_segments(tail + words)
+        n = len(self.words_data)
+        self.splice(n-len(tail), n, merged, record=False)
+        self.draw_static_timeline()
 
     def undo(self):
-        if self.hist_idx > 0:
-            self.hist_idx -= 1; self.words_data = [w.copy() for w in self.history[self.hist_idx]]; self.draw_static_timeline()
+        op = self.history.undo()
+        if op: self.splice(*op, record=False); self.draw_static_timeline()
     def redo(self):
-        if self.hist_idx < len(self.history)-1:
-            self.hist_idx += 1; self.words_data = [w.copy() for w in self.history[self.hist_idx]]; self.draw_static_timeline()
+        op = self.history.redo()
+        if op: self.splice(*op, record=False); self.draw_static_timeline()
     def save(self): self.on_save(self.words_data); self.close()
     def close(self):
-        pygame.mixer.music.stop()
-        try: os.remove(self.audio_file)
-        except: pass
+        # El WAV es del servicio de audio compartido: no se borra
+        if self.player: self.player.close(); self.player = None
+        if self._preview_job: self.window.after_cancel(self._preview_job)
+        if self.preview: self.preview.close(); self.preview = None
+        gc.collect()
         if self.inst_file:
             try: os.remove(self.inst_file)
             except: pass
@@ -563,10 +737,18 @@ class KaraokeGenerator:
         self.lang = 'es'
         self.words = []
         self.vid_path = None
+        self.editor = None
+        self.aligned_lyrics = ""    # letra con la que se alinearon self.words
+        self.aligned_model = None
+        self.raw = []               # transcript crudo de Whisper (se guarda en el proyecto)
+        self.project = None         # Project abierto (.smproj): guardar = añadir al diario
+        self._saver = ThreadPoolExecutor(max_workers=1)   # guardados del proyecto en orden, fuera del hilo de Tk
         self.root.title("SubMaster AI")
         self.root.geometry("1100x900")
         self.root.configure(bg='#0a0e27')
         self.ui()
+        # Cargar el modelo por defecto mientras el usuario elige el video
+        preload_model(self.v_mod.get())
 
     def ui(self):
         fr = tk.Frame(self.root, bg='#0a0e27', padx=20, pady=20)
@@ -579,10 +761,12 @@ class KaraokeGenerator:
         self.lbl_v = tk.Label(cf, text=TRANSLATIONS[self.lang]['no_video'], bg='#151b35', fg='gray')
         self.lbl_v.pack(side=tk.LEFT)
         tk.Button(cf, text=TRANSLATIONS[self.lang]['select_video'], command=self.sel_vid, bg='#00ff88').pack(side=tk.RIGHT)
+        tk.Button(cf, text="📂 "+TRANSLATIONS[self.lang]['open_project'], command=self.open_project, bg='#151b35', fg='white').pack(side=tk.RIGHT, padx=5)
         
         st = tk.Frame(fr, bg='#151b35', padx=10, pady=10); st.pack(fill=tk.X, pady=5)
         self.v_mod = tk.StringVar(value='small')
         self.mk_cb(st, TRANSLATIONS[self.lang]['model'], self.v_mod, ['tiny', 'base', 'small'])
+        self.v_mod.trace('w', lambda *a: preload_model(self.v_mod.get()))
         self.v_font = tk.StringVar(value='Arial')
         self.mk_cb(st, TRANSLATIONS[self.lang]['font'], self.v_font, sorted(tkfont.families()))
         self.font_p = tk.Label(st, text="Abc", bg='black', fg='white', font=('Arial',12))
@@ -613,6 +797,9 @@ class KaraokeGenerator:
             TRANSLATIONS[self.lang]['full']
         ]
         self.mk_cb(row_vis, TRANSLATIONS[self.lang]['visible_words'], self.v_vis, vis_opts)
+        # Disposición por frase (\k / \t): solo clásico, barrido y fade; el resto sigue por palabra
+        self.v_phrase = tk.BooleanVar(value=False)
+        tk.Checkbutton(row_vis, text=TRANSLATIONS[self.lang]['phrase_layout'], variable=self.v_phrase, bg='#151b35', fg='white', selectcolor='#0a0e27', activebackground='#151b35').pack(side=tk.LEFT, padx=5)
 
         tk.Label(fr, text=TRANSLATIONS[self.lang]['lyrics'], bg='#0a0e27', fg='#00ff88').pack(anchor='w')
         self.txt = scrolledtext.ScrolledText(fr, height=8, bg='#0f121f', fg='white', insertbackground='white')
@@ -628,6 +815,8 @@ class KaraokeGenerator:
         self.b_ex.pack(side=tk.LEFT, fill=tk.X, expand=True, padx=2)
         self.b_rn = tk.Button(b2, text="🎬 "+TRANSLATIONS[self.lang]['generate_video'], command=self.gen, bg='#f44336', state='disabled')
         self.b_rn.pack(side=tk.LEFT, fill=tk.X, expand=True, padx=2)
+        self.b_pj = tk.Button(b2, text="💾 "+TRANSLATIONS[self.lang]['save_project'], command=self.save_project, bg='#9c27b0', fg='white', state='disabled')
+        self.b_pj.pack(side=tk.LEFT, fill=tk.X, expand=True, padx=2)
         
         self.pb = ttk.Progressbar(fr, mode='indeterminate'); self.pb.pack(fill=tk.X, pady=5)
         self.log_l = tk.Label(fr, text="Ready.", bg='#0a0e27', fg='gray'); self.log_l.pack(anchor='w')
@@ -638,20 +827,20 @@ class KaraokeGenerator:
     def mk_col(self, p, l, v):
         tk.Label(p, text=l, bg='#151b35', fg='white').pack(side=tk.LEFT)
         b = tk.Label(p, bg=v.get(), width=3, relief='solid'); b.pack(side=tk.LEFT, padx=5)
+        v.trace('w', lambda *a: b.config(bg=v.get()))   # también al cargar un proyecto
         b.bind("<Button-1>", lambda e: (c := colorchooser.askcolor(v.get())[1], v.set(c) if c else None, b.config(bg=v.get())))
 
     def sel_vid(self):
         f = filedialog.askopenfilename()
         if f: 
             self.vid_path = f
+            self.aligned_lyrics = ""
+            self.raw, self.project = [], None
             self.lbl_v.config(text=os.path.basename(f), fg='white')
             
-            # --- CORREGIDO: USAR MOVIEPY PARA DETECTAR RESOLUCIÓN (100% SEGURO) ---
+            # --- RESOLUCIÓN VÍA FFPROBE (cacheado, sin abrir el contenedor) ---
             try:
-                # Usamos with para asegurar que el archivo se cierra
-                with VideoFileClip(f) as clip:
-                    width = clip.w
-                    height = clip.h
+                width, height = probe_media(f).display_size
                 
                 t = TRANSLATIONS[self.lang]
                 
@@ -665,7 +854,7 @@ class KaraokeGenerator:
                     self.log_l.config(text="💻 Horizontal detected: Balanced mode set.")
                     
             except Exception as e:
-                # Si falla moviepy (raro), simplemente no cambiamos el modo y logueamos
+                # Si falla el probe (raro), simplemente no cambiamos el modo y logueamos
                 print(f"Warning: Resolution detection failed: {e}")
                 self.log_l.config(text="Video loaded.")
     
@@ -677,89 +866,57 @@ class KaraokeGenerator:
     def run(self):
         if not self.vid_path: return
         self.b_run.config(state='disabled'); self.pb.start(10)
-        threading.Thread(target=self.process, daemon=True).start()
+        cfg = pipeline.TranscribeConfig(model=self.v_mod.get())
+        # Audios largos en CPU: transcripción por trozos en varios procesos
+        try: cfg.workers = auto_workers(probe_media(self.vid_path).duration)
+        except Exception: pass
+        ly = self.txt.get("1.0", tk.END).strip()
+        threading.Thread(target=self.process, args=(cfg, ly), daemon=True).start()
 
     def safe_log(self, t): self.root.after(0, lambda: self.log_l.config(text=t))
 
-    def process(self):
+    def style_config(self):
+        # Foto de las variables Tk: los hilos de trabajo nunca leen Tk directamente
+        t = TRANSLATIONS[self.lang]
+        eff_key = next((k for k in EFFECT_KEYS if t[k] == self.v_ef.get()), 'fx_color')
+        vis_key = next((k for k in VISIBLE_KEYS if t[k] == self.v_vis.get()), 'balanced')
+        return pipeline.StyleConfig(effect=eff_key, font=self.v_font.get(), size=self.v_sz.get(),
+                                    active=self.c_act.get(), inactive=self.c_pas.get(),
+                                    position=self.v_pos.get(), visible=vis_key,
+                                    layout='phrase' if self.v_phrase.get() else 'word')
+
+    def confirm_lyrics(self, porcentaje):
+        msg = (f"⚠️ ALERTA DE DISCREPANCIA GRAVE ⚠️\n\n"
+               f"El texto que pegaste coincide solo un {porcentaje}% con el audio.\n\n"
+               f"Si continúas, el video quedará desincronizado.\n\n"
+               f"¿Qué deseas hacer?")
+        # SÍ = forzar la letra, NO = usar lo que escuchó la IA
+        return messagebox.askyesno("SubMaster AI - Seguridad",
+                                   msg + "\n\nSÍ = Forzar mi texto (Riesgoso)\nNO = Ignorar mi texto y usar lo que escuchó la IA")
+
+    def process(self, cfg, ly):
         try:
             self.safe_log(TRANSLATIONS[self.lang]['log_dl'])
+            pipeline.check_ffmpeg()
             
-            try:
-                subprocess.run([FFMPEG_EXE, "-version"], stdout=subprocess.PIPE, stderr=subprocess.PIPE, check=True)
-            except Exception as e:
-                raise RuntimeError(f"Error crítico: No se puede ejecutar FFmpeg en la ruta: {FFMPEG_EXE}.\nDetalle: {e}")
-
-            model = whisper.load_model(self.v_mod.get())
-            
+            # Si el audio ya se transcribió con este modelo, sale de la caché al instante
             self.safe_log(TRANSLATIONS[self.lang]['log_tr'])
-            res = model.transcribe(self.vid_path, word_timestamps=True, fp16=False)
+            if not ly:
+                # Sin letra no hay que esperar al final: el editor se llena por lotes
+                self.aligned_lyrics = ""
+                self.process_stream(cfg); return
+            # Transcript del proyecto abierto (mismo modelo): ni Whisper ni caché
+            raw = self.raw if self.raw and self.aligned_model == cfg.model else pipeline.transcribe(self.vid_path, cfg)
             
-            # Palabras crudas de la IA
-            raw = [{'text': w['word'], 'start': w['start'], 'end': w['end']} for s in res['segments'] for w in s['words']]
-            
-            ly = self.txt.get("1.0", tk.END).strip()
-            
-            # --- LÓGICA DE PROTECCIÓN ---
-            usar_texto_usuario = False
-            
-            if ly:
-                self.safe_log("Analizando similitud...")
-                # Normalizamos para comparar peras con peras
-                cl = [w for w in re.split(r'\s+', ly) if w]
-                
-                # Texto IA unido
-                str_ai = " ".join([normalize_text(w['text']) for w in raw])
-                # Texto Usuario unido
-                str_user = " ".join([normalize_text(w) for w in cl])
-                
-                # Calculamos porcentaje de parecido (0.0 a 1.0)
-                ratio = SequenceMatcher(None, str_ai, str_user).ratio()
-                porcentaje = int(ratio * 100)
-                
-                if porcentaje < 40: # UMBRAL DE SEGURIDAD (40%)
-                    msg = (f"⚠️ ALERTA DE DISCREPANCIA GRAVE ⚠️\n\n"
-                           f"El texto que pegaste coincide solo un {porcentaje}% con el audio.\n\n"
-                           f"Si continúas, el video quedará desincronizado.\n\n"
-                           f"¿Qué deseas hacer?")
-                    
-                    respuesta = messagebox.askyesno("SubMaster AI - Seguridad", 
-                                                    msg + "\n\nSÍ = Forzar mi texto (Riesgoso)\nNO = Ignorar mi texto y usar lo que escuchó la IA")
-                    
-                    if respuesta: # Dijo SÍ, forzar
-                        usar_texto_usuario = True
-                    else: # Dijo NO, usar IA
-                        usar_texto_usuario = False
-                        self.safe_log("Usando transcripción automática de IA...")
-                else:
-                    # Si el parecido es bueno, usamos el texto del usuario sin preguntar
-                    usar_texto_usuario = True
-
-            # --- ALINEACIÓN O USO DIRECTO ---
-            if usar_texto_usuario and ly:
-                self.safe_log(TRANSLATIONS[self.lang]['log_al'])
-                cl = [w for w in re.split(r'\s+', ly) if w]
-                wn = [normalize_text(w['text']) for w in raw]
-                un = [normalize_text(w) for w in cl]
-                sm = SequenceMatcher(None, wn, un)
-                fin = []
-                for tag, i1, i2, j1, j2 in sm.get_opcodes():
-                    if tag == 'equal':
-                        for k in range(j2-j1): fin.append({'text': cl[j1+k], 'start': raw[i1+k]['start'], 'end': raw[i1+k]['end']})
-                    elif tag == 'replace':
-                        if i2 > i1:
-                            st, en = raw[i1]['start'], raw[i2-1]['end']
-                            dur = (en-st)/(j2-j1)
-                            for k in range(j2-j1): fin.append({'text': cl[j1+k], 'start': st+k*dur, 'end': st+(k+1)*dur})
-                    elif tag == 'insert':
-                        le = fin[-1]['end'] if fin else 0.0
-                        for k in range(j2-j1): fin.append({'text': cl[j1+k], 'start': le, 'end': le+0.5}); le+=0.5
-                self.words = fin
-            else:
-                # Usamos lo que escuchó la IA directamente
-                self.words = raw
-            
-            self.words = refine_word_segments(self.words)
+            # Letra corregida sobre un proyecto ya alineado: solo se re-alinea lo que cambió
+            words = None
+            if self.aligned_lyrics and self.words and self.aligned_model == cfg.model:
+                words = pipeline.realign_lyrics(self.words, raw, ly, log=self.safe_log)
+            if words is None:
+                words, used, _ = pipeline.resolve_words(raw, ly, confirm=self.confirm_lyrics, log=self.safe_log)
+                if not used: ly = ""
+            self.words, self.raw = words, raw
+            self.aligned_lyrics, self.aligned_model = ly, cfg.model
             self.safe_log(f"Done. {len(self.words)} words.")
             self.root.after(0, self.enable)
 
@@ -769,6 +926,38 @@ class KaraokeGenerator:
             self.safe_log("Error Crítico Detectado.")
             self.root.after(0, lambda: self.show_error_popup(full_error))
 
+    def process_stream(self, cfg):
+        n, raw = 0, []
+        for batch in pipeline.iter_transcribe(self.vid_path, cfg):
+            raw.extend(batch)
+            words = refine_word_segments(batch)
+            # Ventanas vacías (intro instrumental) no cuentan: el editor se abre con el primer lote con palabras
+            if not words: continue
+            self.root.after(0, lambda w=words, first=(n == 0): self.stream_words(w, first))
+            n += len(words)
+            self.safe_log(f"{TRANSLATIONS[self.lang]['log_tr']} {n} words")
+        self.raw, self.aligned_model = raw, cfg.model
+        self.safe_log(f"Done. {n} words.")
+        self.root.after(0, self.stream_done)
+
+    def stream_words(self, words, first):
+        if first:
+            # Primer lote: ya se puede editar y reproducir el principio
+            self.words = words
+            self.pb.stop()
+            self.b_ed.config(state='normal')
+            self.open_ed()
+            return
+        tail = self.words[-1:]
+        self.words[len(self.words)-len(tail):] = refine_word_segments(tail + words)
+        if self.editor and self.editor.window.winfo_exists():
+            self.editor.append_words(words)
+
+    def stream_done(self):
+        self.pb.stop()    # por si no llegó ningún lote con palabras
+        self.b_run.config(state='normal')
+        self.b_ed.config(state='normal'); self.b_ex.config(state='normal'); self.b_rn.config(state='normal'); self.b_pj.config(state='normal')
+
     def show_error_popup(self, error_text):
         err_win = tk.Toplevel(self.root)
         err_win.title("ERROR CRÍTICO - CÓPIALO Y ENVÍALO")
@@ -787,146 +976,140 @@ class KaraokeGenerator:
     def enable(self):
         self.pb.stop()
         self.b_run.config(state='normal')
-        self.b_ed.config(state='normal'); self.b_ex.config(state='normal'); self.b_rn.config(state='normal')
+        self.b_ed.config(state='normal'); self.b_ex.config(state='normal'); self.b_rn.config(state='normal'); self.b_pj.config(state='normal')
         self.open_ed()
 
-    def open_ed(self): TimelineEditor(self.root, self.words, self.vid_path, self.cb_save, self.lang)
-    def cb_save(self, w): self.words = w; self.safe_log("Saved.")
+    def open_ed(self):
+        pj = self.project
+        self.editor = TimelineEditor(self.root, self.words, self.vid_path, self.cb_save, self.lang, self.style_config(),
+                                     peaks=pj.peaks if pj else None, onsets=pj.onsets.onsets if pj and pj.onsets else None)
+    def cb_save(self, w):
+        self.words = w
+        if self.project: self.save_project()
+        else: self.safe_log("Saved.")
+
+    # --- PROYECTO (.smproj) ---
+    def save_project(self):
+        if not self.words: return
+        if self.project:
+            # Ya guardado: solo lo que cambió, al final del diario. En otro hilo: si el
+            # diario pasa del umbral se compacta y eso reescribe el archivo entero
+            self._saver.submit(self._save_journal, self.project, list(self.words), list(self.raw),
+                               asdict(self.style_config()), self.aligned_lyrics, self.aligned_model)
+            return
+        f = filedialog.asksaveasfilename(defaultextension=PROJECT_EXT, filetypes=[("SubMaster", "*" + PROJECT_EXT)])
+        if not f: return
+        # Primera vez: archivo completo con picos y onsets (si no estaban calculados, tarda)
+        args = (f, self.vid_path, list(self.words), list(self.raw), self.style_config(), self.aligned_lyrics, self.aligned_model)
+        threading.Thread(target=self._save_project_thread, args=args, daemon=True).start()
+
+    def _save_journal(self, pj, words, raw, style, lyrics, model):
+        try:
+            # Re-transcrito con otro modelo: transcript y modelo van juntos en un registro
+            if raw and model != pj.meta.get('model'): pj.set_raw(raw, model=model)
+            pj.set_words(words)
+            pj.set_meta(style=style, lyrics=lyrics, model=model)
+            self.safe_log(f"Saved: {os.path.basename(pj.path)}")
+        except Exception:
+            full_error = traceback.format_exc()
+            self.root.after(0, lambda: self.show_error_popup(full_error))
+
+    def _save_project_thread(self, path, *args):
+        self.safe_log(f"Saving {os.path.basename(path)}...")
+        try:
+            pj = pipeline.save_project(path, *args)
+            self.root.after(0, lambda: setattr(self, 'project', pj))
+            self.safe_log(f"Saved: {os.path.basename(path)}")
+        except Exception:
+            full_error = traceback.format_exc()
+            self.root.after(0, lambda: self.show_error_popup(full_error))
+
+    def open_project(self):
+        f = filedialog.askopenfilename(filetypes=[("SubMaster", "*" + PROJECT_EXT)])
+        if not f: return
+        try: pj = Project(f); words, raw = pj.words.to_dicts(), pj.raw()
+        except Exception as e:
+            messagebox.showerror("SubMaster AI", f"{os.path.basename(f)}: {e}")
+            return
+        video = pj.video_path()
+        if not os.path.exists(video):
+            messagebox.showerror("SubMaster AI", f"No se encuentra el video del proyecto:\n{video}")
+            return
+        # Estilo antes de tocar nada: solo los campos que conoce este StyleConfig
+        style = None
+        if isinstance(pj.style, dict):
+            known = {fd.name for fd in fields(pipeline.StyleConfig)}
+            try: style = pipeline.StyleConfig(**{k: v for k, v in pj.style.items() if k in known})
+            except Exception as e:
+                logging.warning(f"Project style ignored: {e}")
+        if pj.video_changed():
+            messagebox.showwarning("SubMaster AI", "El video cambió desde que se guardó el proyecto: revisa la sincronización.")
+        self.vid_path, self.project = video, pj
+        self.lbl_v.config(text=os.path.basename(video), fg='white')
+        self.words, self.raw = words, raw
+        self.aligned_lyrics, self.aligned_model = pj.meta.get('lyrics', ""), pj.meta.get('model')
+        if self.aligned_model: self.v_mod.set(self.aligned_model)
+        self.txt.delete("1.0", tk.END); self.txt.insert("1.0", self.aligned_lyrics)
+        if style: self.apply_style(style)
+        self.safe_log(f"{os.path.basename(f)}: {len(self.words)} words.")
+        self.enable()
+
+    def apply_style(self, st):
+        t = TRANSLATIONS[self.lang]
+        self.v_ef.set(t.get(st.effect, t['fx_color'])); self.v_vis.set(t.get(st.visible, t['balanced']))
+        self.v_font.set(st.font); self.v_sz.set(st.size); self.v_pos.set(st.position)
+        self.c_act.set(st.active); self.c_pas.set(st.inactive)
+        self.v_phrase.set(st.layout == 'phrase')
 
     def exp(self):
         f = filedialog.asksaveasfilename(defaultextension=".srt")
         if f:
             if f.endswith('.srt'): self.save_srt(f)
-            else: self.create_ass(f, self.words, (1920,1080))
+            else: self.create_ass(f, self.words, render_size(self.vid_path))
             self.safe_log("Exported.")
 
-    def save_srt(self, f):
-        with open(f, 'w', encoding='utf-8') as file:
-            for i, w in enumerate(self.words, 1):
-                def ft(s): h,r=divmod(s,3600); m,s=divmod(r,60); return f"{int(h):02}:{int(m):02}:{s:06.3f}".replace('.',',')
-                file.write(f"{i}\n{ft(w['start'])} --> {ft(w['end'])}\n{w['text']}\n\n")
+    def save_srt(self, f): pipeline.write_srt(f, self.words)
 
     def gen(self):
         out = filedialog.asksaveasfilename(defaultextension=".mp4")
         if not out: return
         self.b_rn.config(state='disabled')
-        self.pb.start(10)
-        threading.Thread(target=self._gen_thread, args=(out,), daemon=True).start()
+        # Barra determinada: el progreso real llega de ffmpeg (-progress)
+        self.pb.config(mode='determinate', maximum=1000, value=0)
+        threading.Thread(target=self._gen_thread, args=(out, self.style_config()), daemon=True).start()
 
-    def _gen_thread(self, out):
+    def _render_progress(self, p):
+        self.pb.config(value=p.fraction * 1000)
+        eta = "--:--" if p.eta is None else f"{int(p.eta) // 60}:{int(p.eta) % 60:02d}"
+        self.log_l.config(text=f"{TRANSLATIONS[self.lang]['rendering']} {p.fraction:.0%} · {p.fps:.0f} fps · {p.speed:.1f}x · ETA {eta}")
+
+    def _gen_thread(self, out, style):
         self.safe_log(TRANSLATIONS[self.lang]['rendering'])
         try:
             ass = "t.ass"
-            self.create_ass(ass, self.words, (1920,1080))
-            
-            cmd = [FFMPEG_EXE, "-i", self.vid_path, "-vf", f"ass={ass}", "-c:v", "libx264", "-preset", "ultrafast", "-c:a", "copy", "-y", out]
-            
-            if IS_WINDOWS:
-                subprocess.run(cmd, creationflags=subprocess.CREATE_NO_WINDOW, check=True)
-            else:
-                subprocess.run(cmd, check=True)
+            pipeline.write_ass(ass, self.words, style, render_size(self.vid_path))
+            # Por segmentos (varios procesos en videos largos) y con caché: tras retocar
+            # una palabra solo se recodifican los segmentos que la contienen
+            cfg = pipeline.RenderConfig(workers=auto_render_workers(probe_media(self.vid_path).duration), cache=True)
+            stats = pipeline.render_video(self.vid_path, ass, out, cfg, progress=lambda p: self.root.after(0, self._render_progress, p))
             
             if os.path.exists(ass): os.remove(ass)
             open_folder_cross_platform(out)
-            self.safe_log("Success! Video saved.")
+            self.safe_log(f"Success! Video saved. ({stats.rtf:.2f} RTF, {stats.bytes / 2**20:.1f} MB)")
         except Exception as e:
             full_error = traceback.format_exc()
             self.safe_log(f"Render Error.")
             self.root.after(0, lambda: self.show_error_popup(full_error))
         finally:
-            self.root.after(0, lambda: (self.pb.stop(), self.b_rn.config(state='normal')))
+            self.root.after(0, lambda: (self.pb.stop(), self.pb.config(mode='indeterminate', value=0), self.b_rn.config(state='normal')))
 
     def create_ass(self, filename, words, size):
-        width, height = size
-        sel_txt = self.v_ef.get()
-        current_trans = TRANSLATIONS[self.lang]
-        eff_key = next((k for k, v in current_trans.items() if v == sel_txt), 'fx_color')
-        if eff_key not in EFFECT_KEYS: eff_key = 'fx_color'
-        
-        pos, font, sz = self.v_pos.get(), self.v_font.get(), self.v_sz.get()
-        def ac(c): h=c.lstrip('#'); return f"&H00{h[4:6]}{h[2:4]}{h[0:2]}"
-        c_act = ac(self.c_act.get()); c_in = ac(self.c_pas.get())
-        
-        align, mv, ty = 2, 50, height - 100
-        if pos == 'top': align, mv, ty = 8, 50, 150
-        elif pos == 'center': align, mv, ty = 5, 0, height // 2
-        
-        border_style = "3" if eff_key == 'fx_box' else "1"
-        back_col = "&H80000000" if eff_key == 'fx_box' else "&H00000000"
-        
-        head = f"""[Script Info]\nScriptType: v4.00+\nPlayResX: {width}\nPlayResY: {height}\n[V4+ Styles]\nFormat: Name, Fontname, Fontsize, PrimaryColour, SecondaryColour, OutlineColour, BackColour, Bold, Italic, Underline, StrikeOut, ScaleX, ScaleY, Spacing, Angle, BorderStyle, Outline, Shadow, Alignment, MarginL, MarginR, MarginV, Encoding\nStyle: Default,{font},{sz},{c_act},{c_in},&H00000000,{back_col},-1,0,0,0,100,100,0,0,{border_style},2,0,{align},10,10,{mv},1\n[Events]\nFormat: Layer, Start, End, Style, Name, MarginL, MarginR, MarginV, Effect, Text\n"""
-        
-        with open(filename, 'w', encoding='utf-8') as f:
-            f.write(head)
-            def fmt(s): h,r=divmod(s,3600); m,s=divmod(r,60); return f"{int(h)}:{int(m):02d}:{s:05.2f}"
-            
-            if eff_key == 'fx_scatter':
-                for w in words:
-                    rx, ry = random.randint(width//4, width*3//4), random.randint(height//4, height*3//4)
-                    f.write(f"Dialogue: 0,{fmt(w['start'])},{fmt(w['end'])},Default,,0,0,0,,{{\\an5\\move({rx},{ry},{rx},{ry})\\fad(100,100)}}{w['text']}\n")
-                return
-
-            for i, w in enumerate(words):
-                st, en = fmt(w['start']), fmt(w['end'])
-                
-                if eff_key == 'fx_hormozi':
-                    f.write(f"Dialogue: 0,{st},{en},Default,,0,0,0,,{{\\an5\\pos({width//2},{height//2})\\fscx120\\fscy120\\1c{c_act}}}{w['text']}\n")
-                    continue
-
-                # --- CORRECCIÓN MATEMÁTICA AQUÍ ---
-                sel_vis = self.v_vis.get()
-                t = TRANSLATIONS[self.lang]
-                
-                if sel_vis == t['single']:
-                    # 1 Palabra (Solo la actual)
-                    s_idx = i
-                    e_idx = i + 1
-                elif sel_vis == t['compact']:
-                    # 4 Palabras (1 antes, 1 actual, 2 después)
-                    s_idx = max(0, i - 1)
-                    e_idx = min(len(words), i + 3)
-                elif sel_vis == t['full']:
-                    # 11 Palabras (5 antes, 1 actual, 5 después)
-                    s_idx = max(0, i - 5)
-                    e_idx = min(len(words), i + 6)
-                else: 
-                    # Balanceado (7 Palabras: 3 antes, 1 actual, 3 después)
-                    s_idx = max(0, i - 3)
-                    e_idx = min(len(words), i + 4)
-
-                vis = words[s_idx:e_idx]
-                # ----------------------------------
-
-                line = ""
-                pos_tag = ""
-                if pos == 'alternating':
-                    alt = (i // 4) % 3
-                    if alt == 0: pos_tag = f"{{\\an2\\pos({width//2},{height-50})}}"
-                    elif alt == 1: pos_tag = f"{{\\an8\\pos({width//2},50)}}"
-                    else: pos_tag = f"{{\\an5\\pos({width//2},{height//2})}}"
-                
-                if eff_key == 'fx_heart':
-                    f.write(f"Dialogue: 1,{st},{en},Default,,0,0,0,,{{\\an5\\pos({width//2},{ty-sz-20})\\1c&H0000FF&}}❤\n")
-
-                for vw in vis:
-                    if vw == w:
-                        if eff_key == 'fx_pop': line += f"{{\\fscx50\\fscy50\\t(0,100,\\fscx120\\fscy120)\\1c{c_act}}}{vw['text']} "
-                        elif eff_key == 'fx_shake': line += f"{{\\t(0,50,\\frz5)\\t(50,100,\\frz-5)\\t(100,150,\\frz0)\\1c{c_act}}}{vw['text']} "
-                        elif eff_key == 'fx_glitch': line += f"{{\\t(0,50,\\fscx110\\3c&H0000FF&)\\t(50,100,\\fscx100\\3c&H000000&)\\1c{c_act}}}{vw['text']} "
-                        elif eff_key == 'fx_slide': line += f"{{\\move({width//2},{ty+50},{width//2},{ty})\\1c{c_act}}}{vw['text']} "
-                        elif eff_key == 'fx_neon': line += f"{{\\bord5\\3c{c_act}\\blur3\\1c&HFFFFFF&}}{vw['text']} "
-                        elif eff_key == 'fx_type': line += f"{{\\alpha&H00&}}{vw['text']} "
-                        elif eff_key == 'fx_wipe': line += f"{{\\kf{int((w['end']-w['start'])*100)} \\1c{c_act}}}{vw['text']} "
-                        elif eff_key == 'fx_bounce': line += f"{{\\t(0,150,\\fscy150)\\t(150,300,\\fscy100)\\1c{c_act}}}{vw['text']} "
-                        elif eff_key == 'fx_fade': line += f"{{\\fad(100,100)\\1c{c_act}}}{vw['text']} "
-                        elif eff_key == 'fx_pulse': line += f"{{\\t(0,100,\\fscx110\\fscy110)\\t(100,200,\\fscx100\\fscy100)\\1c{c_act}}}{vw['text']} "
-                        elif eff_key == 'fx_zoom': line += f"{{\\t(0,100,\\fscx130\\fscy130)\\1c{c_act}}}{vw['text']} "
-                        else: line += f"{{\\1c{c_act}}}{vw['text']} "
-                    else:
-                        line += f"{{\\1c{c_in}}}{vw['text']} "
-                f.write(f"Dialogue: 0,{st},{en},Default,,0,0,0,,{pos_tag}{line}\n")
+        pipeline.write_ass(filename, words, self.style_config(), size)
 
 if __name__ == "__main__":
+    # Modo headless: python karaoke_generator.py batch <carpeta> --workers N
+    if len(sys.argv) > 1 and sys.argv[1] == 'batch':
+        sys.exit(pipeline.main(sys.argv[1:]))
     root = tk.Tk()
     app = KaraokeGenerator(root)
     root.mainloop()
@@ -0,0 +1,397 @@
+import hashlib
+import json
+import logging
+import os
+import re
+import struct
+import subprocess
+import threading
+from dataclasses import dataclass, field, asdict
+
+import numpy as np
+
+from karaoke_core import FFMPEG_EXE, FFPROBE_EXE, CACHE_DIR, SUBPROCESS_FLAGS
+
+# --- SERVICIO DE AUDIO COMPARTIDO ---
+# Cada entrada se decodifica UNA sola vez con un único proceso ffmpeg que saca
+# dos salidas a la vez: 44.1 kHz estéreo (playback / quitar voz, por el pipe)
+# y 16 kHz mono float32 (Whisper, a archivo). Ambas quedan en disco y se leen
+# con memmap, así transcripción, editor y quitar voz comparten el mismo PCM.
+
+PLAYBACK_RATE = 44100
+WHISPER_RATE = 16000
+DEFAULT_MAX_MB = int(os.environ.get("SUBMASTER_AUDIO_CACHE_MB", "4096"))
+
+WAV_HEADER_SIZE = 44
+
+def wav_header(frames, rate, channels, sample_bytes=2):
+    data_size = frames * channels * sample_bytes
+    return struct.pack('<4sI4s4sIHHIIHH4sI', b'RIFF', 36 + data_size, b'WAVE', b'fmt ', 16, 1, channels, rate,
+                       rate * channels * sample_bytes, channels * sample_bytes, sample_bytes * 8, b'data', data_size)
+
+class DecodedAudio:
+    def __init__(self, source, wav_path, pcm16k_path, meta):
+        self.source = source
+        self.wav_path = wav_path          # WAV PCM s16 estéreo 44.1 kHz (pygame/scipy lo abren directo)
+        self.pcm16k_path = pcm16k_path    # float32 mono 16 kHz crudo
+        self.frames = meta['frames']
+        self.digest = meta['digest']
+        self.mono_source = meta['mono']   # L == R en todo el archivo
+        self.rate = PLAYBACK_RATE
+        self._peaks = None
+
+    @property
+    def duration(self): return self.frames / float(self.rate)
+
+    def pcm(self):
+        # (frames, 2) int16, solo lectura, sin cargar nada en RAM
+        if self.frames == 0: return np.zeros((0, 2), dtype=np.int16)
+        return np.memmap(self.wav_path, dtype=np.int16, mode='r', offset=WAV_HEADER_SIZE, shape=(self.frames, 2))
+
+    def whisper_audio(self):
+        # Vista 16 kHz mono float32 para Whisper. Copy-on-write: torch la quiere escribible
+        n = os.path.getsize(self.pcm16k_path) // 4
+        if n == 0: return np.zeros(0, dtype=np.float32)
+        return np.memmap(self.pcm16k_path, dtype=np.float32, mode='c', shape=(n,))
+
+    def peaks(self):
+        # Pirámide de picos para la forma de onda; se calcula una vez y queda junto al WAV
+        if self._peaks is None:
+            path = os.path.splitext(self.wav_path)[0] + ".peaks.npz"
+            self._peaks = PeakPyramid.load(path, self.rate)
+            if self._peaks is None:
+                self._peaks = PeakPyramid.build(self.pcm(), self.rate)
+                self._peaks.save(path)
+        return self._peaks
+
+    def view(self, rate, mono):
+        if rate == WHISPER_RATE and mono: return self.whisper_audio()
+        if rate == PLAYBACK_RATE and not mono: return self.pcm()
+        if rate == PLAYBACK_RATE and mono: return self.pcm().mean(axis=1).astype(np.float32) / 32768.0
+        raise ValueError(f"Vista de audio no soportada: {rate} Hz mono={mono}")
+
+class AudioService:
+    def __init__(self, directory=os.path.join(CACHE_DIR, "audio"), max_mb=DEFAULT_MAX_MB):
+        self.dir = directory
+        self.max_bytes = int(max_mb * 1024 * 1024)
+        self._loaded = {}       # huella del archivo -> DecodedAudio
+        self._lock = threading.Lock()
+        self._key_locks = {}
+
+    @staticmethod
+    def fingerprint(path):
+        st = os.stat(path)
+        return f"{os.path.abspath(path)}|{st.st_mtime_ns}|{st.st_size}"
+
+    def get(self, path):
+        fp = self.fingerprint(path)
+        with self._lock:
+            if fp in self._loaded: return self._loaded[fp]
+            key_lock = self._key_locks.setdefault(fp, threading.Lock())
+        with key_lock:
+            with self._lock:
+                if fp in self._loaded: return self._loaded[fp]
+            audio = self._open_cached(path, fp) or self._decode(path, fp)
+            with self._lock: self._loaded[fp] = audio
+        return audio
+
+    def _paths(self, fp):
+        base = os.path.join(self.dir, hashlib.sha1(fp.encode('utf-8')).hexdigest())
+        return base + ".wav", base + ".16k.f32", base + ".json"
+
+    def _open_cached(self, path, fp):
+        wav, pcm16, meta_path = self._paths(fp)
+        try:
+            with open(meta_path, encoding='utf-8') as f: meta = json.load(f)
+            if not (os.path.exists(wav) and os.path.exists(pcm16)): return None
+            for p in (wav, pcm16, meta_path): os.utime(p)
+            return DecodedAudio(path, wav, pcm16, meta)
+        except Exception:
+            return None
+
+    def _decode(self, path, fp):
+        os.makedirs(self.dir, exist_ok=True)
+        wav, pcm16, meta_path = self._paths(fp)
+        tmp_wav, tmp_pcm16 = wav + ".part", pcm16 + ".part"
+        logging.info(f"Decoding audio once: {os.path.basename(path)}")
+        cmd = [FFMPEG_EXE, "-nostdin", "-v", "error", "-i", path, "-vn",
+               "-map", "0:a:0", "-ac", "2", "-ar", str(PLAYBACK_RATE), "-f", "s16le", "pipe:1",
+               "-map", "0:a:0", "-ac", "1", "-ar", str(WHISPER_RATE), "-f", "f32le", "-y", tmp_pcm16]
+        h = hashlib.sha256()
+        frames, mono, carry = 0, True, b""
+        with open(tmp_wav, 'wb') as out:
+            out.write(wav_header(0, PLAYBACK_RATE, 2))
+            with subprocess.Popen(cmd, stdout=subprocess.PIPE, stderr=subprocess.PIPE, **SUBPROCESS_FLAGS) as proc:
+                for chunk in iter(lambda: proc.stdout.read(1 << 20), b""):
+                    out.write(chunk); h.update(chunk)
+                    # ¿Es mono disfrazado de estéreo? (decide si se puede quitar la voz)
+                    buf = carry + chunk
+                    usable = len(buf) - len(buf) % 4
+                    carry = buf[usable:]
+                    if mono and usable:
+                        s = np.frombuffer(buf[:usable], dtype=np.int16).reshape(-1, 2)
+                        mono = bool(np.array_equal(s[:, 0], s[:, 1]))
+                    frames += usable // 4
+                err = proc.stderr.read().decode('utf-8', 'replace')
+            if proc.returncode != 0:
+                for p in (tmp_wav, tmp_pcm16):
+                    try: os.remove(p)
+                    except OSError: pass
+                raise RuntimeError(f"FFmpeg no pudo decodificar el audio de {path}:\n{err}")
+            out.seek(0); out.write(wav_header(frames, PLAYBACK_RATE, 2))
+
+        os.replace(tmp_wav, wav); os.replace(tmp_pcm16, pcm16)
+        meta = {'source': os.path.abspath(path), 'frames': frames, 'digest': h.hexdigest(), 'mono': mono}
+        with open(meta_path, 'w', encoding='utf-8') as f: json.dump(meta, f)
+        self._evict(keep=(wav, pcm16, meta_path))
+        return DecodedAudio(path, wav, pcm16, meta)
+
+    def _evict(self, keep=()):
+        # Expulsión LRU por fecha de uso; se borran los tres archivos de cada entrada juntos
+        groups = {}
+        for name in os.listdir(self.dir):
+            if name.endswith(".part"): continue
+            full = os.path.join(self.dir, name)
+            try: st = os.stat(full)
+            except OSError: continue
+            g = groups.setdefault(name.split('.')[0], [0.0, 0, []])
+            g[0] = max(g[0], st.st_mtime); g[1] += st.st_size; g[2].append(full)
+        total = sum(g[1] for g in groups.values())
+        loaded = {a.wav_path for a in self._loaded.values()}
+        for _, size, files in sorted(groups.values()):
+            if total <= self.max_bytes: break
+            if any(f in keep or f in loaded for f in files): continue
+            for f in files:
+                try: os.remove(f)
+                except OSError: pass
+            total -= size
+
+# --- PIRÁMIDE DE PICOS (FORMA DE ONDA) ---
+# Nivel 0: mínimo y máximo de cada grupo de PEAK_BASE frames (ambos canales);
+# cada nivel siguiente junta pares del anterior. Para dibujar se elige el
+# nivel cuyo tamaño de grupo es el mayor que no pasa de las muestras por
+# pixel, así cualquier zoom cuesta O(pixeles visibles) y no O(muestras).
+
+PEAK_BASE = 64
+PEAK_BLOCK = PEAK_BASE * 65536     # frames por bloque al construir (memoria acotada)
+
+class PeakPyramid:
+    def __init__(self, levels, rate, base=PEAK_BASE):
+        self.levels = levels           # [(mins, maxs)] int16, del más fino al más grueso
+        self.rate = rate
+        self.base = base
+
+    @classmethod
+    def build(cls, pcm, rate, base=PEAK_BASE):
+        n = len(pcm)
+        bins = -(-n // base)
+        mins = np.zeros(bins, dtype=np.int16); maxs = np.zeros(bins, dtype=np.int16)
+        for a in range(0, n, PEAK_BLOCK):
+            b = min(n, a + PEAK_BLOCK)
+            blk = np.asarray(pcm[a:b])
+            full = (b - a) // base
+            if full:
+                g = blk[:full * base].reshape(full, -1)       # base frames x 2 canales por fila
+                mins[a // base:a // base + full] = g.min(axis=1); maxs[a // base:a // base + full] = g.max(axis=1)
+            if full * base < b - a:
+                rest = blk[full * base:]
+                mins[a // base + full] = rest.min(); maxs[a // base + full] = rest.max()
+        levels = [(mins, maxs)]
+        while len(mins) > 1:
+            if len(mins) % 2:
+                mins = np.append(mins, mins[-1]); maxs = np.append(maxs, maxs[-1])
+            mins = np.minimum(mins[0::2], mins[1::2]); maxs = np.maximum(maxs[0::2], maxs[1::2])
+            levels.append((mins, maxs))
+        return cls(levels, rate, base)
+
+    @classmethod
+    def load(cls, path, rate):
+        try:
+            with np.load(path) as z:
+                if int(z['rate']) != rate: return None
+                n = int(z['levels'])
+                return cls([(z[f'min{k}'], z[f'max{k}']) for k in range(n)], rate, int(z['base']))
+        except Exception:
+            return None
+
+    def save(self, path):
+        arrays = {'rate': self.rate, 'base': self.base, 'levels': len(self.levels)}
+        for k, (mn, mx) in enumerate(self.levels): arrays[f'min{k}'] = mn; arrays[f'max{k}'] = mx
+        tmp = path + ".part.npz"
+        try:
+            np.savez(tmp, **arrays)
+            os.replace(tmp, path)
+        except OSError as e:
+            logging.warning(f"Could not store waveform peaks: {e}")
+
+    def level_for(self, px_per_sec):
+        spp = self.rate / float(px_per_sec)
+        k = int(np.floor(np.log2(spp / self.base))) if spp >= self.base else 0
+        return min(max(k, 0), len(self.levels) - 1)
+
+    def columns(self, t0, n_px, px_per_sec):
+        """(mins, maxs) de cada columna de pixel desde el instante t0, normalizados a [-1, 1]."""
+        if n_px <= 0 or not len(self.levels[0][0]): return np.zeros(0, np.float32), np.zeros(0, np.float32)
+        k = self.level_for(px_per_sec)
+        mn, mx = self.levels[k]
+        size = self.base << k
+        edges = np.floor((t0 + np.arange(n_px + 1) / float(px_per_sec)) * self.rate / size).astype(np.int64)
+        edges = np.clip(edges, 0, len(mn))
+        lo = np.minimum(edges[:-1], len(mn) - 1)
+        valid = edges[:-1] < len(mn)
+        first, last = lo[0], max(int(edges[-1]), lo[-1] + 1)
+        out_mn = np.minimum.reduceat(mn[first:last], lo - first).astype(np.float32) / 32768.0
+        out_mx = np.maximum.reduceat(mx[first:last], lo - first).astype(np.float32) / 32768.0
+        out_mn[~valid] = 0.0; out_mx[~valid] = 0.0
+        return out_mn, out_mx
+
+# Servicio compartido por todo el proceso
+AUDIO = AudioService()
+
+def get_audio(path):
+    return AUDIO.get(path)
+
+# --- ÍNDICE DE METADATOS (FFPROBE) ---
+# Resolución, duración, fps, rotación, canales y keyframes sin abrir el
+# contenedor con moviepy. Se cachea por ruta+mtime+tamaño (memoria y disco).
+# Si no hay ffprobe (imageio-ffmpeg solo trae ffmpeg) se lee la cabecera que
+# imprime `ffmpeg -i`.
+
+@dataclass
+class MediaInfo:
+    width: int = 0
+    height: int = 0
+    duration: float = 0.0
+    fps: float = 0.0
+    rotation: int = 0              # grados, como los aplica el reproductor
+    audio_channels: int = 0
+    channel_layout: str = ''
+    keyframes: list = field(default_factory=list)   # segundos; vacío hasta pedirlos
+    start_time: float = 0.0        # inicio del contenedor (los keyframes van en ese reloj)
+
+    @property
+    def display_size(self):
+        # Tamaño tal y como se ve (los móviles graban apaisado + rotación 90)
+        if self.rotation % 180: return self.height, self.width
+        return self.width, self.height
+
+    @property
+    def has_video(self): return self.width > 0 and self.height > 0
+
+def _fps(rate):
+    try:
+        num, _, den = rate.partition('/')
+        return float(num) / float(den or 1)
+    except (ValueError, ZeroDivisionError):
+        return 0.0
+
+def _ffprobe_available():
+    try:
+        subprocess.run([FFPROBE_EXE, "-version"], stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL, check=True, **SUBPROCESS_FLAGS)
+        return True
+    except Exception:
+        return False
+
+def _probe_ffprobe(path):
+    cmd = [FFPROBE_EXE, "-v", "error", "-print_format", "json", "-show_format", "-show_streams", path]
+    data = json.loads(subprocess.run(cmd, capture_output=True, check=True, **SUBPROCESS_FLAGS).stdout)
+    fmt = data.get('format', {})
+    info = MediaInfo(duration=float(fmt.get('duration') or 0.0), start_time=float(fmt.get('start_time') or 0.0))
+    for st in data.get('streams', []):
+        if st.get('codec_type') == 'video' and not info.has_video:
+            if st.get('disposition', {}).get('attached_pic'): continue   # carátula de un mp3
+            info.width, info.height = int(st.get('width') or 0), int(st.get('height') or 0)
+            info.fps = _fps(st.get('avg_frame_rate') or '') or _fps(st.get('r_frame_rate') or '')
+            rot = st.get('tags', {}).get('rotate')
+            for sd in st.get('side_data_list', []):
+                if 'rotation' in sd: rot = -float(sd['rotation'])
+            info.rotation = int(float(rot or 0)) % 360
+        elif st.get('codec_type') == 'audio' and not info.audio_channels:
+            info.audio_channels = int(st.get('channels') or 0)
+            info.channel_layout = st.get('channel_layout', '')
+    return info
+
+def _probe_ffmpeg(path):
+    res = subprocess.run([FFMPEG_EXE, "-hide_banner", "-nostdin", "-i", path], capture_output=True, **SUBPROCESS_FLAGS)
+    txt = res.stderr.decode('utf-8', 'replace')
+    info = MediaInfo()
+    m = re.search(r'Duration: (\d+):(\d+):(\d+(?:\.\d+)?)', txt)
+    if m: info.duration = int(m.group(1)) * 3600 + int(m.group(2)) * 60 + float(m.group(3))
+    m = re.search(r'start: (-?\d+(?:\.\d+)?)', txt)
+    if m: info.start_time = float(m.group(1))
+    for line in txt.splitlines():
+        if 'Video:' in line and not info.has_video and 'attached pic' not in line:
+            m = re.search(r', (\d{2,5})x(\d{2,5})', line)
+            if m: info.width, info.height = int(m.group(1)), int(m.group(2))
+            m = re.search(r'([\d.]+) fps', line) or re.search(r'([\d.]+)k? tbr', line)
+            if m: info.fps = float(m.group(1))
+        elif 'Audio:' in line and not info.audio_channels:
+            m = re.search(r'Hz, ([^,]+),', line)
+            if m:
+                info.channel_layout = m.group(1).strip()
+                n = re.match(r'(\d+) channels', info.channel_layout)
+                info.audio_channels = int(n.group(1)) if n else {'mono': 1, 'stereo': 2}.get(info.channel_layout.split('(')[0], 2)
+    m = re.search(r'rotation of (-?[\d.]+) degrees', txt) or re.search(r'rotate\s*:\s*(-?\d+)', txt)
+    if m:
+        rot = float(m.group(1))
+        info.rotation = int(-rot if 'rotation of' in m.group(0) else rot) % 360
+    return info
+
+def _probe_keyframes(path):
+    if _ffprobe_available():
+        # Solo cabeceras de paquetes: no decodifica nada
+        cmd = [FFPROBE_EXE, "-v", "error", "-select_streams", "v:0", "-show_entries", "packet=pts_time,flags", "-of", "csv=p=0", path]
+        out = subprocess.run(cmd, capture_output=True, check=True, **SUBPROCESS_FLAGS).stdout.decode()
+        kf = [float(t) for t, _, flags in (l.partition(',') for l in out.splitlines()) if 'K' in flags and t not in ('', 'N/A')]
+    else:
+        # Decodifica solo los keyframes
+        cmd = [FFMPEG_EXE, "-hide_banner", "-nostdin", "-skip_frame", "nokey", "-i", path, "-map", "0:v:0", "-vf", "showinfo", "-f", "null", "-"]
+        txt = subprocess.run(cmd, capture_output=True, **SUBPROCESS_FLAGS).stderr.decode('utf-8', 'replace')
+        kf = [float(t) for t in re.findall(r'pts_time:\s*(-?[\d.]+)', txt)]
+    return sorted(set(kf))
+
+class MediaIndex:
+    def __init__(self, directory=os.path.join(CACHE_DIR, "probe")):
+        self.dir = directory
+        self._mem = {}
+        self._lock = threading.Lock()
+
+    def _path(self, fp): return os.path.join(self.dir, hashlib.sha1(fp.encode('utf-8')).hexdigest() + ".json")
+
+    def probe(self, path, keyframes=False):
+        fp = AudioService.fingerprint(path)
+        with self._lock: info = self._mem.get(fp)
+        if info is None:
+            try:
+                with open(self._path(fp), encoding='utf-8') as f: info = MediaInfo(**json.load(f))
+            except Exception:
+                info = _probe_ffprobe(path) if _ffprobe_available() else _probe_ffmpeg(path)
+                self._store(fp, info)
+            with self._lock: self._mem[fp] = info
+        if keyframes and not info.keyframes and info.has_video:
+            info.keyframes = _probe_keyframes(path)
+            self._store(fp, info)
+        return info
+
+    def _store(self, fp, info):
+        try:
+            os.makedirs(self.dir, exist_ok=True)
+            tmp = self._path(fp) + ".part"
+            with open(tmp, 'w', encoding='utf-8') as f: json.dump(asdict(info), f)
+            os.replace(tmp, self._path(fp))
+        except OSError as e:
+            logging.warning(f"Probe cache write failed: {e}")
+
+MEDIA_INDEX = MediaIndex()
+
+def probe_media(path, keyframes=False):
+    return MEDIA_INDEX.probe(path, keyframes)
+
+def render_size(path, default=(1920, 1080)):
+    # PlayRes del ASS = resolución real (ya rotada) del video
+    try:
+        info = probe_media(path)
+        if info.has_video: return info.display_size
+    except Exception as e:
+        logging.warning(f"Probe failed ({path}): {e}")
+    return default
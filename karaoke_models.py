@@ -0,0 +1,107 @@
+import gc
+import logging
+import os
+import threading
+from collections import OrderedDict
+
+import whisper
+
+# --- REGISTRO DE MODELOS WHISPER ---
+# Los modelos quedan cargados en memoria (clave: nombre + dispositivo) para que
+# la segunda transcripción de la sesión empiece al instante. Si se supera el
+# presupuesto de memoria se descarga el usado hace más tiempo (LRU).
+
+DEFAULT_BUDGET_MB = int(os.environ.get("SUBMASTER_MODEL_BUDGET_MB", "2048"))
+
+def default_device():
+    try:
+        import torch
+        return "cuda" if torch.cuda.is_available() else "cpu"
+    except Exception:
+        return "cpu"
+
+def model_nbytes(model):
+    # Pesos + buffers; si no es un módulo torch (tests, mocks) cuenta 0
+    try:
+        n = sum(p.numel() * p.element_size() for p in model.parameters())
+        n += sum(b.numel() * b.element_size() for b in model.buffers())
+        return n
+    except Exception:
+        return 0
+
+class ModelRegistry:
+    def __init__(self, budget_mb=DEFAULT_BUDGET_MB):
+        self.budget = int(budget_mb * 1024 * 1024)
+        self._models = OrderedDict()   # (nombre, dispositivo) -> (modelo, bytes)
+        self._lock = threading.Lock()
+        self._key_locks = {}           # evita cargar dos veces el mismo modelo a la vez
+
+    def set_budget(self, budget_mb):
+        with self._lock:
+            self.budget = int(budget_mb * 1024 * 1024)
+            self._evict()
+
+    def get(self, name, device=None):
+        key = (name, device or default_device())
+        with self._lock:
+            if key in self._models:
+                self._models.move_to_end(key)
+                return self._models[key][0]
+            key_lock = self._key_locks.setdefault(key, threading.Lock())
+
+        with key_lock:
+            with self._lock:
+                if key in self._models:
+                    self._models.move_to_end(key)
+                    return self._models[key][0]
+            logging.info(f"Loading Whisper model '{key[0]}' on {key[1]}...")
+            model = whisper.load_model(key[0], device=key[1])
+            with self._lock:
+                self._models[key] = (model, model_nbytes(model))
+                self._evict()
+        return model
+
+    def _evict(self):
+        # Siempre se conserva el último modelo usado aunque supere el presupuesto
+        freed = False
+        while len(self._models) > 1 and self.used_bytes() > self.budget:
+            (name, device), _ = self._models.popitem(last=False)
+            logging.info(f"Evicting Whisper model '{name}' ({device})")
+            freed = True
+        if freed:
+            gc.collect()
+            try:
+                import torch
+                if torch.cuda.is_available(): torch.cuda.empty_cache()
+            except Exception: pass
+
+    def used_bytes(self):
+        return sum(nb for _, nb in self._models.values())
+
+    def loaded(self):
+        with self._lock:
+            return list(self._models.keys())
+
+    def preload(self, name, device=None):
+        # Carga en segundo plano (p.ej. mientras el usuario elige el video)
+        if name not in whisper.available_models(): return None
+        def work():
+            try: self.get(name, device)
+            except Exception as e: logging.warning(f"Model preload failed ({name}): {e}")
+        th = threading.Thread(target=work, daemon=True)
+        th.start()
+        return th
+
+    def clear(self):
+        with self._lock:
+            self._models.clear()
+        gc.collect()
+
+# Registro compartido por todo el proceso
+MODEL_REGISTRY = ModelRegistry()
+
+def get_model(name, device=None):
+    return MODEL_REGISTRY.get(name, device)
+
+def preload_model(name, device=None):
+    return MODEL_REGISTRY.preload(name, device)
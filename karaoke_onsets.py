@@ -0,0 +1,111 @@
+import logging
+import os
+import threading
+
+import numpy as np
+from scipy import fft as sfft
+from scipy.ndimage import maximum_filter1d, uniform_filter1d
+
+from karaoke_media import WHISPER_RATE
+
+# --- ÍNDICE DE ONSETS Y BEATS ---
+# Una pasada por archivo sobre el audio 16 kHz mono ya decodificado: flujo
+# espectral (log-magnitud, solo subidas) por bloques, picos con umbral
+# adaptativo y un tempo global por autocorrelación para la rejilla de beats.
+# Resultado: arrays ordenados en segundos, guardados como .onsets.npz junto
+# al WAV del servicio de audio (misma expulsión LRU).
+
+N_FFT = 1024
+HOP = 160                  # 10 ms a 16 kHz
+BLOCK_FRAMES = 4096        # frames STFT por bloque (~41 s de audio)
+PICK_RADIUS = 3            # máximo local en ±30 ms
+MEAN_RADIUS = 50           # umbral: media móvil de ±0.5 s ...
+DELTA = 0.5                # ... más DELTA desviaciones
+TEMPO_RANGE = (60.0, 200.0)
+CENTER_S = N_FFT / 2 / WHISPER_RATE   # el tiempo de un frame es el centro de su ventana
+
+def onset_envelope(audio, rate=WHISPER_RATE):
+    """Flujo espectral por frame (float32), vectorizado y por bloques."""
+    n = len(audio)
+    frames = max(0, (n - N_FFT) // HOP + 1)
+    env = np.zeros(frames, dtype=np.float32)
+    win = np.hanning(N_FFT).astype(np.float32)
+    prev = None
+    for f0 in range(0, frames, BLOCK_FRAMES):
+        f1 = min(frames, f0 + BLOCK_FRAMES)
+        seg = np.asarray(audio[f0 * HOP:(f1 - 1) * HOP + N_FFT], dtype=np.float32)
+        spec = np.abs(sfft.rfft(np.lib.stride_tricks.sliding_window_view(seg, N_FFT)[::HOP] * win, axis=-1))
+        spec = np.log1p(100.0 * spec)
+        # Frame anterior del bloque previo para que el flujo no salte en los cortes
+        d = np.diff(spec, axis=0, prepend=spec[:1] if prev is None else prev)
+        env[f0:f1] = np.maximum(d, 0.0).sum(axis=1)
+        prev = spec[-1:]
+    return env
+
+def pick_onsets(env, frame_s=HOP / WHISPER_RATE):
+    if not len(env): return np.zeros(0)
+    mean = uniform_filter1d(env, 2 * MEAN_RADIUS + 1, mode='nearest')
+    sq = uniform_filter1d(env * env, 2 * MEAN_RADIUS + 1, mode='nearest')
+    std = np.sqrt(np.maximum(sq - mean * mean, 0.0))
+    peaks = (env == maximum_filter1d(env, 2 * PICK_RADIUS + 1, mode='nearest')) & (env > mean + DELTA * std) & (env > 0)
+    return np.flatnonzero(peaks) * frame_s + CENTER_S
+
+def estimate_beats(env, frame_s=HOP / WHISPER_RATE):
+    """(tempo en BPM, tiempos de beat) con un tempo global por autocorrelación."""
+    if len(env) < 4: return 0.0, np.zeros(0)
+    x = env - env.mean()
+    m = 1 << int(np.ceil(np.log2(2 * len(x))))
+    ac = sfft.irfft(np.abs(sfft.rfft(x, m)) ** 2, m)[:len(x)]
+    lo = int(round(60.0 / TEMPO_RANGE[1] / frame_s)); hi = min(len(ac) - 1, int(round(60.0 / TEMPO_RANGE[0] / frame_s)))
+    if hi <= lo: return 0.0, np.zeros(0)
+    lag = lo + int(np.argmax(ac[lo:hi + 1]))
+    # Fase: la que más energía de onsets recoge en la rejilla
+    phase = int(np.argmax([env[p::lag].sum() for p in range(lag)]))
+    return 60.0 / (lag * frame_s), np.arange(phase, len(env), lag) * frame_s + CENTER_S
+
+class OnsetIndex:
+    def __init__(self, onsets, beats, tempo):
+        self.onsets = np.asarray(onsets, dtype=np.float64)
+        self.beats = np.asarray(beats, dtype=np.float64)
+        self.tempo = float(tempo)
+
+    @classmethod
+    def build(cls, audio):
+        env = onset_envelope(audio)
+        tempo, beats = estimate_beats(env)
+        return cls(pick_onsets(env), beats, tempo)
+
+    @classmethod
+    def load(cls, path):
+        try:
+            with np.load(path) as z: return cls(z['onsets'], z['beats'], float(z['tempo']))
+        except Exception:
+            return None
+
+    def save(self, path):
+        tmp = path + ".part.npz"
+        try:
+            np.savez(tmp, onsets=self.onsets, beats=self.beats, tempo=self.tempo)
+            os.replace(tmp, path)
+        except OSError as e:
+            logging.warning(f"Could not store onset index: {e}")
+
+    def __len__(self): return len(self.onsets)
+
+    def __repr__(self): return f"OnsetIndex({len(self.onsets)} onsets, {len(self.beats)} beats, {self.tempo:.1f} BPM)"
+
+_cache = {}
+_lock = threading.Lock()
+
+def get_onsets(audio):
+    """Índice de onsets de un DecodedAudio: memoria, luego .npz, si no se calcula."""
+    with _lock:
+        if audio.wav_path in _cache: return _cache[audio.wav_path]
+    path = os.path.splitext(audio.wav_path)[0] + ".onsets.npz"
+    idx = OnsetIndex.load(path)
+    if idx is None:
+        logging.info(f"Onset analysis: {os.path.basename(audio.source)}")
+        idx = OnsetIndex.build(audio.whisper_audio())
+        idx.save(path)
+    with _lock: _cache[audio.wav_path] = idx
+    return idx
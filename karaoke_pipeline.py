@@ -0,0 +1,382 @@
+import argparse
+import json
+import logging
+import os
+import re
+import subprocess
+import sys
+import time
+import traceback
+from concurrent.futures import ProcessPoolExecutor, as_completed
+from dataclasses import dataclass, field, asdict
+
+from karaoke_core import (
+    FFMPEG_EXE, SUBPROCESS_FLAGS, EFFECT_KEYS, VISIBLE_KEYS, POSITIONS,
+    refine_word_segments,
+)
+from karaoke_models import get_model
+from karaoke_track import WordTrack, word_columns
+from karaoke_align import align, apply_alignment, normalize_tokens, realign
+import karaoke_ass
+from karaoke_ass import LAYOUTS, AssStyle
+from karaoke_compositor import render_composited, supports as compositor_supports
+from karaoke_cache import TRANSCRIPT_CACHE, TranscriptCache, audio_digest
+from karaoke_media import get_audio, probe_media, render_size
+from karaoke_onsets import get_onsets
+from karaoke_project import PROJECT_EXT, Project
+from karaoke_render import RENDER_CACHE, render_segments, render_single
+from karaoke_transcribe import transcribe_parallel, iter_windows
+
+# --- PIPELINE HEADLESS ---
+# Transcripción, alineación y render sin Tk: lo usa la GUI y el modo batch
+# (python karaoke_generator.py batch <carpeta> --workers N).
+
+VIDEO_EXTS = ('.mp4', '.mov', '.mkv', '.avi', '.webm', '.m4v')
+
+# Por debajo de este % de parecido la letra pegada se considera de otra canción
+MIN_SIMILARITY = 40
+# Re-alineación incremental solo si la letra nueva se parece a la ya alineada
+REALIGN_MIN_SIMILARITY = 60
+
+# 'ass': libass vía el filtro ass de ffmpeg; 'pillow': compositor nativo (karaoke_compositor)
+RENDER_BACKENDS = ('ass', 'pillow')
+
+# --- CONFIGURACIÓN EXPLÍCITA ---
+
+@dataclass
+class TranscribeConfig:
+    model: str = 'small'
+    fp16: bool = False
+    use_cache: bool = True
+    workers: int = 1               # >1: transcripción por trozos en paralelo (audios largos en CPU)
+    chunk_seconds: float = 120.0
+    overlap_seconds: float = 4.0
+    stream_seconds: float = 26.0   # streaming (primer lote rápido): + solape cabe en los 30 s de Whisper
+
+@dataclass
+class StyleConfig:
+    effect: str = 'fx_color'      # una de EFFECT_KEYS
+    font: str = 'Arial'
+    size: int = 60
+    active: str = '#00ff00'
+    inactive: str = '#ffffff'
+    position: str = 'bottom'      # una de POSITIONS
+    visible: str = 'balanced'     # una de VISIBLE_KEYS
+    layout: str = 'word'          # 'word' o 'phrase' (una línea por frase con \k / \t, ver karaoke_ass)
+
+@dataclass
+class RenderConfig:
+    preset: str = 'ultrafast'
+    workers: int = 1               # >1: render por segmentos cortados en keyframes (karaoke_render)
+    cache: bool = False            # guardar segmentos y recodificar solo los que cambian
+    backend: str = 'ass'           # uno de RENDER_BACKENDS
+
+@dataclass
+class JobConfig:
+    transcribe: TranscribeConfig = field(default_factory=TranscribeConfig)
+    style: StyleConfig = field(default_factory=StyleConfig)
+    render: RenderConfig = field(default_factory=RenderConfig)
+    write_video: bool = True
+    force_lyrics: bool = False    # usar la letra aunque el parecido sea < MIN_SIMILARITY
+    snap: bool = False            # ajustar inicios/finales a los onsets del audio
+    project: bool = False         # guardar también el proyecto (.smproj) para abrirlo en el editor
+
+# --- TRANSCRIPCIÓN ---
+
+def check_ffmpeg():
+    try:
+        subprocess.run([FFMPEG_EXE, "-version"], stdout=subprocess.PIPE, stderr=subprocess.PIPE, check=True, **SUBPROCESS_FLAGS)
+    except Exception as e:
+        raise RuntimeError(f"Error crítico: No se puede ejecutar FFmpeg en la ruta: {FFMPEG_EXE}.\nDetalle: {e}")
+
+def load_model(name):
+    # Los modelos quedan residentes en el registro: solo la primera vez es lenta
+    return get_model(name)
+
+def transcribe_options(cfg):
+    # Todo lo que cambia el resultado de Whisper forma parte de la clave de caché
+    return {'word_timestamps': True, 'fp16': cfg.fp16}
+
+def use_chunks(video_path, cfg):
+    return cfg.workers > 1 and probe_media(video_path).duration > cfg.chunk_seconds * 1.5
+
+def transcribe(video_path, cfg, model=None, cache=TRANSCRIPT_CACHE):
+    options = transcribe_options(cfg)
+    chunked = use_chunks(video_path, cfg)
+    key = None
+    if cfg.use_cache and cache is not None:
+        # El troceado puede mover alguna palabra en los cortes: es otra entrada de caché
+        key_opts = dict(options, chunks=[cfg.chunk_seconds, cfg.overlap_seconds]) if chunked else options
+        key = TranscriptCache.key(audio_digest(video_path), cfg.model, key_opts)
+        raw = cache.get(key)
+        if raw is not None:
+            logging.info(f"Transcript cache hit ({len(raw)} words)")
+            return raw
+
+    if chunked:
+        raw = transcribe_parallel(video_path, cfg.model, options, cfg.workers, cfg.chunk_seconds, cfg.overlap_seconds)
+    else:
+        if model is None: model = load_model(cfg.model)
+        # PCM 16 kHz ya decodificado por el servicio de audio (sin ffmpeg interno de Whisper)
+        res = model.transcribe(get_audio(video_path).whisper_audio(), **options)
+        # Palabras crudas de la IA
+        raw = [{'text': w['word'], 'start': float(w['start']), 'end': float(w['end'])} for s in res['segments'] for w in s['words']]
+    if key is not None: cache.put(key, raw)
+    return raw
+
+def iter_transcribe(video_path, cfg, cache=TRANSCRIPT_CACHE):
+    """Como `transcribe` pero entrega las palabras por lotes según se finalizan.
+
+    Cada lote es una lista de palabras crudas en orden; el editor puede
+    empezar a trabajar con el primero mientras se transcribe el resto.
+    """
+    options = transcribe_options(cfg)
+    key = None
+    if cfg.use_cache and cache is not None:
+        key = TranscriptCache.key(audio_digest(video_path), cfg.model, dict(options, chunks=[cfg.stream_seconds, cfg.overlap_seconds]))
+        raw = cache.get(key)
+        if raw is not None:
+            yield raw
+            return
+
+    raw = []
+    for batch in iter_windows(video_path, cfg.model, options, cfg.workers, cfg.stream_seconds, cfg.overlap_seconds):
+        raw.extend(batch)
+        yield batch
+    if key is not None: cache.put(key, raw)
+
+# --- ALINEACIÓN CON LA LETRA ---
+
+def split_lyrics(lyrics):
+    return [w for w in re.split(r'\s+', lyrics) if w]
+
+def lyrics_similarity(raw, tokens):
+    # Porcentaje de parecido (0 a 100) entre lo que escuchó la IA y la letra
+    return align(normalize_tokens(w['text'] for w in raw), normalize_tokens(tokens)).percent
+
+def align_lyrics(raw, tokens):
+    res = align(normalize_tokens(w['text'] for w in raw), normalize_tokens(tokens))
+    return apply_alignment(raw, tokens, res.opcodes)
+
+def resolve_words(raw, lyrics, confirm=None, force_lyrics=False, log=logging.info):
+    """Devuelve (palabras, usó_letra, porcentaje).
+
+    `confirm(porcentaje)` decide qué hacer si la letra se parece poco al audio
+    (la GUI pregunta al usuario); sin callback manda `force_lyrics`.
+    """
+    tokens = split_lyrics(lyrics or "")
+    if not tokens: return refine_word_segments(raw), False, None
+
+    log("Analizando similitud...")
+    # Una sola alineación da el parecido y los tiempos
+    res = align(normalize_tokens(w['text'] for w in raw), normalize_tokens(tokens))
+    porcentaje = res.percent
+    usar_texto_usuario = True
+    if porcentaje < MIN_SIMILARITY:
+        usar_texto_usuario = confirm(porcentaje) if confirm else force_lyrics
+        if not usar_texto_usuario: log("Usando transcripción automática de IA...")
+
+    if usar_texto_usuario: log("Alineando Texto...")
+    words = apply_alignment(raw, tokens, res.opcodes) if usar_texto_usuario else raw
+    return refine_word_segments(words), usar_texto_usuario, porcentaje
+
+def realign_lyrics(words, raw, lyrics, log=logging.info):
+    """Aplica una letra corregida sobre palabras ya alineadas (y quizá editadas).
+
+    Solo se re-alinean los tramos que cambiaron; el resto conserva sus
+    tiempos. Devuelve None si la letra nueva es otra (mejor proceso completo).
+    """
+    tokens = split_lyrics(lyrics or "")
+    if not tokens or not words: return None
+    new_words, changed, porcentaje = realign(words, tokens, raw)
+    if porcentaje < REALIGN_MIN_SIMILARITY: return None
+    log(f"Re-aligned {changed} changed words, kept {len(new_words) - changed}.")
+    return refine_word_segments(new_words)
+
+# --- EXPORTACIÓN ---
+
+def write_srt(filename, words):
+    def ft(s): h,r=divmod(s,3600); m,s=divmod(r,60); return f"{int(h):02}:{int(m):02}:{s:06.3f}".replace('.',',')
+    with open(filename, 'w', encoding='utf-8') as file:
+        for i, (text, start, end) in enumerate(zip(*word_columns(words)), 1):
+            file.write(f"{i}\n{ft(start)} --> {ft(end)}\n{text}\n\n")
+
+def write_ass(filename, words, style, size=(1920, 1080)):
+    # Foto inmutable del estilo + motor de plantillas compiladas (karaoke_ass)
+    karaoke_ass.write_ass(filename, words, AssStyle.from_config(style, size))
+
+# --- RENDER ---
+
+def render_video(video_path, ass_path, out_path, cfg, progress=None, log=logging.info, words=None, style=None):
+    """Quema el .ass y devuelve RenderStats. `progress(RenderProgress)` se llama desde otro hilo.
+
+    Con backend 'pillow' hacen falta `words` y `style` (AssStyle); si el efecto
+    no lo cubre el compositor se usa libass.
+    """
+    stats = None
+    if cfg.backend == 'pillow' and words is not None and style is not None:
+        if compositor_supports(style):
+            stats = render_composited(video_path, words, style, out_path, cfg.preset, cfg.workers, progress=progress, log=log)
+        else: log(f"Compositor: effect {style.effect} or font {style.font} not supported, rendering with libass")
+    if stats is None and (cfg.workers > 1 or cfg.cache):
+        stats = render_segments(video_path, ass_path, out_path, cfg.preset, cfg.workers,
+                                cache=RENDER_CACHE if cfg.cache else None, progress=progress)
+    if stats is None: stats = render_single(video_path, ass_path, out_path, cfg.preset, progress)
+    log(stats.summary())
+    return stats
+
+# --- PROCESO DE UN ARCHIVO ---
+
+def save_project(path, video_path, words, raw, style, lyrics="", model=None):
+    """Proyecto completo: pista, transcript crudo, estilo y el análisis del audio ya hecho."""
+    audio = get_audio(video_path)
+    return Project.create(path, video_path, words, raw, asdict(style), {'lyrics': lyrics, 'model': model},
+                          peaks=audio.peaks(), onsets=get_onsets(audio))
+
+def read_sidecar_lyrics(video_path):
+    # Letra opcional junto al video: cancion.mp4 -> cancion.txt
+    txt = os.path.splitext(video_path)[0] + ".txt"
+    if not os.path.exists(txt): return ""
+    with open(txt, encoding='utf-8') as f: return f.read().strip()
+
+def process_file(video_path, out_dir, job, model=None, log=logging.info):
+    stem = os.path.splitext(os.path.basename(video_path))[0]
+    out = lambda ext: os.path.join(out_dir, stem + ext)
+    summary = {'video': os.path.abspath(video_path), 'config': asdict(job), 'outputs': {}, 'timings': {}}
+    t0 = time.time()
+    try:
+        log(f"[{stem}] Transcribing...")
+        raw = transcribe(video_path, job.transcribe, model)
+        t1 = time.time(); summary['timings']['transcribe'] = round(t1 - t0, 3)
+
+        lyrics = read_sidecar_lyrics(video_path)
+        words, used_lyrics, porcentaje = resolve_words(raw, lyrics, force_lyrics=job.force_lyrics,
+                                                       log=lambda m: log(f"[{stem}] {m}"))
+        words = WordTrack.from_dicts(words)   # columnar para exportar (mucha menos memoria)
+        if job.snap:
+            words = words.snap(get_onsets(get_audio(video_path)).onsets)
+        t2 = time.time(); summary['timings']['align'] = round(t2 - t1, 3)
+        summary.update({'words': len(words), 'raw_words': len(raw), 'used_lyrics': used_lyrics, 'similarity': porcentaje})
+
+        write_srt(out('.srt'), words); summary['outputs']['srt'] = out('.srt')
+        size = render_size(video_path)
+        summary['resolution'] = list(size)
+        write_ass(out('.ass'), words, job.style, size); summary['outputs']['ass'] = out('.ass')
+        if job.project:
+            save_project(out(PROJECT_EXT), video_path, words, raw, job.style, lyrics if used_lyrics else "", job.transcribe.model)
+            summary['outputs']['project'] = out(PROJECT_EXT)
+        if job.write_video:
+            log(f"[{stem}] Rendering...")
+            stats = render_video(video_path, out('.ass'), out('.mp4'), job.render, log=lambda m: log(f"[{stem}] {m}"),
+                                 words=words, style=AssStyle.from_config(job.style, size))
+            summary['outputs']['mp4'] = out('.mp4')
+            summary['render'] = dict(asdict(stats), rtf=round(stats.rtf, 4))
+        summary['timings']['render'] = round(time.time() - t2, 3)
+        summary['status'] = 'ok'
+    except Exception:
+        summary['status'] = 'error'
+        summary['error'] = traceback.format_exc()
+        log(f"[{stem}] Error:\n{summary['error']}")
+    summary['timings']['total'] = round(time.time() - t0, 3)
+
+    with open(out('.json'), 'w', encoding='utf-8') as f:
+        json.dump(summary, f, indent=2, ensure_ascii=False)
+    return summary
+
+# --- BATCH (POOL DE PROCESOS) ---
+
+def _init_worker(model_name, torch_threads):
+    # Cada proceso carga su modelo una sola vez (queda en el registro) y reparte los núcleos
+    logging.basicConfig(level=logging.INFO, format="%(asctime)s - %(message)s")
+    try:
+        import torch
+        torch.set_num_threads(torch_threads)
+    except Exception: pass
+    load_model(model_name)
+
+def _worker_process(video_path, out_dir, job):
+    return process_file(video_path, out_dir, job)
+
+def find_videos(folder):
+    return sorted(os.path.join(folder, f) for f in os.listdir(folder) if f.lower().endswith(VIDEO_EXTS))
+
+def run_batch(folder, out_dir, job, workers=1, log=logging.info):
+    videos = find_videos(folder)
+    os.makedirs(out_dir, exist_ok=True)
+    if not videos:
+        log(f"No videos found in {folder}")
+        return []
+
+    check_ffmpeg()
+    workers = max(1, min(workers, len(videos)))
+    torch_threads = max(1, (os.cpu_count() or 1) // workers)
+    log(f"Batch: {len(videos)} videos, {workers} workers")
+
+    results = []
+    with ProcessPoolExecutor(max_workers=workers, initializer=_init_worker, initargs=(job.transcribe.model, torch_threads)) as pool:
+        futs = {pool.submit(_worker_process, v, out_dir, job): v for v in videos}
+        for fut in as_completed(futs):
+            try: res = fut.result()
+            except Exception:
+                # El worker murió (OOM, etc.): dejar constancia igualmente
+                res = {'video': futs[fut], 'status': 'error', 'error': traceback.format_exc()}
+            results.append(res)
+            log(f"[{len(results)}/{len(videos)}] {os.path.basename(res['video'])}: {res['status']}")
+
+    ok = sum(1 for r in results if r['status'] == 'ok')
+    log(f"Batch done: {ok}/{len(results)} ok.")
+    return results
+
+# --- CLI ---
+
+def build_parser():
+    p = argparse.ArgumentParser(prog="karaoke_generator.py", description="SubMaster AI (headless)")
+    sub = p.add_subparsers(dest='command', required=True)
+
+    b = sub.add_parser('batch', help="Procesar todos los videos de una carpeta")
+    b.add_argument('folder')
+    b.add_argument('--out', help="Carpeta de salida (por defecto <carpeta>/out)")
+    b.add_argument('--workers', type=int, default=1)
+    b.add_argument('--chunk-workers', type=int, default=1, help="Procesos por video para transcribir por trozos (videos largos)")
+    b.add_argument('--model', default='small', choices=['tiny', 'base', 'small'])
+    b.add_argument('--effect', default='fx_color', choices=EFFECT_KEYS)
+    b.add_argument('--font', default='Arial')
+    b.add_argument('--size', type=int, default=60)
+    b.add_argument('--active', default='#00ff00')
+    b.add_argument('--inactive', default='#ffffff')
+    b.add_argument('--position', default='bottom', choices=POSITIONS)
+    b.add_argument('--visible', default='balanced', choices=VISIBLE_KEYS)
+    b.add_argument('--layout', default='word', choices=LAYOUTS, help="'phrase': una línea por frase (clásico, barrido, fade)")
+    b.add_argument('--preset', default='ultrafast')
+    b.add_argument('--render-workers', type=int, default=1, help="Procesos ffmpeg por video para el render por segmentos")
+    b.add_argument('--render-cache', action='store_true', help="Reutilizar los segmentos ya renderizados que no cambian")
+    b.add_argument('--render-backend', default='ass', choices=RENDER_BACKENDS,
+                   help="'pillow': compositor nativo (clásico, caja, barrido, fade); el resto va por libass")
+    b.add_argument('--project', action='store_true', help="Guardar también el proyecto .smproj (se abre en el editor sin re-transcribir)")
+    b.add_argument('--no-video', action='store_true', help="Solo SRT/ASS/JSON, sin render")
+    b.add_argument('--force-lyrics', action='store_true', help="Usar la letra .txt aunque no se parezca al audio")
+    b.add_argument('--snap', action='store_true', help="Ajustar los tiempos de cada palabra a los onsets del audio")
+    return p
+
+def main(argv=None):
+    logging.basicConfig(level=logging.INFO, format="%(asctime)s - %(message)s")
+    args = build_parser().parse_args(argv)
+    if args.command == 'batch':
+        job = JobConfig(
+            transcribe=TranscribeConfig(model=args.model, workers=args.chunk_workers),
+            style=StyleConfig(effect=args.effect, font=args.font, size=args.size, active=args.active,
+                              inactive=args.inactive, position=args.position, visible=args.visible,
+                              layout=args.layout),
+            render=RenderConfig(preset=args.preset, workers=args.render_workers, cache=args.render_cache,
+                                backend=args.render_backend),
+            write_video=not args.no_video,
+            force_lyrics=args.force_lyrics,
+            snap=args.snap,
+            project=args.project,
+        )
+        results = run_batch(args.folder, args.out or os.path.join(args.folder, 'out'), job, workers=args.workers)
+        return 0 if all(r['status'] == 'ok' for r in results) else 1
+    return 2
+
+if __name__ == "__main__":
+    sys.exit(main())
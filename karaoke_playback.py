@@ -0,0 +1,167 @@
+import threading
+import time
+
+import numpy as np
+import pygame
+
+from karaoke_media import PLAYBACK_RATE
+
+# --- MOTOR DE REPRODUCCIÓN PCM ---
+# En vez de pygame.mixer.music (que reabre y re-parsea el WAV en cada load /
+# play(start=...)), el PCM ya decodificado (memmap del servicio de audio o el
+# instrumental en memoria) se trocea en bloques cortos que se encolan en un
+# pygame Channel. Buscar = cambiar el índice del siguiente bloque, así que el
+# seek cuesta lo que tardar en cortar un bloque: unos pocos ms.
+
+BLOCK_S = 0.2          # duración de cada bloque encolado
+POLL_S = 0.005         # intervalo del hilo que alimenta la cola
+SCRUB_INTERVAL = 0.04  # como mucho un scrub cada 40 ms (gana el último)
+SCRUB_S = 0.08         # fragmento audible al arrastrar en pausa
+FADE_S = 0.005         # rampa para que el fragmento no haga "clic"
+
+def ensure_mixer(rate=PLAYBACK_RATE):
+    # Mezclador en el formato del PCM (s16 estéreo) y con buffer corto para baja latencia
+    if pygame.mixer.get_init() != (rate, -16, 2):
+        if pygame.mixer.get_init(): pygame.mixer.quit()
+        pygame.mixer.init(frequency=rate, size=-16, channels=2, buffer=512)
+    pygame.mixer.set_num_channels(max(2, pygame.mixer.get_num_channels()))
+
+def _sound(block):
+    return pygame.mixer.Sound(buffer=np.ascontiguousarray(block, dtype=np.int16).tobytes())
+
+class PcmPlayer:
+    def __init__(self, rate=PLAYBACK_RATE, block_s=BLOCK_S):
+        ensure_mixer(rate)
+        self.rate = rate
+        self.block = int(rate * block_s)
+        self.tracks = {}
+        self.track = None
+        self.playing = False
+        self._chan = pygame.mixer.Channel(0)
+        self._scrub_chan = pygame.mixer.Channel(1)
+        self._lock = threading.RLock()
+        self._pos = 0            # siguiente frame a encolar
+        self._clock_frame = 0    # frame que sonaba en _clock_time
+        self._clock_time = 0.0
+        self._scrub_to = None
+        self._last_scrub = 0.0
+        self._alive = True
+        self._thread = threading.Thread(target=self._feed_loop, daemon=True)
+        self._thread.start()
+
+    # --- pistas ---
+    def add_track(self, name, pcm):
+        # pcm: (frames, 2) int16, en RAM o memmap
+        with self._lock:
+            self.tracks[name] = pcm
+            if self.track is None: self.track = name
+
+    def select(self, name):
+        # Cambiar de original a instrumental sin recargar nada: se sigue donde iba
+        with self._lock:
+            if name == self.track or name not in self.tracks: return
+            t = self.position()
+            self.track = name
+            if self.playing: self._restart(t)
+
+    @property
+    def frames(self): return len(self.tracks[self.track]) if self.track else 0
+
+    @property
+    def duration(self): return self.frames / float(self.rate)
+
+    # --- transporte ---
+    def position(self):
+        with self._lock:
+            if not self.playing: return self._clock_frame / float(self.rate)
+            return self._clock_frame / float(self.rate) + (time.perf_counter() - self._clock_time)
+
+    def play(self, t=None):
+        with self._lock:
+            if t is None: t = self.position()
+            self.playing = True
+            self._restart(t)
+
+    def pause(self):
+        with self._lock:
+            t = self.position()
+            self.playing = False
+            self._chan.stop()
+            self._clock_frame = int(t * self.rate)
+            return t
+
+    def stop(self):
+        with self._lock:
+            self.playing = False
+            self._chan.stop(); self._scrub_chan.stop()
+            self._pos = self._clock_frame = 0
+            self._scrub_to = None
+
+    def seek(self, t):
+        with self._lock:
+            self._scrub_to = None
+            if self.playing: self._restart(t)
+            else: self._clock_frame = self._pos = self._frame(t)
+
+    def scrub(self, t):
+        # Eventos de arrastre: solo se guarda el último, el hilo los aplica con throttle
+        self._scrub_to = t
+
+    def close(self):
+        self._alive = False
+        self._thread.join(timeout=1.0)
+        with self._lock:
+            self.playing = False
+            self._chan.stop(); self._scrub_chan.stop()
+            self.tracks.clear(); self.track = None
+
+    # --- interno ---
+    def _frame(self, t):
+        return min(max(0, int(t * self.rate)), self.frames)
+
+    def _restart(self, t):
+        self._pos = self._frame(t)
+        self._chan.stop()
+        self._clock_frame = self._pos
+        self._clock_time = time.perf_counter()
+        self._enqueue(first=True)
+
+    def _enqueue(self, first=False):
+        pcm = self.tracks[self.track]
+        if self._pos >= len(pcm):
+            return False
+        snd = _sound(pcm[self._pos:self._pos + self.block])
+        if first: self._chan.play(snd)
+        else: self._chan.queue(snd)
+        self._pos += self.block
+        return True
+
+    def _preview(self, t):
+        # Fragmento corto con rampas de entrada/salida
+        pcm = self.tracks[self.track]
+        a = self._frame(t)
+        blk = np.array(pcm[a:a + int(SCRUB_S * self.rate)], dtype=np.float32)
+        if not len(blk): return
+        f = min(int(FADE_S * self.rate), len(blk) // 2)
+        if f:
+            ramp = np.linspace(0.0, 1.0, f, dtype=np.float32)[:, None]
+            blk[:f] *= ramp; blk[-f:] *= ramp[::-1]
+        self._scrub_chan.play(_sound(blk))
+
+    def _feed_loop(self):
+        while self._alive:
+            with self._lock:
+                now = time.perf_counter()
+                if self._scrub_to is not None and self.track and now - self._last_scrub >= SCRUB_INTERVAL:
+                    t, self._scrub_to = self._scrub_to, None
+                    self._last_scrub = now
+                    if self.playing: self._restart(t)
+                    else:
+                        self._clock_frame = self._pos = self._frame(t)
+                        self._preview(t)
+                if self.playing and self._chan.get_queue() is None:
+                    if not self._enqueue() and not self._chan.get_busy():
+                        # Fin de la pista
+                        self._clock_frame = self.frames
+                        self.playing = False
+            time.sleep(POLL_S)
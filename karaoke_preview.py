@@ -0,0 +1,188 @@
+import logging
+import math
+import os
+import subprocess
+import tempfile
+import threading
+from bisect import bisect_left
+from collections import OrderedDict
+
+import numpy as np
+
+from karaoke_core import FFMPEG_EXE, SUBPROCESS_FLAGS
+from karaoke_ass import AssStyle, iter_events, write_ass
+from karaoke_media import probe_media
+from karaoke_render import ass_filter_path
+
+# --- PREVIEW REAL DEL EDITOR ---
+# Frames pequeños del video con el .ass aplicado, sacados por un pipe de
+# ffmpeg (rawvideo RGB) a resolución reducida y sobre una rejilla fija de
+# PREVIEW_FPS, así cada frame tiene una clave entera. Van a una caché LRU;
+# un hilo decodifica por ventanas por delante del cabezal para que el
+# preview siga a la reproducción. Al regenerar el .ass se comparan los
+# eventos viejos con los nuevos y solo se tiran los frames de los tramos
+# que cambiaron.
+
+PREVIEW_HEIGHT = 360
+PREVIEW_FPS = 10
+CACHE_FRAMES = 240        # ~160 MB a 640x360
+PREFETCH_S = 4.0          # por delante del cabezal
+WINDOW_S = 2.0            # segundos por proceso ffmpeg
+
+def changed_ranges(old, new):
+    """Tramos [(t0, t1)] fusionados donde aparece o desaparece algún evento."""
+    old, new = set(old), set(new)
+    spans = sorted((e[0], e[1]) for e in old ^ new)
+    out = []
+    for a, b in spans:
+        if out and a <= out[-1][1]: out[-1] = (out[-1][0], max(out[-1][1], b))
+        else: out.append((a, b))
+    return out
+
+class PreviewEngine:
+    def __init__(self, video_path, height=PREVIEW_HEIGHT, fps=PREVIEW_FPS, capacity=CACHE_FRAMES, on_frame=None):
+        info = probe_media(video_path)
+        self.video_path = video_path
+        self.has_video = info.has_video
+        # PlayRes del .ass = tamaño real del video; libass lo escala al del preview
+        self.size = info.display_size if info.has_video else (1920, 1080)
+        w, h = self.size
+        self.height = min(height, h) if info.has_video else height
+        self.width = max(2, int(round(w * self.height / h / 2)) * 2)
+        self.fps = fps
+        self.duration = info.duration
+        # Último frame de la rejilla que existe (round(duración*fps) ya cae fuera)
+        self.last_key = max(0, math.ceil(self.duration * fps - 1e-6) - 1)
+        self.capacity = capacity
+        self.on_frame = on_frame          # on_frame(k) desde el hilo de trabajo
+        self.frames = OrderedDict()       # índice de frame -> array (alto, ancho, 3) uint8
+        self._empty = set()               # frames que ffmpeg no dio (stream más corto, fallo): no se piden más
+        self.events = []
+        self.ass_path = None
+        self._epoch = 0
+        self._dirty = []                  # [(época, t0, t1)] para descartar decodificaciones en vuelo
+        self._head = 0.0
+        self._tmp = tempfile.mkdtemp(prefix="submaster_preview_")
+        self._cond = threading.Condition()
+        self._alive = True
+        self._thread = threading.Thread(target=self._worker, daemon=True)
+        self._thread.start()
+
+    # --- subtítulos ---
+    def set_subtitles(self, words, style):
+        """Regenera el .ass (`style`: StyleConfig) e invalida solo los frames que cambiaron."""
+        style = AssStyle.from_config(style, self.size)
+        events = list(iter_events(words, style))
+        with self._cond:
+            epoch = self._epoch + 1
+        path = os.path.join(self._tmp, f"preview_{epoch}.ass")
+        write_ass(path, words, style)
+        with self._cond:
+            old_path, first = self.ass_path, self.ass_path is None
+            ranges = [(0.0, float('inf'))] if first else changed_ranges(self.events, events)
+            self.events, self.ass_path, self._epoch = events, path, epoch
+            self._dirty = [d for d in self._dirty if d[0] > epoch - 8] + [(epoch, a, b) for a, b in ranges]
+            for k in [k for k in self.frames if self._in(k / self.fps, ranges)]: del self.frames[k]
+            self._empty.clear()
+            self._cond.notify()
+        # El .ass anterior lo puede estar leyendo un ffmpeg; se borra el de hace dos
+        stale = os.path.join(self._tmp, f"preview_{epoch - 2}.ass")
+        if old_path and os.path.exists(stale):
+            try: os.remove(stale)
+            except OSError: pass
+
+    @staticmethod
+    def _in(t, ranges):
+        # Un frame en t ve los eventos con inicio <= t < fin
+        i = bisect_left(ranges, (t, float('inf'))) - 1
+        return i >= 0 and ranges[i][0] <= t < ranges[i][1]
+
+    # --- consulta ---
+    def key(self, t): return max(0, int(round(t * self.fps)))
+
+    def frame(self, t):
+        """Frame más cercano a t si ya está en caché (no bloquea); si no, se pide."""
+        k = self.key(t)
+        with self._cond:
+            img = self.frames.get(k)
+            if img is not None: self.frames.move_to_end(k)
+            self._head = t
+            self._cond.notify()
+        return img
+
+    def seek(self, t):
+        with self._cond:
+            self._head = t
+            self._cond.notify()
+
+    def close(self):
+        with self._cond:
+            self._alive = False
+            self._cond.notify()
+        self._thread.join(timeout=2.0)
+        for name in os.listdir(self._tmp):
+            try: os.remove(os.path.join(self._tmp, name))
+            except OSError: pass
+        try: os.rmdir(self._tmp)
+        except OSError: pass
+
+    # --- decodificación ---
+    def _missing(self):
+        # Primer frame que falta entre el cabezal y PREFETCH_S por delante
+        k0 = self.key(self._head)
+        k_end = min(self.last_key, k0 + int(PREFETCH_S * self.fps))
+        for k in range(k0, k_end + 1):
+            if k not in self.frames and k not in self._empty: return k
+        return None
+
+    def _worker(self):
+        while True:
+            with self._cond:
+                while self._alive and (self.ass_path is None or self._missing() is None): self._cond.wait()
+                if not self._alive: return
+                k, epoch, ass = self._missing(), self._epoch, self.ass_path
+            n = max(1, min(int(WINDOW_S * self.fps), self.last_key - k + 1))
+            frames = self._decode(k, n, ass)
+            got, jump = 0, False
+            try:
+                for j, img in frames:
+                    got += 1
+                    with self._cond:
+                        if not self._alive: return
+                        # Cambió el .ass mientras se decodificaba: fuera lo que cae en un tramo nuevo
+                        if self._epoch != epoch and any(e > epoch and a <= j / self.fps < b for e, a, b in self._dirty): continue
+                        self.frames[j] = img
+                        self.frames.move_to_end(j)
+                        while len(self.frames) > self.capacity: self.frames.popitem(last=False)
+                        jump = abs(self.key(self._head) - j) > PREFETCH_S * self.fps
+                    if self.on_frame: self.on_frame(j)
+                    if jump: break      # el cabezal saltó lejos: se vuelve a planificar
+                if got < n and not jump:
+                    # Lectura corta: esos frames no van a llegar; sin esto se relanzaría ffmpeg sin parar
+                    with self._cond: self._empty.update(range(k + got, k + n))
+            except Exception as e:
+                logging.warning(f"Preview decode failed: {e}")
+                with self._cond: self._cond.wait(1.0)
+            finally:
+                frames.close()
+
+    def _decode(self, k, n, ass):
+        t0 = k / self.fps
+        # El filtro ass ve el reloj original: setpts suma t0 tras el seek
+        vf = f"setpts=PTS+{t0:.6f}/TB,fps={self.fps}:start_time={t0:.6f},scale={self.width}:{self.height},ass={ass_filter_path(ass)}"
+        if self.has_video:
+            src = ["-ss", f"{t0:.6f}", "-i", self.video_path]
+        else:
+            src = ["-f", "lavfi", "-i", f"color=black:s={self.width}x{self.height}:r={self.fps}"]
+        cmd = [FFMPEG_EXE, "-hide_banner", "-nostdin", "-v", "error"] + src + [
+               "-an", "-vf", vf, "-fps_mode", "passthrough", "-frames:v", str(n), "-f", "rawvideo", "-pix_fmt", "rgb24", "pipe:1"]
+        size = self.width * self.height * 3
+        proc = subprocess.Popen(cmd, stdout=subprocess.PIPE, stderr=subprocess.DEVNULL, **SUBPROCESS_FLAGS)
+        try:
+            for j in range(k, k + n):
+                buf = proc.stdout.read(size)
+                if len(buf) < size: break
+                yield j, np.frombuffer(buf, dtype=np.uint8).reshape(self.height, self.width, 3)
+        finally:
+            # También al abandonar la ventana a medias (salto del cabezal)
+            proc.kill(); proc.stdout.close(); proc.wait()
@@ -0,0 +1,309 @@
+import json
+import logging
+import os
+import struct
+import sys
+import tempfile
+import threading
+import time
+import zlib
+
+import numpy as np
+
+from karaoke_media import PeakPyramid
+from karaoke_onsets import OnsetIndex
+from karaoke_track import WordTrack
+
+# --- ARCHIVO DE PROYECTO (.smproj) ---
+# Un solo archivo binario con todo lo necesario para reabrir sin volver a
+# transcribir ni analizar el audio:
+#
+#   cabecera (32 bytes) | secciones alineadas a 64 | TOC JSON | diario de ediciones
+#
+# Las secciones son arrays crudos (pista de palabras en columnas, transcript
+# crudo de Whisper, pirámide de picos, onsets/beats); el TOC dice dónde está
+# cada una y guarda lo pequeño (video, estilo, letra, modelo). Al abrir se
+# mapea el archivo entero con memmap y los arrays son vistas: abrir no lee
+# los picos de un video de horas, solo lo que luego se dibuja.
+#
+# Guardar no reescribe el archivo: cada cambio se añade al final como un
+# registro del diario (reemplazo de palabras words[lo:hi] -> nuevas, o
+# metadatos), con longitud y CRC para descartar una cola a medio escribir.
+# Al abrir se reproduce el diario; cuando crece demasiado se compacta
+# (archivo nuevo con el estado actual y os.replace). Antes de reemplazar o
+# recortar el archivo se sueltan las vistas del memmap (Windows no deja
+# tocar un archivo mapeado); si aun así falla, se sigue con el diario y no
+# se reintenta hasta que crezca otro COMPACT_MIN_BYTES.
+
+PROJECT_EXT = ".smproj"
+MAGIC = b"SMPROJ\r\n"              # el \r\n delata transferencias en modo texto
+VERSION = 1
+HEADER = struct.Struct('<8sIIQQ')  # magia, versión, flags, offset del TOC, largo del TOC
+RECORD = struct.Struct('<4sII')    # etiqueta, largo, crc32 del JSON
+RECORD_TAG = b"EDIT"
+ALIGN = 64
+COMPACT_MIN_BYTES = 1 << 20        # el diario se compacta al pasar de esto ...
+COMPACT_RATIO = 0.25               # ... y de esta fracción del resto del archivo
+
+def _pack_texts(texts):
+    # UTF-8 separado por NUL: al abrir se decodifica de una vez con split
+    return '\0'.join(t.replace('\0', '') for t in texts).encode('utf-8')
+
+def _unpack_texts(blob, n):
+    if not n: return []
+    texts = bytes(blob).decode('utf-8').split('\0')
+    if len(texts) != n: raise ValueError(f"Proyecto dañado: {len(texts)} textos para {n} palabras")
+    return [sys.intern(t) for t in texts]
+
+def _columns(words):
+    # Textos tal cual (el transcript crudo de Whisper conserva el espacio inicial)
+    if isinstance(words, WordTrack): return words.texts, words.starts, words.ends
+    words = list(words)
+    return ([str(w['text']) for w in words], np.array([w['start'] for w in words], dtype=np.float64),
+            np.array([w['end'] for w in words], dtype=np.float64))
+
+def video_ref(video_path, project_path):
+    st = os.stat(video_path)
+    rel = None
+    try: rel = os.path.relpath(os.path.abspath(video_path), os.path.dirname(os.path.abspath(project_path)))
+    except ValueError: pass     # otra unidad en Windows
+    return {'path': os.path.abspath(video_path), 'rel': rel, 'size': st.st_size, 'mtime_ns': st.st_mtime_ns}
+
+def write_project(path, video, words, raw=(), style=None, meta=None, peaks=None, onsets=None):
+    """Escribe el contenedor completo (atómico). `video` es el dict de video_ref."""
+    texts, starts, ends = _columns(words)
+    raw_texts, raw_starts, raw_ends = _columns(raw)
+    sections = [('words.text', np.frombuffer(_pack_texts(texts), dtype=np.uint8)),
+                ('words.start', starts), ('words.end', ends),
+                ('raw.text', np.frombuffer(_pack_texts(raw_texts), dtype=np.uint8)),
+                ('raw.start', raw_starts), ('raw.end', raw_ends)]
+    toc = {'version': VERSION, 'saved': time.time(), 'video': video, 'style': style, 'meta': meta or {},
+           'words': len(texts), 'raw': len(raw_texts), 'peaks': None, 'onsets': None, 'sections': {}}
+    if peaks is not None:
+        toc['peaks'] = {'rate': peaks.rate, 'base': peaks.base, 'levels': [len(mn) for mn, _ in peaks.levels]}
+        sections += [('peaks.min', np.concatenate([mn for mn, _ in peaks.levels])),
+                     ('peaks.max', np.concatenate([mx for _, mx in peaks.levels]))]
+    if onsets is not None:
+        toc['onsets'] = {'tempo': onsets.tempo}
+        sections += [('onsets.onsets', onsets.onsets), ('onsets.beats', onsets.beats)]
+
+    directory = os.path.dirname(os.path.abspath(path))
+    fd, tmp = tempfile.mkstemp(dir=directory, suffix=".part")
+    try:
+        with os.fdopen(fd, 'wb') as f:
+            f.write(b'\0' * HEADER.size)
+            for name, arr in sections:
+                arr = np.ascontiguousarray(arr)
+                pos = -(-f.tell() // ALIGN) * ALIGN
+                f.write(b'\0' * (pos - f.tell()))
+                f.write(arr.tobytes())
+                toc['sections'][name] = [pos, arr.dtype.str, len(arr)]
+            blob = json.dumps(toc, ensure_ascii=False).encode('utf-8')
+            toc_offset = f.tell()
+            f.write(blob)
+            f.seek(0)
+            f.write(HEADER.pack(MAGIC, VERSION, 0, toc_offset, len(blob)))
+            f.flush(); os.fsync(f.fileno())
+        os.replace(tmp, path)
+    except BaseException:
+        try: os.remove(tmp)
+        except OSError: pass
+        raise
+
+class Project:
+    """Proyecto abierto: estado actual (base mapeada + diario reproducido) y escritura incremental."""
+
+    def __init__(self, path):
+        self.path = path
+        # Guardados desde hilos de trabajo (la compactación reescribe megas): uno a la vez
+        self._lock = threading.RLock()
+        self._load()
+
+    @classmethod
+    def create(cls, path, video_path, words, raw=(), style=None, meta=None, peaks=None, onsets=None):
+        write_project(path, video_ref(video_path, path), words, raw, style, meta, peaks, onsets)
+        return cls(path)
+
+    # --- lectura ---
+    def _load(self):
+        data = np.memmap(self.path, dtype=np.uint8, mode='r')
+        if len(data) < HEADER.size: raise ValueError(f"No es un proyecto de SubMaster: {self.path}")
+        magic, version, _, toc_offset, toc_len = HEADER.unpack(bytes(data[:HEADER.size]))
+        if magic != MAGIC: raise ValueError(f"No es un proyecto de SubMaster: {self.path}")
+        if version > VERSION: raise ValueError(f"Proyecto de una versión más nueva ({version}); actualiza SubMaster")
+        toc = json.loads(bytes(data[toc_offset:toc_offset + toc_len]).decode('utf-8'))
+
+        def section(name):
+            pos, dtype, n = toc['sections'][name]
+            dtype = np.dtype(dtype)
+            if not n: return np.zeros(0, dtype=dtype)
+            return data[pos:pos + n * dtype.itemsize].view(dtype)
+
+        self.toc = toc
+        self.video = toc['video']
+        self.style = toc['style']
+        self.meta = dict(toc['meta'])
+        self.words = WordTrack(_unpack_texts(section('words.text'), toc['words']), section('words.start'), section('words.end'))
+        self._raw = (section('raw.text'), section('raw.start'), section('raw.end'), toc['raw'])
+        self.peaks = None
+        if toc['peaks']:
+            p = toc['peaks']
+            mins, maxs, levels, k = section('peaks.min'), section('peaks.max'), [], 0
+            for n in p['levels']:
+                levels.append((mins[k:k + n], maxs[k:k + n])); k += n
+            self.peaks = PeakPyramid(levels, p['rate'], p['base'])
+        self.onsets = None
+        if toc['onsets']:
+            self.onsets = OnsetIndex(section('onsets.onsets'), section('onsets.beats'), toc['onsets']['tempo'])
+
+        # Diario: registros válidos tras el TOC; una cola rota (corte a medio guardar) se ignora
+        self.base_bytes = toc_offset + toc_len
+        self.retry_at = 0          # tras una compactación fallida: tamaño de diario para reintentar
+        pos, self.records = self.base_bytes, 0
+        while pos + RECORD.size <= len(data):
+            tag, n, crc = RECORD.unpack(bytes(data[pos:pos + RECORD.size]))
+            body = bytes(data[pos + RECORD.size:pos + RECORD.size + n])
+            if tag != RECORD_TAG or len(body) != n or zlib.crc32(body) != crc:
+                logging.warning(f"Project journal: discarding {len(data) - pos} bytes of a partial save")
+                break
+            self._apply(json.loads(body.decode('utf-8')))
+            pos += RECORD.size + n
+            self.records += 1
+        self.end = pos
+        self.torn = pos < len(data)     # cola rota: se recorta al añadir el siguiente registro
+
+    def _detach(self):
+        # Copia en RAM de todo lo que apunta al memmap, para poder reemplazar o recortar el archivo
+        texts, starts, ends, n = self._raw
+        if not isinstance(texts, list): texts = bytes(texts)
+        self._raw = (texts, np.array(starts), np.array(ends), n)
+        self.words = self.words.copy()
+        if self.peaks is not None:
+            self.peaks = PeakPyramid([(np.array(mn), np.array(mx)) for mn, mx in self.peaks.levels], self.peaks.rate, self.peaks.base)
+        if self.onsets is not None:
+            self.onsets = OnsetIndex(np.array(self.onsets.onsets), np.array(self.onsets.beats), self.onsets.tempo)
+
+    def raw(self):
+        """Transcript crudo de Whisper como lista de dicts (se decodifica al pedirlo)."""
+        texts, starts, ends, n = self._raw
+        if not isinstance(texts, list): texts = _unpack_texts(texts, n)
+        return [{'text': t, 'start': s, 'end': e} for t, s, e in zip(texts, starts.tolist(), ends.tolist())]
+
+    def video_path(self):
+        """Ruta del video: la absoluta guardada o, si se movió la carpeta, la relativa al proyecto."""
+        path = self.video['path']
+        if not os.path.exists(path) and self.video.get('rel'):
+            rel = os.path.join(os.path.dirname(os.path.abspath(self.path)), self.video['rel'])
+            if os.path.exists(rel): return rel
+        return path
+
+    def video_changed(self):
+        try: st = os.stat(self.video_path())
+        except OSError: return True
+        return st.st_size != self.video['size'] or st.st_mtime_ns != self.video['mtime_ns']
+
+    # --- diario ---
+    def _apply(self, rec):
+        if rec['op'] == 'words':
+            w, lo, hi = self.words, rec['lo'], rec['hi']
+            texts = w.texts[:lo] + [sys.intern(t) for t in rec['text']] + w.texts[hi:]
+            starts = np.concatenate([w.starts[:lo], np.asarray(rec['start'], dtype=np.float64), w.starts[hi:]])
+            ends = np.concatenate([w.ends[:lo], np.asarray(rec['end'], dtype=np.float64), w.ends[hi:]])
+            self.words = WordTrack(texts, starts, ends)
+        elif rec['op'] == 'raw':
+            # Transcript nuevo (otro modelo) junto con su modelo: nunca uno sin el otro
+            self._raw = (rec['text'], np.asarray(rec['start'], dtype=np.float64), np.asarray(rec['end'], dtype=np.float64), len(rec['text']))
+            self.meta.update(rec.get('meta', {}))
+        elif rec['op'] == 'meta':
+            if 'style' in rec: self.style = rec['style']
+            self.meta.update(rec.get('meta', {}))
+
+    def _append(self, rec):
+        self._apply(rec)
+        body = json.dumps(rec, ensure_ascii=False).encode('utf-8')
+        if self.torn: self._detach()
+        with open(self.path, 'r+b') as f:
+            if self.torn:
+                # Cola rota de un guardado interrumpido; si no se puede recortar se sobrescribe
+                # y lo que sobre detrás lo descarta el CRC al abrir
+                try: f.truncate(self.end)
+                except OSError as e: logging.warning(f"Project journal: could not cut the partial save: {e}")
+                self.torn = False
+            f.seek(self.end)
+            f.write(RECORD.pack(RECORD_TAG, len(body), zlib.crc32(body)) + body)
+            f.flush(); os.fsync(f.fileno())
+        self.end += RECORD.size + len(body)
+        self.records += 1
+
+    def set_words(self, words):
+        """Guarda la pista como un único reemplazo del tramo que cambió. True si había cambios."""
+        with self._lock: return self._set_words(WordTrack.from_dicts(words))
+
+    def _set_words(self, new):
+        old = self.words
+        n = min(len(old), len(new))
+        # Prefijo y sufijo comunes: tiempos vectorizados, textos solo hasta el primer tiempo distinto
+        same = (old.starts[:n] == new.starts[:n]) & (old.ends[:n] == new.ends[:n])
+        a = int(np.argmin(same)) if n and not same.all() else n
+        a = next((i for i in range(a) if old.texts[i] != new.texts[i]), a)
+        m = n - a
+        same = (old.starts[len(old) - m:] == new.starts[len(new) - m:]) & (old.ends[len(old) - m:] == new.ends[len(new) - m:])
+        s = int(np.argmin(same[::-1])) if m and not same.all() else m
+        s = next((i for i in range(s) if old.texts[len(old) - 1 - i] != new.texts[len(new) - 1 - i]), s)
+        hi, new_hi = len(old) - s, len(new) - s
+        if a == hi and a == new_hi: return False
+        self._append({'op': 'words', 'lo': a, 'hi': hi, 'text': new.texts[a:new_hi],
+                      'start': new.starts[a:new_hi].tolist(), 'end': new.ends[a:new_hi].tolist()})
+        self.maybe_compact()
+        return True
+
+    def set_raw(self, raw, **meta):
+        """Sustituye el transcript crudo (y su modelo, en `meta`) con un solo registro."""
+        texts, starts, ends = _columns(raw)
+        with self._lock:
+            self._append({'op': 'raw', 'text': list(texts), 'start': starts.tolist(), 'end': ends.tolist(), 'meta': meta})
+            self.maybe_compact()
+
+    def set_meta(self, style=None, **meta):
+        """Estilo (dict de StyleConfig) y metadatos sueltos (letra, modelo...). True si había cambios."""
+        with self._lock: return self._set_meta(style, meta)
+
+    def _set_meta(self, style, meta):
+        rec = {'op': 'meta'}
+        if style is not None and style != self.style: rec['style'] = style
+        changed = {k: v for k, v in meta.items() if self.meta.get(k) != v}
+        if changed: rec['meta'] = changed
+        if len(rec) == 1: return False
+        self._append(rec)
+        self.maybe_compact()
+        return True
+
+    # --- compactación ---
+    @property
+    def journal_bytes(self): return self.end - self.base_bytes
+
+    def maybe_compact(self):
+        if self.journal_bytes > max(COMPACT_MIN_BYTES, COMPACT_RATIO * self.base_bytes, self.retry_at): self.compact()
+
+    def compact(self, video_path=None, raw=None, peaks=None, onsets=None):
+        """Reescribe el archivo con el estado actual; también para sustituir transcript/análisis.
+
+        Lento en proyectos largos (escribe todo): llamarlo fuera del hilo de Tk.
+        """
+        with self._lock:
+            self._detach()
+            video = video_ref(video_path, self.path) if video_path else self.video
+            raw = self.raw() if raw is None else raw
+            try:
+                write_project(self.path, video, self.words, raw, self.style, self.meta,
+                              self.peaks if peaks is None else peaks, self.onsets if onsets is None else onsets)
+            except OSError as e:
+                # Otra vista viva del archivo (p. ej. los picos en el editor) en Windows: se sigue
+                # con el diario y no se reintenta en cada guardado
+                logging.warning(f"Project compaction failed, keeping the journal: {e}")
+                self.retry_at = self.journal_bytes + COMPACT_MIN_BYTES
+                return False
+            self._load()
+            return True
+
+    def __repr__(self): return f"Project({os.path.basename(self.path)}, {len(self.words)} words, {self.records} edits)"
@@ -0,0 +1,360 @@
+import hashlib
+import logging
+import os
+import subprocess
+import tempfile
+import threading
+import time
+from bisect import bisect_right
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor, as_completed, wait
+from dataclasses import dataclass, replace
+
+from karaoke_core import FFMPEG_EXE, CACHE_DIR, SUBPROCESS_FLAGS
+from karaoke_media import AudioService, probe_media
+
+# --- RENDER POR SEGMENTOS EN PARALELO ---
+# El filtro ass (libass) va en un solo hilo aunque x264 use varios, así que un
+# render largo no aprovecha la máquina. Aquí el video se corta en keyframes
+# (ffprobe, cacheado en MediaIndex), cada segmento se quema con su propio
+# trozo de .ass desplazado a su reloj en un proceso ffmpeg (pool acotado) y
+# al final se unen con el demuxer concat copiando el video, y el audio del
+# original se copia una sola vez.
+#
+# Con caché, cada segmento codificado se guarda con una clave que resume su
+# trozo de .ass (eventos ya desplazados + cabecera con el estilo), la huella
+# del video y los parámetros del corte. Tras retocar una palabra solo cambia
+# la clave de uno o dos segmentos: el resto se reutiliza y solo se vuelve a
+# unir (concat sin recodificar).
+
+SEGMENT_S = 30.0          # duración objetivo de cada segmento
+MIN_PARALLEL_S = 60.0     # por debajo no compensa trocear
+MAX_WORKERS = 8
+DEFAULT_CACHE_MB = int(os.environ.get("SUBMASTER_RENDER_CACHE_MB", "8192"))
+CACHE_VERSION = 1         # subir si cambia cómo se codifica un segmento
+PROGRESS_PERIOD = 0.5     # s entre informes de -progress de ffmpeg
+
+def ass_filter_path(path):
+    # El filtro ass de ffmpeg usa ':' y '\' como separadores: hay que escaparlos
+    return path.replace('\\', '/').replace(':', '\\:').replace("'", "\\'")
+
+def auto_render_workers(duration):
+    if duration < MIN_PARALLEL_S: return 1
+    return max(1, min((os.cpu_count() or 1) // 2, MAX_WORKERS))
+
+def plan_segments(keyframes, duration, target=SEGMENT_S):
+    """[(t0, t1)] que cubren [0, duration) y empiezan siempre en un keyframe.
+
+    Un corte se acepta si el segmento anterior llega a `target` y al final
+    le queda al menos medio `target` (sin colas diminutas).
+    """
+    cuts = [0.0]
+    for k in keyframes:
+        if k - cuts[-1] >= target and duration - k >= target / 2: cuts.append(k)
+    return list(zip(cuts, cuts[1:] + [duration]))
+
+# --- TROZOS DE ASS ---
+
+def _cs(t):
+    h, m, s = t.split(':')
+    sec, _, cs = s.partition('.')
+    return ((int(h) * 60 + int(m)) * 60 + int(sec)) * 100 + int(cs.ljust(2, '0')[:2])
+
+def _fmt_cs(cs):
+    s, c = divmod(cs, 100); m, s = divmod(s, 60); h, m = divmod(m, 60)
+    return f"{h}:{m:02d}:{s:02d}.{c:02d}"
+
+def _dialogues(path):
+    # (inicio cs, fin cs, resto de la línea) de cada Dialogue; la cabecera aparte
+    head, events = [], []
+    with open(path, encoding='utf-8') as f:
+        for line in f:
+            if not line.startswith('Dialogue:'):
+                if not events: head.append(line)
+                continue
+            kind, start, end, rest = line.split(',', 3)
+            events.append((_cs(start), _cs(end), kind, rest))
+    return "".join(head), events
+
+def split_ass(ass_path, segments, out_dir):
+    """Escribe un .ass por segmento con solo sus eventos y los tiempos en su reloj.
+
+    Se trocea el .ass ya escrito (no se regenera) para que cada segmento vea
+    exactamente los mismos eventos, aleatorios incluidos. Un evento que
+    empieza antes del corte se desplaza entero: el segmento usa como origen
+    el inicio más temprano de los suyos (`base`) y el video se adelanta
+    `t0 - base` con setpts, así \\t, \\k y \\fad siguen contando desde el
+    inicio real del evento. Devuelve [(ruta, desfase en s)].
+    """
+    head, events = _dialogues(ass_path)
+    # Cortes en cs hacia abajo: el desfase t0 - base nunca sale negativo
+    starts = [int(t0 * 100) for t0, _ in segments]
+    per_seg = [[] for _ in segments]
+    for ev in events:
+        start, end = ev[0], max(ev[1], ev[0] + 1)
+        j = max(0, bisect_right(starts, start) - 1)
+        while j < len(starts) and starts[j] < end:
+            per_seg[j].append(ev); j += 1
+    out = []
+    for j, evs in enumerate(per_seg):
+        base = min([starts[j]] + [e[0] for e in evs])
+        path = os.path.join(out_dir, f"seg_{j:04d}.ass")
+        with open(path, 'w', encoding='utf-8') as f:
+            f.write(head)
+            f.writelines(f"{kind},{_fmt_cs(s - base)},{_fmt_cs(e - base)},{rest}" for s, e, kind, rest in evs)
+        out.append((path, segments[j][0] - base / 100.0))
+    return out
+
+# --- CACHÉ DE SEGMENTOS ---
+
+class RenderCache:
+    def __init__(self, directory=os.path.join(CACHE_DIR, "render"), max_mb=DEFAULT_CACHE_MB):
+        self.dir = directory
+        self.max_bytes = int(max_mb * 1024 * 1024)
+
+    @staticmethod
+    def key(video_path, t0, t1, fps, shift, preset, ass_path):
+        h = hashlib.sha1(f"{CACHE_VERSION}|{AudioService.fingerprint(video_path)}|{t0:.6f}|{t1:.6f}|{fps}|{shift:.6f}|{preset}|".encode('utf-8'))
+        with open(ass_path, 'rb') as f: h.update(f.read())
+        return h.hexdigest()
+
+    def path(self, key): return os.path.join(self.dir, key + ".mp4")
+
+    def get(self, key):
+        p = self.path(key)
+        if not os.path.exists(p): return None
+        try: os.utime(p)
+        except OSError: pass
+        return p
+
+    def evict(self, keep=()):
+        # LRU por fecha de uso, como el servicio de audio
+        entries = []
+        for name in os.listdir(self.dir):
+            if '.part' in name: continue
+            full = os.path.join(self.dir, name)
+            try: st = os.stat(full)
+            except OSError: continue
+            entries.append((st.st_mtime, st.st_size, full))
+        total = sum(e[1] for e in entries)
+        for _, size, full in sorted(entries):
+            if total <= self.max_bytes: break
+            if full in keep: continue
+            try: os.remove(full)
+            except OSError: pass
+            total -= size
+
+RENDER_CACHE = RenderCache()
+
+# --- PROGRESO ---
+# ffmpeg escribe bloques clave=valor en -progress pipe:1 (frame, fps,
+# out_time_us, total_size, speed...) terminados en progress=continue/end.
+# Con varios procesos a la vez (segmentos) se suman en un RenderProgress
+# común; el callback se llama desde hilos de trabajo, la GUI lo pasa a Tk
+# con after().
+
+@dataclass
+class RenderProgress:
+    total: float              # segundos de video del render
+    done: float = 0.0         # segundos ya codificados (los segmentos de la caché cuentan enteros)
+    frame: int = 0
+    fps: float = 0.0          # suma de los procesos activos
+    speed: float = 0.0        # segundos codificados por segundo de reloj en este render
+    bytes: int = 0
+    elapsed: float = 0.0
+
+    @property
+    def fraction(self): return min(1.0, self.done / self.total) if self.total > 0 else 0.0
+
+    @property
+    def eta(self):
+        if self.speed <= 0: return None
+        return max(0.0, self.total - self.done) / self.speed
+
+@dataclass
+class RenderStats:
+    duration: float           # segundos de video
+    wall: float               # segundos de reloj
+    bytes: int
+    frames: int               # frames codificados en este render
+    segments: int = 1
+    encoded: int = 1          # segmentos codificados (el resto salió de la caché)
+
+    @property
+    def rtf(self): return self.wall / self.duration if self.duration > 0 else 0.0
+
+    def summary(self):
+        seg = f", {self.encoded}/{self.segments} segments encoded" if self.segments > 1 else ""
+        return (f"Render: {self.duration:.1f} s of video in {self.wall:.1f} s (RTF {self.rtf:.2f}, "
+                f"{1 / self.rtf if self.rtf else 0:.1f}x), {self.frames} frames, {self.bytes / 2**20:.1f} MB written{seg}")
+
+def _num(v, cast=float):
+    try: return cast(v)
+    except (TypeError, ValueError): return cast(0)
+
+class _Tracker:
+    # Suma thread-safe del progreso de varios procesos ffmpeg
+    def __init__(self, total, callback=None, done=0.0):
+        self.state = RenderProgress(total, done=done)
+        self.base = done
+        self.parts = {}
+        self.callback = callback
+        self._t0 = time.perf_counter()
+        self._lock = threading.Lock()
+
+    def update(self, key, block, limit=None):
+        t = _num(block.get('out_time_us'), int) / 1e6
+        if limit: t = limit if block.get('progress') == 'end' else min(t, limit)
+        part = {'time': t, 'frame': _num(block.get('frame'), int),
+                'fps': 0.0 if block.get('progress') == 'end' else _num(block.get('fps')),
+                'bytes': _num(block.get('total_size'), int)}
+        with self._lock:
+            self.parts[key] = part
+            p = self.state
+            p.elapsed = time.perf_counter() - self._t0
+            p.done = self.base + sum(v['time'] for v in self.parts.values())
+            p.frame = sum(v['frame'] for v in self.parts.values())
+            p.fps = sum(v['fps'] for v in self.parts.values())
+            p.bytes = sum(v['bytes'] for v in self.parts.values())
+            p.speed = (p.done - self.base) / p.elapsed if p.elapsed > 0 else 0.0
+            snap = replace(p)
+        if self.callback: self.callback(snap)
+
+def run_ffmpeg(cmd, on_block=None, feed=None, cancel=None):
+    """Ejecuta ffmpeg con -progress pipe:1 y pasa cada bloque (dict) a on_block.
+
+    stderr se lee en otro hilo (sin bloqueos) y su final va en el RuntimeError si falla.
+    Con `feed`, feed(stdin) escribe la entrada (pipe:0) desde otro hilo.
+    Con `cancel` (threading.Event) el proceso se mata en el siguiente bloque de progreso.
+    """
+    cmd = [cmd[0], "-progress", "pipe:1", "-nostats", "-stats_period", str(PROGRESS_PERIOD)] + cmd[1:]
+    tail = deque(maxlen=40)
+    errors = []
+    stdin = subprocess.PIPE if feed else subprocess.DEVNULL
+    with subprocess.Popen(cmd, stdin=stdin, stdout=subprocess.PIPE, stderr=subprocess.PIPE, **SUBPROCESS_FLAGS) as proc:
+        reader = threading.Thread(target=lambda: tail.extend(l.decode('utf-8', 'replace') for l in proc.stderr), daemon=True)
+        reader.start()
+        if feed:
+            def writer():
+                try: feed(proc.stdin)
+                except (BrokenPipeError, OSError): pass     # ffmpeg cerró antes (fallo o fin del video)
+                except Exception as e: errors.append(e); proc.kill()
+                finally:
+                    try: proc.stdin.close()
+                    except OSError: pass
+            writer = threading.Thread(target=writer, daemon=True)
+            writer.start()
+        block = {}
+        for raw in proc.stdout:
+            key, _, value = raw.decode('utf-8', 'replace').strip().partition('=')
+            block[key] = value
+            if key == 'progress':
+                if on_block: on_block(block)
+                block = {}
+                if cancel is not None and cancel.is_set(): proc.kill()
+        proc.wait()
+        reader.join()
+        if feed: writer.join()
+    if errors: raise errors[0]
+    if proc.returncode != 0:
+        raise RuntimeError(f"FFmpeg falló al renderizar (código {proc.returncode}):\n{''.join(tail)}")
+
+# --- RENDER ---
+
+def _segment_cmd(video_path, t0, t1, fps, ass_path, shift, out_path, preset, threads, last):
+    vf = f"ass={ass_filter_path(ass_path)}"
+    if shift > 1e-6: vf = f"setpts=PTS+{shift:.6f}/TB,{vf},setpts=PTS-STARTPTS"
+    cmd = [FFMPEG_EXE, "-hide_banner", "-nostdin", "-v", "error", "-ss", f"{t0:.6f}", "-i", video_path]
+    # Medio frame menos: el keyframe que abre el segmento siguiente no se repite
+    if not last: cmd += ["-t", f"{max(0.0, t1 - t0 - 0.5 / (fps or 30.0)):.6f}"]
+    # passthrough: con el setpts desplazado el modo cfr tiraría/duplicaría frames al reajustar la rejilla
+    return cmd + ["-an", "-vf", vf, "-fps_mode", "passthrough", "-c:v", "libx264", "-preset", preset, "-threads", str(threads), "-y", out_path]
+
+def render_single(video_path, ass_path, out_path, preset='ultrafast', progress=None):
+    """Un solo proceso ffmpeg sobre todo el video (el camino de siempre), con progreso."""
+    duration = probe_media(video_path).duration
+    t_start = time.perf_counter()
+    tracker = _Tracker(duration, progress)
+    cmd = [FFMPEG_EXE, "-hide_banner", "-nostdin", "-v", "error", "-i", video_path, "-vf", f"ass={ass_filter_path(ass_path)}",
+           "-c:v", "libx264", "-preset", preset, "-c:a", "copy", "-y", out_path]
+    run_ffmpeg(cmd, lambda b: tracker.update(0, b))
+    return RenderStats(duration, time.perf_counter() - t_start, os.path.getsize(out_path), tracker.state.frame)
+
+def _concat_entry(path):
+    # Comillas simples del formato concat: ' se escribe '\''
+    return "file '" + path.replace("'", "'\\''") + "'\n"
+
+def concat_segments(outputs, segments, video_path, out_path, tmp):
+    """Une los segmentos (concat sin recodificar) y copia el audio del original una vez."""
+    lst = os.path.join(tmp, "segments.txt")
+    with open(lst, 'w', encoding='utf-8') as f:
+        # Duración explícita: con passthrough el último frame de cada trozo no la lleva
+        # y el demuxer colocaría el siguiente segmento un frame antes
+        for seg_out, (t0, t1) in zip(outputs, segments):
+            f.write(_concat_entry(os.path.abspath(seg_out)) + f"duration {t1 - t0:.6f}\n")
+    cmd = [FFMPEG_EXE, "-hide_banner", "-nostdin", "-v", "error", "-f", "concat", "-safe", "0", "-i", lst, "-i", video_path,
+           "-map", "0:v:0", "-map", "1:a:0?", "-c", "copy", "-y", out_path]
+    subprocess.run(cmd, check=True, capture_output=True, **SUBPROCESS_FLAGS)
+
+def render_segments(video_path, ass_path, out_path, preset='ultrafast', workers=None, target=SEGMENT_S, cache=None,
+                    progress=None, log=logging.info):
+    """Render paralelo: keyframes -> segmentos -> pool de ffmpeg -> concat + audio.
+
+    Con `cache` (RenderCache) solo se codifican los segmentos cuyo trozo de
+    .ass, estilo o video cambió desde un render anterior. `progress` recibe
+    un RenderProgress con la suma de todos los procesos.
+    Devuelve RenderStats, o None si el video no se puede trocear (sin
+    keyframes, muy corto); entonces hay que usar render_single.
+    """
+    info = probe_media(video_path, keyframes=True)
+    kfs = [k - info.start_time for k in info.keyframes]
+    segments = plan_segments(kfs, info.duration, target)
+    if len(segments) < 2: return None
+    t_start = time.perf_counter()
+    workers = max(1, min(workers or auto_render_workers(info.duration), len(segments)))
+    threads = max(1, (os.cpu_count() or 1) // workers)
+    if cache is not None: os.makedirs(cache.dir, exist_ok=True)
+
+    with tempfile.TemporaryDirectory(prefix="submaster_render_", dir=os.path.dirname(os.path.abspath(out_path))) as tmp:
+        slices = split_ass(ass_path, segments, tmp)
+        outputs, jobs = [], []
+        for j, ((t0, t1), (seg_ass, shift)) in enumerate(zip(segments, slices)):
+            last = j == len(segments) - 1
+            if cache is None:
+                seg_out = os.path.join(tmp, f"seg_{j:04d}.mp4")
+                jobs.append((seg_out, seg_out, _segment_cmd(video_path, t0, t1, info.fps, seg_ass, shift, seg_out, preset, threads, last), t1 - t0))
+            else:
+                key = cache.key(video_path, t0, t1, info.fps, shift, preset, seg_ass)
+                seg_out = cache.path(key)
+                if cache.get(key) is None:
+                    part = os.path.join(cache.dir, key + ".part.mp4")
+                    jobs.append((part, seg_out, _segment_cmd(video_path, t0, t1, info.fps, seg_ass, shift, part, preset, threads, last), t1 - t0))
+            outputs.append(seg_out)
+        log(f"Render: {len(segments)} segments, {len(jobs)} to encode, {workers} workers")
+
+        tracker = _Tracker(info.duration, progress, done=info.duration - sum(job[3] for job in jobs))
+
+        cancel = threading.Event()
+
+        def run(job):
+            run_ffmpeg(job[2], lambda b: tracker.update(job[0], b, job[3]), cancel=cancel)
+            if job[0] != job[1]: os.replace(job[0], job[1])
+
+        with ThreadPoolExecutor(max_workers=workers) as pool:
+            futures = [pool.submit(run, job) for job in jobs]
+            try:
+                for fut in as_completed(futures): fut.result()
+            except Exception:
+                # Primer fallo: fuera los pendientes, se matan los ffmpeg en marcha y se
+                # espera a que terminen antes de borrar los .part que estaban escribiendo
+                cancel.set()
+                for fut in futures: fut.cancel()
+                wait(futures)
+                for part, final, _, _ in jobs:
+                    if part != final and os.path.exists(part): os.remove(part)
+                raise
+
+        concat_segments(outputs, segments, video_path, out_path, tmp)
+    if cache is not None: cache.evict(keep=set(outputs))
+    return RenderStats(info.duration, time.perf_counter() - t_start, os.path.getsize(out_path),
+                       tracker.state.frame, len(segments), len(jobs))
@@ -0,0 +1,295 @@
+import os
+import sys
+import time
+from bisect import bisect_left, bisect_right
+from collections import deque
+from itertools import accumulate
+
+import numpy as np
+
+# --- PISTA DE PALABRAS COLUMNAR ---
+# En vez de listas de dicts {'text','start','end'} (≈ 400 bytes por palabra),
+# inicios y finales van en arrays float64 contiguos y los textos en una lista
+# de strings internados. Se convierte desde/hacia el formato de dicts para
+# todo el código que aún lo usa.
+
+def _floats(values, n):
+    # Conversión vectorizada; si algo no es número se cae al saneado campo a campo
+    try:
+        arr = np.array(values, dtype=np.float64).reshape(n)
+        if np.isnan(arr).any(): raise ValueError   # None -> nan: mejor el camino lento
+        return arr
+    except (TypeError, ValueError):
+        out = np.empty(n, dtype=np.float64)
+        for k, v in enumerate(values):
+            try: out[k] = float(v)
+            except (TypeError, ValueError): out[k] = 0.0
+        return out
+
+def refine_arrays(starts, ends):
+    """Versión vectorizada de refine_word_segments sobre arrays ya ordenados.
+
+    Mismo resultado que el bucle original: duración mínima 0.2 s y, si una
+    palabra pisa a la siguiente, se recorta a 0.01 s antes; si eso la deja sin
+    duración se le dan 0.1 s y se empuja el inicio de la siguiente. Ese empuje
+    encadenado (raro) es lo único que se resuelve con un bucle, y solo desde
+    la palabra afectada hasta que la cadena se corta.
+    """
+    s = starts.copy()
+    e0 = ends
+    n = len(s)
+    e = np.where(e0 <= s, s + 0.2, e0)
+    if n < 2: return s, e
+
+    over = e[:-1] > s[1:]
+    e[:-1] = np.where(over, s[1:] - 0.01, e[:-1])
+    chain = np.flatnonzero(over & (e[:-1] <= s[:-1]))
+
+    done = -1
+    for i in chain:
+        if i <= done: continue
+        while True:
+            si, ei = s[i], e0[i]
+            if ei <= si: ei = si + 0.2
+            pushed = False
+            if i < n - 1 and ei > s[i + 1]:
+                ei = s[i + 1] - 0.01
+                if ei <= si:
+                    ei = si + 0.1
+                    s[i + 1] = ei + 0.01
+                    pushed = True
+            e[i] = ei
+            if not pushed: break
+            i += 1
+        done = i
+    return s, e
+
+class WordTrack:
+    __slots__ = ('texts', 'starts', 'ends')
+
+    def __init__(self, texts=(), starts=(), ends=()):
+        self.texts = texts if isinstance(texts, list) else list(texts)
+        self.starts = np.asarray(starts, dtype=np.float64)
+        self.ends = np.asarray(ends, dtype=np.float64)
+
+    @classmethod
+    def from_dicts(cls, words):
+        if isinstance(words, WordTrack): return words
+        words = list(words)
+        n = len(words)
+        texts = [sys.intern(str(w['text']).strip()) for w in words]
+        return cls(texts, _floats([w['start'] for w in words], n), _floats([w['end'] for w in words], n))
+
+    def to_dicts(self):
+        return [{'text': t, 'start': s, 'end': e} for t, s, e in zip(self.texts, self.starts.tolist(), self.ends.tolist())]
+
+    def columns(self):
+        # (textos, inicios, finales) como listas Python: lo más rápido para bucles de exportación
+        return self.texts, self.starts.tolist(), self.ends.tolist()
+
+    def __len__(self): return len(self.texts)
+
+    def __getitem__(self, idx):
+        if isinstance(idx, slice):
+            # Vista: los arrays comparten memoria, solo se copia la lista de referencias
+            return WordTrack(self.texts[idx], self.starts[idx], self.ends[idx])
+        return {'text': self.texts[idx], 'start': float(self.starts[idx]), 'end': float(self.ends[idx])}
+
+    def __iter__(self):
+        for t, s, e in zip(self.texts, self.starts.tolist(), self.ends.tolist()):
+            yield {'text': t, 'start': s, 'end': e}
+
+    def copy(self):
+        return WordTrack(list(self.texts), self.starts.copy(), self.ends.copy())
+
+    def refine(self):
+        if not len(self): return WordTrack()
+        order = np.argsort(self.starts, kind='stable')
+        s, e = refine_arrays(self.starts[order], self.ends[order])
+        texts = self.texts
+        return WordTrack([texts[k] for k in order.tolist()], s, e)
+
+    def snap(self, onsets, tol=None):
+        # Inicios y finales al onset más cercano (si está a <= tol); luego se re-refina
+        tol = SNAP_TOLERANCE if tol is None else tol
+        s = snap_times(self.starts, onsets, tol)
+        e = snap_times(self.ends, onsets, tol)
+        e = np.where(e > s, e, np.maximum(self.ends, s + 0.2))
+        return WordTrack(list(self.texts), s, e).refine()
+
+    @property
+    def nbytes(self):
+        return self.starts.nbytes + self.ends.nbytes + sys.getsizeof(self.texts)
+
+    def __repr__(self): return f"WordTrack({len(self)} words)"
+
+# --- AJUSTE A ONSETS ---
+# Con los onsets ordenados, cada instante se ajusta con un searchsorted: un
+# transcript de 10k palabras se ajusta en milisegundos.
+
+SNAP_TOLERANCE = 0.08
+
+def snap_times(times, onsets, tol=SNAP_TOLERANCE):
+    t = np.asarray(times, dtype=np.float64)
+    if not len(onsets) or not len(t): return t.copy()
+    last = len(onsets) - 1
+    k = np.searchsorted(onsets, t)
+    left = onsets[np.clip(k - 1, 0, last)]
+    right = onsets[np.clip(k, 0, last)]
+    near = np.where(t - left <= right - t, left, right)
+    return np.where(np.abs(near - t) <= tol, near, t)
+
+def snap_words(words, onsets, tol=SNAP_TOLERANCE):
+    # Devuelve el mismo tipo que recibe (WordTrack o lista de dicts)
+    track = WordTrack.from_dicts(words).snap(onsets, tol)
+    return track if isinstance(words, WordTrack) else track.to_dicts()
+
+def word_columns(words):
+    # Acepta WordTrack o lista de dicts
+    if isinstance(words, WordTrack): return words.columns()
+    return [w['text'] for w in words], [w['start'] for w in words], [w['end'] for w in words]
+
+# --- ÍNDICE DE INTERVALOS ---
+# Inicios ordenados + máximo acumulado de los finales: con bisect se sabe en
+# O(log n) qué palabras tocan un instante o un rango, aunque alguna se solape.
+# Durante la reproducción secuencial un cursor evita incluso el bisect.
+
+class WordIndex:
+    def __init__(self, words=()):
+        self.rebuild(words)
+
+    def rebuild(self, words):
+        _, starts, ends = word_columns(words)
+        self.starts = [float(s) for s in starts]
+        self.ends = [float(e) for e in ends]
+        self.max_ends = list(accumulate(self.ends, max))
+        self._cur = None
+
+    def splice(self, lo, hi, words=()):
+        # Sustituye las entradas [lo, hi) por `words` sin rehacer el resto
+        _, starts, ends = word_columns(words)
+        m = len(starts)
+        self.starts[lo:hi] = [float(s) for s in starts]
+        self.ends[lo:hi] = [float(e) for e in ends]
+        self.max_ends[lo:hi] = [0.0] * m
+        # El máximo acumulado se rehace solo hasta que vuelve a coincidir con el anterior
+        prev = self.max_ends[lo - 1] if lo else float('-inf')
+        k = lo
+        while k < len(self.ends):
+            v = max(prev, self.ends[k])
+            if k >= lo + m and v == self.max_ends[k]: break
+            self.max_ends[k] = prev = v
+            k += 1
+        self._cur = None
+
+    def __len__(self): return len(self.starts)
+
+    def range(self, t0, t1):
+        """(lo, hi) de las palabras que tocan [t0, t1]."""
+        lo = bisect_left(self.max_ends, t0)
+        return lo, max(lo, bisect_right(self.starts, t1))
+
+    def _first(self, k, t):
+        # k contiene t y ninguna anterior llega a t
+        return self.starts[k] <= t <= self.ends[k] and (k == 0 or self.max_ends[k - 1] < t)
+
+    def at(self, t):
+        """Índice de la primera palabra con inicio <= t <= fin, o None."""
+        cur = self._cur
+        if cur is not None:
+            # Reproducción secuencial: la misma palabra o la siguiente
+            for k in (cur, cur + 1):
+                if k < len(self.starts) and self._first(k, t): return k
+        k = bisect_left(self.max_ends, t)
+        while k < len(self.starts) and self.starts[k] <= t:
+            if self.ends[k] >= t:
+                self._cur = k
+                return k
+            k += 1
+        return None
+
+    def hit(self, t, tol=0.0, parity=None):
+        """Palabra bajo el instante t (± tol) más cercana; `parity` filtra la fila del zig-zag."""
+        lo, hi = self.range(t - tol, t + tol)
+        best, best_d = None, None
+        for k in range(lo, hi):
+            if parity is not None and k % 2 != parity: continue
+            if self.ends[k] < t - tol: continue
+            d = abs((self.starts[k] + self.ends[k]) / 2 - t)
+            if best is None or d < best_d: best, best_d = k, d
+        return best
+
+# --- HISTORIAL DE EDICIÓN POR DELTAS ---
+# Cada cambio se guarda como un reemplazo words[lo:lo+len(old)] -> new (editar,
+# insertar, borrar y re-refinar son casos de lo mismo); su inverso es el
+# reemplazo contrario. La memoria depende del tamaño de los cambios, no de la
+# pista, y tiene un tope: al pasarlo se olvidan los deltas más antiguos.
+
+DEFAULT_HISTORY_MB = float(os.environ.get("SUBMASTER_HISTORY_MB", "32"))
+COALESCE_S = 1.0       # ediciones seguidas de la misma zona en menos de esto = un solo paso
+
+def _words_bytes(words):
+    return sum(sys.getsizeof(w) + len(w['text']) for w in words)
+
+class Delta:
+    __slots__ = ('lo', 'old', 'new', 'kind', 'stamp', 'nbytes')
+
+    def __init__(self, lo, old, new, kind=None):
+        self.lo, self.old, self.new, self.kind = lo, old, new, kind
+        self.stamp = time.monotonic()
+        self.nbytes = _words_bytes(old) + _words_bytes(new) + 64
+
+class EditHistory:
+    def __init__(self, max_mb=DEFAULT_HISTORY_MB, coalesce_s=COALESCE_S):
+        self.max_bytes = int(max_mb * 1024 * 1024)
+        self.coalesce_s = coalesce_s
+        self.done = deque()
+        self.undone = []
+        self.nbytes = 0
+
+    def record(self, lo, old, new, kind=None):
+        """Registra words[lo:lo+len(old)] -> new. Las palabras no deben mutarse después."""
+        # Lo que no cambió en los bordes no hace falta guardarlo
+        a, n = 0, min(len(old), len(new))
+        while a < n and old[a] == new[a]: a += 1
+        i, j = len(old), len(new)
+        while i > a and j > a and old[i - 1] == new[j - 1]: i -= 1; j -= 1
+        lo, old, new = lo + a, list(old[a:i]), list(new[a:j])
+        if not old and not new: return
+
+        for d in self.undone: self.nbytes -= d.nbytes
+        self.undone.clear()
+        last = self.done[-1] if self.done else None
+        if (kind is not None and last is not None and last.kind == kind and time.monotonic() - last.stamp < self.coalesce_s
+                and last.lo <= lo and lo + len(old) <= last.lo + len(last.new)):
+            # Composición con el delta anterior: mismo "antes", "después" actualizado
+            off = lo - last.lo
+            d = Delta(last.lo, last.old, last.new[:off] + new + last.new[off + len(old):], kind)
+            self.done[-1] = d
+            self.nbytes += d.nbytes - last.nbytes
+        else:
+            d = Delta(lo, old, new, kind)
+            self.done.append(d)
+            self.nbytes += d.nbytes
+        while self.nbytes > self.max_bytes and len(self.done) > 1:
+            self.nbytes -= self.done.popleft().nbytes
+
+    def undo(self):
+        """(lo, hi, palabras) a aplicar para deshacer, o None."""
+        if not self.done: return None
+        d = self.done.pop()
+        self.undone.append(d)
+        return d.lo, d.lo + len(d.new), d.old
+
+    def redo(self):
+        if not self.undone: return None
+        d = self.undone.pop()
+        d.stamp = float('-inf')    # lo rehecho no se funde con la siguiente edición
+        self.done.append(d)
+        return d.lo, d.lo + len(d.old), d.new
+
+    def can_undo(self): return bool(self.done)
+    def can_redo(self): return bool(self.undone)
+
+    def clear(self):
+        self.done.clear(); self.undone.clear(); self.nbytes = 0
@@ -0,0 +1,141 @@
+import logging
+import os
+from concurrent.futures import ProcessPoolExecutor
+
+import numpy as np
+
+from karaoke_core import normalize_text
+from karaoke_media import WHISPER_RATE, get_audio
+from karaoke_models import get_model, default_device
+
+# --- TRANSCRIPCIÓN POR TROZOS EN PARALELO ---
+# Para entradas largas en CPU: el audio se corta en puntos de poca energía,
+# cada ventana (con solape) va a un proceso con su propio modelo y luego se
+# juntan las palabras corrigiendo el offset y quitando duplicados del solape.
+
+FRAME_S = 0.1          # resolución del análisis de energía
+SEARCH_S = 10.0        # margen alrededor del corte nominal para buscar silencio
+WHISPER_WINDOW_S = 30.0   # entrada fija de Whisper: una ventana más larga cuesta dos pasadas
+AUTO_MIN_DURATION = 600.0
+
+def auto_workers(duration):
+    # Solo compensa en CPU y con audios largos; cada proceso carga su modelo
+    if duration < AUTO_MIN_DURATION or default_device() != "cpu": return 1
+    return max(1, min((os.cpu_count() or 1) // 2, 4))
+
+def frame_energy(audio, rate=WHISPER_RATE, frame_s=FRAME_S, block_frames=6000):
+    # RMS por frame, vectorizado y por bloques para no duplicar audios largos en RAM
+    hop = int(rate * frame_s)
+    n = len(audio) // hop
+    out = np.empty(n, dtype=np.float32)
+    for b in range(0, n, block_frames):
+        e = min(n, b + block_frames)
+        blk = np.asarray(audio[b*hop:e*hop], dtype=np.float32).reshape(-1, hop)
+        out[b:e] = np.sqrt(np.mean(blk * blk, axis=1))
+    return out
+
+def plan_chunks(audio, chunk_s=120.0, overlap_s=4.0, rate=WHISPER_RATE, max_core_s=None):
+    """Lista de (inicio, fin, núcleo_ini, núcleo_fin) en muestras.
+
+    Los cortes caen en el frame más silencioso cerca de cada múltiplo de
+    `chunk_s`; cada ventana se extiende `overlap_s/2` a cada lado del núcleo.
+    Con `max_core_s` ningún núcleo (tampoco el último) pasa de esa duración.
+    """
+    total = len(audio)
+    if total <= int((chunk_s + overlap_s) * rate):
+        return [(0, total, 0, total)]
+
+    energy = frame_energy(audio, rate)
+    hop = int(rate * FRAME_S)
+    cuts = [0]
+    nominal = chunk_s
+    while nominal < total / rate - chunk_s / 2 or (max_core_s and (total - cuts[-1]) / rate > max_core_s):
+        lo = max(int((nominal - SEARCH_S) / FRAME_S), int(cuts[-1] / hop) + 1)
+        hi = min(int((nominal + SEARCH_S) / FRAME_S), len(energy))
+        if max_core_s: hi = min(hi, int(cuts[-1] / hop + max_core_s / FRAME_S))
+        if hi <= lo: break
+        c = (lo + int(np.argmin(energy[lo:hi]))) * hop
+        cuts.append(c)
+        nominal = c / rate + chunk_s
+    cuts.append(total)
+
+    half = int(overlap_s * rate / 2)
+    return [(max(0, a - half), min(total, b + half), a, b) for a, b in zip(cuts[:-1], cuts[1:])]
+
+def core_words(item, words, rate=WHISPER_RATE):
+    # Cada palabra se queda en el trozo cuyo núcleo contiene su punto medio
+    start, end, core_a, core_b = item
+    a, b = core_a / rate, core_b / rate
+    kept = [w for w in words if a <= (w['start'] + w['end']) / 2 < b or (core_b == end and (w['start'] + w['end']) / 2 >= b)]
+    kept.sort(key=lambda w: w['start'])
+    return kept
+
+def dedupe_words(words, prev=None):
+    # Lo que aún se repite justo en el corte (misma palabra, tiempos casi iguales) sobra
+    out = []
+    for w in words:
+        last = out[-1] if out else prev
+        if last and normalize_text(last['text']) == normalize_text(w['text']) and abs(last['start'] - w['start']) < 0.3:
+            continue
+        out.append(w)
+    return out
+
+def merge_chunk_words(chunks, rate=WHISPER_RATE):
+    # `chunks` = [(plan, palabras)] en orden; palabras ya en tiempo absoluto
+    out = []
+    for item, words in chunks:
+        out.extend(dedupe_words(core_words(item, words, rate), out[-1] if out else None))
+    return out
+
+# --- WORKERS ---
+
+def _init_chunk_worker(model_name, torch_threads):
+    try:
+        import torch
+        torch.set_num_threads(torch_threads)
+    except Exception: pass
+    get_model(model_name, "cpu")
+
+def transcribe_window(pcm16k_path, start, end, model_name, options, device=None):
+    # Lee solo su ventana del memmap compartido; devuelve tiempos absolutos
+    audio = np.memmap(pcm16k_path, dtype=np.float32, mode='r')
+    clip = np.array(audio[start:end], dtype=np.float32)
+    res = get_model(model_name, device).transcribe(clip, **options)
+    off = start / WHISPER_RATE
+    return [{'text': w['word'], 'start': float(w['start']) + off, 'end': float(w['end']) + off}
+            for s in res['segments'] for w in s['words']]
+
+def iter_windows(video_path, model_name, options, workers=1, chunk_s=120.0, overlap_s=4.0, log=logging.info):
+    """Genera las palabras finalizadas ventana a ventana, en orden.
+
+    Con `workers > 1` las ventanas se transcriben en paralelo pero se
+    entregan en orden; cada lote ya está deduplicado contra el anterior.
+    """
+    audio = get_audio(video_path)
+    # Ventanas cortas (streaming): núcleo + solape dentro de los 30 s de Whisper
+    max_core = WHISPER_WINDOW_S - overlap_s if chunk_s + overlap_s <= WHISPER_WINDOW_S else None
+    plan = plan_chunks(audio.whisper_audio(), chunk_s, overlap_s, max_core_s=max_core)
+    workers = max(1, min(workers, len(plan)))
+    log(f"Chunked transcription: {len(plan)} windows on {workers} processes")
+    prev = None
+    if workers == 1:
+        for item in plan:
+            batch = dedupe_words(core_words(item, transcribe_window(audio.pcm16k_path, item[0], item[1], model_name, options)), prev)
+            if batch: prev = batch[-1]
+            yield batch
+        return
+
+    torch_threads = max(1, (os.cpu_count() or 1) // workers)
+    pool = ProcessPoolExecutor(max_workers=workers, initializer=_init_chunk_worker, initargs=(model_name, torch_threads))
+    try:
+        futs = [pool.submit(transcribe_window, audio.pcm16k_path, a, b, model_name, options, "cpu") for a, b, _, _ in plan]
+        for item, fut in zip(plan, futs):
+            batch = dedupe_words(core_words(item, fut.result()), prev)
+            if batch: prev = batch[-1]
+            yield batch
+    finally:
+        # Si el consumidor corta el stream no esperamos a las ventanas pendientes
+        pool.shutdown(wait=False, cancel_futures=True)
+
+def transcribe_parallel(video_path, model_name, options, workers, chunk_s=120.0, overlap_s=4.0, log=logging.info):
+    return [w for batch in iter_windows(video_path, model_name, options, workers, chunk_s, overlap_s, log) for w in batch]
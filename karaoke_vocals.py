@@ -0,0 +1,105 @@
+import os
+
+import numpy as np
+from scipy import fft as sfft
+
+from karaoke_media import PLAYBACK_RATE
+
+# --- QUITAR VOZ POR BLOQUES ---
+# Todo se procesa por bloques sobre el memmap del servicio de audio y se
+# escribe a otro memmap, así la memoria no depende de la duración del tema.
+# Normalización en dos pasadas: la primera busca el pico, la segunda escala.
+#   'phase'    : (L - R) / 2, lo de siempre (mono, barato).
+#   'spectral' : STFT y se atenúan los bins "centrados" (L y R iguales en
+#                módulo y fase) en la banda de voz, con overlap-add. Conserva
+#                el estéreo y los graves centrados (bombo, bajo).
+
+MODES = ('phase', 'spectral')
+BLOCK = 1 << 18        # frames por bloque (~6 s a 44.1 kHz)
+N_FFT = 2048
+HOP = N_FFT // 4
+VOCAL_BAND = (120.0, 8000.0)
+MASK_POWER = 8         # más alto = solo se quita lo muy centrado
+
+def _window():
+    # Raíz de Hann periódica en análisis y síntesis: con HOP = N/4 la suma solapada vale 2
+    return np.sqrt(0.5 - 0.5 * np.cos(2 * np.pi * np.arange(N_FFT) / N_FFT)).astype(np.float32)
+
+def phase_block(pcm, a, b):
+    blk = np.asarray(pcm[a:b], dtype=np.float32)
+    inst = (blk[:, 0] - blk[:, 1]) / 2
+    return np.column_stack((inst, inst))
+
+def spectral_block(pcm, a, b, rate=PLAYBACK_RATE, win=None):
+    """Salida exacta de [a, b): se leen los frames STFT que la tocan, con ceros fuera del audio."""
+    if win is None: win = _window()
+    n = len(pcm)
+    k0, k1 = (a - N_FFT) // HOP + 1, (b - 1) // HOP
+    s0, s1 = k0 * HOP, k1 * HOP + N_FFT
+    seg = np.zeros((s1 - s0, 2), dtype=np.float32)
+    lo, hi = max(0, s0), min(n, s1)
+    seg[lo - s0:hi - s0] = pcm[lo:hi]
+
+    frames = np.lib.stride_tricks.sliding_window_view(seg, N_FFT, axis=0)[::HOP]   # (F, 2, N)
+    X = sfft.rfft(frames * win, axis=-1)
+    L, R = X[:, 0], X[:, 1]
+    # Índice de "centrado": 1 si L y R coinciden en módulo y fase
+    psi = 2 * np.real(L * np.conj(R)) / (np.abs(L) ** 2 + np.abs(R) ** 2 + 1e-9)
+    mask = 1.0 - np.clip(psi, 0.0, 1.0) ** MASK_POWER
+    freqs = np.fft.rfftfreq(N_FFT, 1.0 / rate)
+    mask[:, (freqs < VOCAL_BAND[0]) | (freqs > VOCAL_BAND[1])] = 1.0
+    Y = sfft.irfft(X * mask[:, None, :].astype(np.float32), n=N_FFT, axis=-1) * win      # (F, 2, N)
+
+    # Overlap-add: los frames de igual fase (k mod 4) no se solapan y van de una vez
+    out = np.zeros((s1 - s0, 2), dtype=np.float32)
+    per = N_FFT // HOP
+    for r in range(per):
+        part = Y[r::per]
+        if not len(part): continue
+        flat = part.transpose(0, 2, 1).reshape(-1, 2)
+        out[r * HOP:r * HOP + len(flat)] += flat
+    return out[a - s0:b - s0] / 2.0
+
+def iter_blocks(pcm, mode='phase', rate=PLAYBACK_RATE, block=BLOCK):
+    if mode not in MODES: raise ValueError(f"Modo de quitar voz desconocido: {mode}")
+    win = _window()
+    for a in range(0, len(pcm), block):
+        b = min(len(pcm), a + block)
+        yield a, b, (phase_block(pcm, a, b) if mode == 'phase' else spectral_block(pcm, a, b, rate, win))
+
+def remove_vocals(pcm, out_path, mode='phase', rate=PLAYBACK_RATE, block=BLOCK, headroom=0.8, progress=None):
+    """Escribe el instrumental en `out_path` (int16 estéreo crudo) y lo devuelve como memmap.
+
+    `pcm` es (frames, 2) int16, normalmente el memmap del servicio de audio.
+    `progress(hechos, total)` se llama tras cada bloque de cada pasada.
+    """
+    n = len(pcm)
+    out = np.memmap(out_path, dtype=np.int16, mode='w+', shape=(max(n, 1), 2))
+    if n == 0: return out
+    # El modo espectral es caro: la primera pasada guarda el resultado en float32 para no recalcularlo
+    tmp_path = out_path + ".f32"
+    tmp = np.memmap(tmp_path, dtype=np.float32, mode='w+', shape=(n, 2)) if mode == 'spectral' else None
+    try:
+        peak = 0.0
+        for a, b, y in iter_blocks(pcm, mode, rate, block):
+            peak = max(peak, float(np.max(np.abs(y))))
+            if tmp is not None: tmp[a:b] = y
+            if progress: progress(b, 2 * n)
+        scale = headroom * 32767 / peak if peak > 0 else 0.0
+
+        if tmp is not None:
+            for a in range(0, n, block):
+                b = min(n, a + block)
+                out[a:b] = np.round(tmp[a:b] * scale)
+                if progress: progress(n + b, 2 * n)
+        else:
+            for a, b, y in iter_blocks(pcm, mode, rate, block):
+                out[a:b] = np.round(y * scale)
+                if progress: progress(n + b, 2 * n)
+        out.flush()
+    finally:
+        if tmp is not None:
+            del tmp
+            try: os.remove(tmp_path)
+            except OSError: pass
+    return out